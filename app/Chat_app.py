@@ -11,6 +11,7 @@ import streamlit as st
 import requests
 import re
 from datetime import datetime
+from app.client import get_default_client
 from app.metrics_page import display_metrics
 
 # Set the page configuration for the Streamlit app.
@@ -119,16 +120,7 @@ def initialize_session():
 def send_feedback(score, user_query, assistant_answer):
     """Sends user feedback to the backend API."""
     try:
-        # Make a POST request to the feedback endpoint.
-        requests.post(
-            "http://127.0.0.1:5000/api/feedback",
-            json={
-                "user_id": st.session_state.user_id,
-                "query": user_query,
-                "answer": assistant_answer,
-                "score": score
-            }
-        )
+        get_default_client().feedback(st.session_state.user_id, user_query, assistant_answer, score)
         # Record that feedback was submitted for this answer to hide the buttons.
         st.session_state.feedback_submitted_for.add(assistant_answer)
         st.toast("Thank you for your feedback!", icon="🎉")
@@ -282,42 +274,31 @@ if st.session_state.current_page == "chat":
                 answer = "Sorry, an error occurred." # Default error message.
                 try:
                     # Determine which API endpoint to call based on the request.
+                    client = get_default_client()
                     if topic_id_from_button:
                         # This request came from a recommendation button click.
-                        response = requests.post(
-                            "http://127.0.0.1:5000/api/get_document", 
-                            json={"topic": topic_id_from_button, "user_id": st.session_state.user_id}
-                        )
+                        data = client.get_document(topic_id_from_button, st.session_state.user_id, include_recommendations=True)
                     else:
                         # This is a standard query from the text input.
-                        response = requests.post(
-                            "http://127.0.0.1:5000/api/query",
-                            json={
-                                "query": prompt,
-                                "chat_history": [msg for msg in current_chat["messages"] if msg['role'] in ['user', 'assistant']][:-1],
-                                "user_id": st.session_state.user_id
-                            }
+                        data = client.query(
+                            prompt,
+                            st.session_state.user_id,
+                            chat_history=[msg for msg in current_chat["messages"] if msg['role'] in ['user', 'assistant']][:-1],
+                            include_recommendations=True
                         )
                     
-                    response.raise_for_status() # Raise an exception for HTTP error codes (4xx or 5xx).
-                    data = response.json()
                     answer = data.get("answer", "Failed to get a valid response.")
                     
-                    # After getting the answer, fetch new recommendations based on the updated user profile.
-                    rec_response = requests.post(
-                        "http://127.0.0.1:5000/api/recommendations",
-                        json={"user_id": st.session_state.user_id}
-                    )
-                    if rec_response.status_code == 200:
-                         current_chat["recommendations"] = rec_response.json().get("recommendations", [])
-                    else:
-                        st.warning("Could not fetch new recommendations.")
-                        current_chat["recommendations"] = []
+                    # The backend returns recommendations computed from the profile it just updated.
+                    current_chat["recommendations"] = data.get("recommendations", [])
 
                 # Handle potential exceptions gracefully.
                 except requests.exceptions.ConnectionError:
                     answer = "Error: Could not connect to the backend server. Is `app/main.py` running?"
                     st.error(answer)
+                except requests.exceptions.Timeout:
+                    answer = "Error: The backend took too long to respond. Please try again."
+                    st.error(answer)
                 except requests.exceptions.HTTPError as e:
                     answer = f"An API error occurred: {e.response.status_code} - {e.response.text}"
                     st.error(answer)
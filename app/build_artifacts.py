@@ -0,0 +1,63 @@
+# app/build_artifacts.py
+# One-time build step for multi-worker deployments. It ingests the knowledge
+# base and writes the FAISS index, parent docstore and document-embedding matrix
+# to the cache directory, where every worker memory-maps them read-only.
+# It can also pack them into a versioned bundle, or install one instead of
+# building (see app/bundles.py). With RAG_ARTIFACT_BUNDLE set and no other
+# option, the bundle is installed.
+#
+# Usage:
+#   python -m app.build_artifacts [--force]
+#   python -m app.build_artifacts --tenant NAME [--tenant NAME ...] | --all-tenants
+#   python -m app.build_artifacts --bundle PATH [--summaries] [--force]
+#   python -m app.build_artifacts --install-bundle PATH
+
+import argparse
+import json
+import os
+
+from dotenv import load_dotenv
+
+from . import bundles, config, rag_pipeline, tenants
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the shared serving artifacts for the RAG backend.")
+    parser.add_argument("--force", action="store_true", help="Rebuild even if a complete set of artifacts already exists.")
+    parser.add_argument("--tenant", action="append", default=[], help=f"Build a tenant's knowledge base from '{config.TENANTS_DIR}' instead of the default one.")
+    parser.add_argument("--all-tenants", action="store_true", help="Build every tenant's knowledge base.")
+    parser.add_argument("--bundle", metavar="PATH", nargs="?", const="", help="Also pack the artifacts into a versioned bundle (default name: artifacts-<version>.tar.gz).")
+    parser.add_argument("--summaries", action="store_true", help="With --bundle, precompute every document summary (one LLM call per new topic) and include them.")
+    parser.add_argument("--install-bundle", metavar="PATH", help="Verify a bundle and install it into the cache directory instead of building.")
+    args = parser.parse_args()
+
+    load_dotenv()
+    install_path = args.install_bundle or (config.ARTIFACT_BUNDLE_PATH if not (args.bundle is not None or args.tenant or args.all_tenants) else None)
+    if install_path:
+        try:
+            manifest = bundles.install_bundle(install_path)
+        except bundles.BundleError as e:
+            print(f"❌ {e}")
+            raise SystemExit(1)
+        print(json.dumps(manifest, indent=4))
+        return
+    if args.bundle is not None:
+        bundles.create_bundle(args.bundle or None, summaries=args.summaries, force=args.force)
+        return
+    if not (args.tenant or args.all_tenants):
+        manifest = rag_pipeline.build_artifacts(force=args.force)
+        print(f"Artifacts in '{config.CACHE_DIR}':")
+        print(json.dumps(manifest, indent=4))
+        return
+
+    shared_embeddings, _ = rag_pipeline._create_models()
+    for name in (tenants.TenantRegistry().available() if args.all_tenants else args.tenant):
+        knowledge_base_path, cache_dir = tenants.tenant_paths(name)
+        if not tenants.TENANT_NAME_PATTERN.match(name) or not os.path.isdir(knowledge_base_path):
+            parser.error(f"No knowledge base for tenant '{name}' in '{config.TENANTS_DIR}'.")
+        embeddings = tenants.make_embeddings(shared_embeddings.base, cache_dir)
+        manifest = rag_pipeline.build_artifacts(embeddings, force=args.force, cache_dir=cache_dir, knowledge_base_path=knowledge_base_path)
+        print(f"Artifacts for tenant '{name}' in '{cache_dir}':")
+        print(json.dumps(manifest, indent=4))
+
+if __name__ == "__main__":
+    main()
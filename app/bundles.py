@@ -0,0 +1,258 @@
+# app/bundles.py
+# Versioned, self-verifying bundles of the serving artifacts, so a new node
+# can start from a prebuilt artifact instead of re-ingesting the knowledge
+# base (no embedding calls) or trusting whatever is in its app/cache.
+#
+# A bundle is a .tar.gz holding the FAISS index, the parent docstore, the
+# document-embedding matrix and its index, the build manifest and, optionally,
+# precomputed /api/get_document summaries. It also holds a `bundle.json` with
+# the index version (a hash of the knowledge base and the index settings),
+# a hash of those settings and the sha256 of every file. Installing checks all
+# of them before anything in the cache directory is replaced.
+#
+# Usage:
+#   python -m app.build_artifacts --bundle artifacts.tar.gz [--summaries]
+#   python -m app.build_artifacts --install-bundle artifacts.tar.gz
+#   RAG_ARTIFACT_BUNDLE=artifacts.tar.gz python -m flask --app app/main run
+
+import hashlib
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+from datetime import datetime
+
+from . import config, rag_pipeline
+
+BUNDLE_FORMAT = 1
+BUNDLE_INDEX_NAME = "bundle.json"
+
+class BundleError(Exception):
+    """A bundle that is corrupt, or built for another version or other settings than this server's."""
+
+# ==============================================================================
+# --- 1. PRECOMPUTED SUMMARIES ---
+# ==============================================================================
+def load_summaries(index_version: str) -> dict:
+    """Precomputed summaries by topic, if the file on disk belongs to this index version."""
+    if not os.path.exists(config.SUMMARIES_PATH):
+        return {}
+    with open(config.SUMMARIES_PATH, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return data["summaries"] if data.get("index_version") == index_version else {}
+
+def precompute_summaries(llm, index_version: str) -> dict:
+    """
+    Generates the /api/get_document summary of every topic (reusing summaries
+    already on disk for this version) and saves them next to the artifacts.
+    """
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_core.prompts import ChatPromptTemplate
+
+    with rag_pipeline.build_lock:
+        store = rag_pipeline._load_docstore()
+        _, _, documents = rag_pipeline._load_doc_embeddings(store)
+    summaries = load_summaries(index_version)
+    missing = [topic for topic in documents if topic not in summaries]
+    chain = ChatPromptTemplate.from_template(rag_pipeline.SUMMARY_PROMPT) | llm | StrOutputParser()
+    for i, topic in enumerate(missing):
+        summaries[topic] = chain.invoke({"topic": topic, "context": documents[topic]["content"]})
+        print(f"  Summarized {i + 1}/{len(missing)}: {topic}")
+    data = {"index_version": index_version, "summaries": {topic: summaries[topic] for topic in documents}}
+    rag_pipeline._atomic_write(config.SUMMARIES_PATH, 'w', lambda f: json.dump(data, f, indent=4))
+    print(f"✅ {len(documents)} summaries available ({len(missing)} generated).")
+    return data["summaries"]
+
+# ==============================================================================
+# --- 2. BUILDING BUNDLES ---
+# ==============================================================================
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _settings(manifest: dict) -> dict:
+    return {"embedding_model": manifest["embedding_model"], "chunking": manifest["chunking"]}
+
+def _current_settings() -> dict:
+    return {
+        "embedding_model": rag_pipeline.embedding_model_name(),
+        "chunking": {
+            "parent_chunk_size": config.PARENT_CHUNK_SIZE, "parent_chunk_overlap": config.PARENT_CHUNK_OVERLAP,
+            "child_chunk_size": config.CHILD_CHUNK_SIZE, "child_chunk_overlap": config.CHILD_CHUNK_OVERLAP,
+        },
+    }
+
+def _settings_hash(settings: dict) -> str:
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+def _artifact_files(index_version: str) -> list:
+    """Paths of the artifacts that go into a bundle, relative to the cache directory."""
+    paths = [os.path.join(config.VECTORSTORE_PATH, 'index.faiss'), os.path.join(config.VECTORSTORE_PATH, 'index.pkl'),
+             config.DOCSTORE_PATH, config.DOC_EMBEDDINGS_PATH, config.DOC_EMBEDDINGS_INDEX_PATH]
+    if load_summaries(index_version):
+        paths.append(config.SUMMARIES_PATH)
+    # The manifest marks a complete install, so it's always the last file.
+    paths.append(config.ARTIFACT_MANIFEST_PATH)
+    return [os.path.relpath(path, config.CACHE_DIR).replace(os.sep, '/') for path in paths]
+
+def create_bundle(output_path: str = None, summaries: bool = False, force: bool = False) -> dict:
+    """
+    Builds the artifacts if they are missing or stale, optionally precomputes
+    summaries, and writes the bundle. Returns its `bundle.json`.
+    """
+    manifest = rag_pipeline.build_artifacts(force=force)
+    index_version = manifest["index_version"]
+    if summaries:
+        _, llm = rag_pipeline._create_models()
+        precompute_summaries(llm, index_version)
+    output_path = output_path or f"artifacts-{index_version}.tar.gz"
+
+    with rag_pipeline.build_lock:
+        names = _artifact_files(index_version)
+        files = {}
+        for name in names:
+            path = os.path.join(config.CACHE_DIR, name)
+            files[name] = {"sha256": _sha256(path), "bytes": os.path.getsize(path)}
+        bundle_index = {
+            "format": BUNDLE_FORMAT, "index_version": index_version,
+            "settings_hash": _settings_hash(_settings(manifest)), "created_at": datetime.utcnow().isoformat(),
+            "manifest": manifest, "files": files,
+        }
+        index_path = os.path.join(tempfile.mkdtemp(), BUNDLE_INDEX_NAME)
+        with open(index_path, 'w', encoding='utf-8') as f:
+            json.dump(bundle_index, f, indent=4)
+        tmp_path = f"{output_path}.{os.getpid()}.tmp"
+        with tarfile.open(tmp_path, "w:gz") as tar:
+            # bundle.json comes first, so installs can check it before reading anything else.
+            tar.add(index_path, arcname=BUNDLE_INDEX_NAME)
+            for name in names:
+                tar.add(os.path.join(config.CACHE_DIR, name), arcname=name)
+        os.replace(tmp_path, output_path)
+        shutil.rmtree(os.path.dirname(index_path), ignore_errors=True)
+    size_mb = os.path.getsize(output_path) / 1e6
+    print(f"✅ Wrote bundle '{output_path}' (version {index_version}, {len(files)} files, {size_mb:.1f} MB).")
+    return bundle_index
+
+# ==============================================================================
+# --- 3. INSTALLING BUNDLES ---
+# ==============================================================================
+def _expected_version():
+    """The version this server may serve: the pinned one, else the local knowledge base's, else any."""
+    if config.ARTIFACT_BUNDLE_VERSION:
+        return config.ARTIFACT_BUNDLE_VERSION
+    if os.path.isdir(config.KNOWLEDGE_BASE_PATH) and any(name.endswith('.md') for _, _, names in os.walk(config.KNOWLEDGE_BASE_PATH) for name in names):
+        return rag_pipeline.compute_index_version()
+    return None
+
+def check_compatible(bundle_index: dict):
+    """Raises BundleError unless the bundle matches this server's format, settings and expected version."""
+    if bundle_index.get("format") != BUNDLE_FORMAT:
+        raise BundleError(f"Unsupported bundle format {bundle_index.get('format')!r} (expected {BUNDLE_FORMAT}).")
+    settings = _current_settings()
+    if _settings_hash(_settings(bundle_index["manifest"])) != bundle_index["settings_hash"]:
+        raise BundleError("The bundle's settings hash doesn't match its manifest.")
+    if _settings(bundle_index["manifest"]) != settings:
+        raise BundleError(f"The bundle was built with other index settings ({_settings(bundle_index['manifest'])}) than this server's ({settings}).")
+    expected = _expected_version()
+    if expected is not None and bundle_index["index_version"] != expected:
+        hint = "" if config.ARTIFACT_BUNDLE_VERSION else " Rebuild the bundle, or set RAG_ARTIFACT_BUNDLE_VERSION to serve it anyway."
+        raise BundleError(f"The bundle is version {bundle_index['index_version']}, but this server expects {expected}.{hint}")
+
+def _installed_matches(bundle_index: dict) -> bool:
+    for name, meta in bundle_index["files"].items():
+        path = os.path.join(config.CACHE_DIR, name)
+        if not os.path.exists(path) or os.path.getsize(path) != meta["bytes"] or _sha256(path) != meta["sha256"]:
+            return False
+    return True
+
+def _safe_name(name: str) -> bool:
+    parts = name.split('/')
+    return not os.path.isabs(name) and '..' not in parts and '' not in parts
+
+def _open_bundle(bundle_path: str):
+    """Opens a bundle and reads its bundle.json. Returns `(tar, bundle_index)`."""
+    try:
+        tar = tarfile.open(bundle_path, "r:*")
+    except (OSError, tarfile.TarError) as e:
+        raise BundleError(f"Can't open bundle '{bundle_path}': {e}")
+    try:
+        bundle_index = json.load(tar.extractfile(BUNDLE_INDEX_NAME))
+    except (KeyError, ValueError, tarfile.TarError) as e:
+        tar.close()
+        raise BundleError(f"'{bundle_path}' has no valid {BUNDLE_INDEX_NAME}: {e}")
+    return tar, bundle_index
+
+def ensure_installed(bundle_path: str) -> dict:
+    """
+    Startup check for server processes. bundle.json comes first in the archive,
+    so reading it is cheap. If the installed manifest is the bundle's (same
+    index version and build), nothing is hashed: the full verification already
+    ran in `install_bundle` (the gunicorn pre-start step or the CLI). Otherwise
+    the bundle is installed. Returns the installed manifest.
+    """
+    tar, bundle_index = _open_bundle(bundle_path)
+    tar.close()
+    check_compatible(bundle_index)
+    if os.path.exists(config.ARTIFACT_MANIFEST_PATH):
+        installed = rag_pipeline._load_manifest()
+        expected = bundle_index["manifest"]
+        if (installed["index_version"], installed.get("built_at")) == (expected["index_version"], expected.get("built_at")):
+            return installed
+    return install_bundle(bundle_path)
+
+def install_bundle(bundle_path: str) -> dict:
+    """
+    Verifies a bundle and installs it into the cache directory, replacing the
+    artifacts there (the manifest last). A no-op when the same files are
+    already installed. Raises BundleError, leaving the cache untouched, if
+    anything doesn't check out. Returns the installed manifest.
+    """
+    started = time.perf_counter()
+    tar, bundle_index = _open_bundle(bundle_path)
+    with tar:
+        check_compatible(bundle_index)
+        names = list(bundle_index["files"])
+        if not names or names[-1] != "manifest.json" or not all(_safe_name(name) for name in names):
+            raise BundleError(f"'{bundle_path}' lists unexpected files: {names}")
+
+        with rag_pipeline.build_lock:
+            if _installed_matches(bundle_index):
+                print(f"✅ Bundle version {bundle_index['index_version']} is already installed in '{config.CACHE_DIR}'.")
+                return bundle_index["manifest"]
+
+            os.makedirs(config.CACHE_DIR, exist_ok=True)
+            staging_dir = tempfile.mkdtemp(prefix=".bundle-", dir=config.CACHE_DIR)
+            try:
+                for name in names:
+                    meta = bundle_index["files"][name]
+                    try:
+                        member = tar.getmember(name)
+                    except KeyError:
+                        raise BundleError(f"'{bundle_path}' is missing '{name}'.")
+                    if not member.isfile():
+                        raise BundleError(f"'{name}' in '{bundle_path}' is not a regular file.")
+                    target = os.path.join(staging_dir, name)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    digest, size = hashlib.sha256(), 0
+                    with tar.extractfile(member) as source, open(target, 'wb') as f:
+                        for chunk in iter(lambda: source.read(1 << 20), b''):
+                            digest.update(chunk)
+                            size += len(chunk)
+                            f.write(chunk)
+                    if digest.hexdigest() != meta["sha256"] or size != meta["bytes"]:
+                        raise BundleError(f"'{name}' in '{bundle_path}' failed its integrity check.")
+                # Everything checked out: move the files into place, the manifest last.
+                for name in names:
+                    target = os.path.join(config.CACHE_DIR, name)
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    os.replace(os.path.join(staging_dir, name), target)
+            finally:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+    print(f"✅ Installed bundle version {bundle_index['index_version']} into '{config.CACHE_DIR}' "
+          f"in {round((time.perf_counter() - started) * 1000)} ms.")
+    return bundle_index["manifest"]
@@ -0,0 +1,246 @@
+# app/client.py
+# Python client for the Flask backend, shared by the Streamlit UI, the metrics
+# page and the evaluation script. It keeps one connection-pooled session per
+# client, applies timeouts to every call and retries with exponential backoff
+# when the backend answers 503 (pipeline still initializing) or 429.
+
+import asyncio
+import functools
+import json
+from typing import Any, Dict, Iterator, List, Optional, TypedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import config
+
+# ==============================================================================
+# --- 1. RESPONSE TYPES ---
+# ==============================================================================
+class Recommendation(TypedDict):
+    topic_id: str
+    title: str
+    explanation: str
+
+class Usage(TypedDict):
+    latency_ms: int
+    input_tokens: int
+    output_tokens: int
+    total_tokens: int
+    cost: float
+
+class AnswerResponse(TypedDict, total=False):
+    answer: str
+    sources: List[str]
+    recommendations: List[Recommendation]
+    usage: Usage
+    degraded: List[str]
+
+class BatchResult(TypedDict, total=False):
+    index: int
+    question: str
+    answer: str
+    sources: List[str]
+    usage: Usage
+    retrieval_cache: Dict[str, Any]
+    error: str
+
+class BatchResponse(TypedDict):
+    results: List[BatchResult]
+    summary: Dict[str, Any]
+
+class ChatMessage(TypedDict):
+    role: str
+    content: str
+
+class ProfileUpdate(TypedDict, total=False):
+    query: str
+    topics: List[str]
+
+class ReplayStep(TypedDict):
+    query: str
+    recommendations: List[Recommendation]
+
+class ProfileUpdateResponse(TypedDict, total=False):
+    user_id: str
+    applied: int
+    recommendations: List[Recommendation]
+    steps: List[ReplayStep]
+
+# ==============================================================================
+# --- 2. SYNCHRONOUS CLIENT ---
+# ==============================================================================
+class BackendClient:
+    """
+    Thread-safe client over a persistent `requests.Session`. HTTP errors are
+    raised as `requests.exceptions.HTTPError` once the retries are exhausted.
+    """
+    RETRY_STATUSES = (429, 503)
+
+    def __init__(self, base_url: Optional[str] = None, connect_timeout: Optional[float] = None,
+                 read_timeout: Optional[float] = None, max_retries: Optional[int] = None,
+                 backoff_factor: Optional[float] = None, pool_size: Optional[int] = None):
+        self.base_url = (base_url or config.API_BASE_URL).rstrip('/')
+        self.timeout = (
+            connect_timeout if connect_timeout is not None else config.API_CONNECT_TIMEOUT_SECONDS,
+            read_timeout if read_timeout is not None else config.API_READ_TIMEOUT_SECONDS,
+        )
+        max_retries = config.API_MAX_RETRIES if max_retries is None else max_retries
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            # A read timeout or dropped response means the backend may already have done the
+            # work (LLM call, profile update, log row), so it is raised instead of retried.
+            read=False,
+            status=max_retries,
+            status_forcelist=self.RETRY_STATUSES,
+            # The backend rejects requests with 429/503 before doing any work, so POSTs are
+            # safe to retry on those statuses and on connect failures only.
+            allowed_methods=frozenset({"GET", "POST"}),
+            backoff_factor=config.API_RETRY_BACKOFF_SECONDS if backoff_factor is None else backoff_factor,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        pool_size = pool_size or config.API_POOL_SIZE
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # Health probes must see a 503 immediately instead of retrying through it.
+        self._probe_session = requests.Session()
+
+    def _post(self, path: str, payload: Dict[str, Any], timeout=None) -> Dict[str, Any]:
+        response = self.session.post(f"{self.base_url}{path}", json=payload, timeout=timeout or self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def health(self, timeout=None) -> Dict[str, Any]:
+        """Returns the startup report. A 503 here means "not ready yet", so it isn't retried or raised."""
+        response = self._probe_session.get(f"{self.base_url}/api/health", timeout=timeout or self.timeout)
+        return response.json()
+
+    def query(self, query: str, user_id: str, chat_history: Optional[List[ChatMessage]] = None,
+              include_recommendations: bool = False, deadline_ms: Optional[int] = None, no_cache: bool = False,
+              timeout=None) -> AnswerResponse:
+        """
+        `deadline_ms` asks the backend to answer (possibly degraded) within that time.
+        `no_cache` bypasses the backend's answer cache (for evaluation and load tests).
+        """
+        payload = {
+            "query": query, "user_id": user_id, "chat_history": chat_history or [],
+            "include_recommendations": include_recommendations,
+        }
+        if deadline_ms is not None:
+            payload["deadline_ms"] = deadline_ms
+        if no_cache:
+            payload["no_cache"] = True
+        return self._post("/api/query", payload, timeout)
+
+    def query_batch(self, questions: List[str], user_id: str = "batch", timeout=None) -> BatchResponse:
+        return self._post("/api/query/batch", {"questions": questions, "user_id": user_id}, timeout)
+
+    def iter_query_batch(self, questions: List[str], user_id: str = "batch", timeout=None) -> Iterator[Dict[str, Any]]:
+        """Streams batch results as they complete; the last item is `{"summary": ...}`."""
+        with self.session.post(f"{self.base_url}/api/query/batch", stream=True, timeout=timeout or self.timeout,
+                               json={"questions": questions, "user_id": user_id, "stream": True}) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+    def get_document(self, topic: str, user_id: str, include_recommendations: bool = False, no_cache: bool = False,
+                     timeout=None) -> AnswerResponse:
+        payload = {"topic": topic, "user_id": user_id, "include_recommendations": include_recommendations}
+        if no_cache:
+            payload["no_cache"] = True
+        return self._post("/api/get_document", payload, timeout)
+
+    def recommendations(self, user_id: str, timeout=None) -> List[Recommendation]:
+        return self._post("/api/recommendations", {"user_id": user_id}, timeout).get("recommendations", [])
+
+    def update_profile(self, user_id: str, query: str, topics: Optional[List[str]] = None,
+                       include_recommendations: bool = False, timeout=None) -> ProfileUpdateResponse:
+        return self._post("/api/profile/update", {
+            "user_id": user_id, "query": query, "topics": topics or [],
+            "include_recommendations": include_recommendations,
+        }, timeout)
+
+    def replay_profile(self, user_id: str, queries: List[ProfileUpdate], reset: bool = False,
+                       include_recommendations: bool = False, timeout=None) -> ProfileUpdateResponse:
+        return self._post("/api/profile/replay", {
+            "user_id": user_id, "queries": queries, "reset": reset,
+            "include_recommendations": include_recommendations,
+        }, timeout)
+
+    def feedback(self, user_id: str, query: str, answer: str, score: int, timeout=None) -> Dict[str, Any]:
+        return self._post("/api/feedback", {"user_id": user_id, "query": query, "answer": answer, "score": score}, timeout)
+
+    def close(self):
+        self.session.close()
+        self._probe_session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+@functools.lru_cache(maxsize=None)
+def get_default_client() -> BackendClient:
+    """Process-wide client for the configured backend, so callers share one connection pool."""
+    return BackendClient()
+
+# ==============================================================================
+# --- 3. ASYNC CLIENT ---
+# ==============================================================================
+class AsyncBackendClient:
+    """
+    asyncio variant for concurrent fan-out. Calls run on worker threads over the
+    pooled synchronous client, at most `max_concurrency` at a time, so it needs
+    no extra HTTP dependency and shares the same retry and timeout policy.
+    """
+    def __init__(self, client: Optional[BackendClient] = None, max_concurrency: int = 4, **client_kwargs):
+        self._owns_client = client is None
+        self.client = client or BackendClient(pool_size=max(max_concurrency, config.API_POOL_SIZE), **client_kwargs)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _call(self, method, *args, **kwargs):
+        async with self._semaphore:
+            return await asyncio.to_thread(method, *args, **kwargs)
+
+    async def health(self, **kwargs) -> Dict[str, Any]:
+        return await self._call(self.client.health, **kwargs)
+
+    async def query(self, query: str, user_id: str, **kwargs) -> AnswerResponse:
+        return await self._call(self.client.query, query, user_id, **kwargs)
+
+    async def query_batch(self, questions: List[str], **kwargs) -> BatchResponse:
+        return await self._call(self.client.query_batch, questions, **kwargs)
+
+    async def get_document(self, topic: str, user_id: str, **kwargs) -> AnswerResponse:
+        return await self._call(self.client.get_document, topic, user_id, **kwargs)
+
+    async def recommendations(self, user_id: str, **kwargs) -> List[Recommendation]:
+        return await self._call(self.client.recommendations, user_id, **kwargs)
+
+    async def update_profile(self, user_id: str, query: str, **kwargs) -> ProfileUpdateResponse:
+        return await self._call(self.client.update_profile, user_id, query, **kwargs)
+
+    async def replay_profile(self, user_id: str, queries: List[ProfileUpdate], **kwargs) -> ProfileUpdateResponse:
+        return await self._call(self.client.replay_profile, user_id, queries, **kwargs)
+
+    async def feedback(self, user_id: str, query: str, answer: str, score: int, **kwargs) -> Dict[str, Any]:
+        return await self._call(self.client.feedback, user_id, query, answer, score, **kwargs)
+
+    async def close(self):
+        if self._owns_client:
+            self.client.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+        return False
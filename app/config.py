@@ -17,12 +17,91 @@ FEEDBACK_LOGS_PATH = os.path.join(PROJECT_ROOT, 'feedback_logs.jsonl')
 FEW_SHOT_EXAMPLES_PATH = os.path.join(BASE_DIR, 'data', 'evaluation', 'few_shot_examples.json')
 SYSTEM_PROMPT_PATH = os.path.join(BASE_DIR, 'prompt')
 
+PROFILES_DIR = os.path.join(PROJECT_ROOT, 'profiles')
 
+# --- Shared Serving Artifacts ---
+# Written once by `python -m app.build_artifacts` (or on first start in
+# single-process mode) and memory-mapped read-only by every worker process.
+DOC_EMBEDDINGS_PATH = os.path.join(CACHE_DIR, 'doc_embeddings.npy')
+DOC_EMBEDDINGS_INDEX_PATH = os.path.join(CACHE_DIR, 'doc_embeddings_index.json')
+ARTIFACT_MANIFEST_PATH = os.path.join(CACHE_DIR, 'manifest.json')
+BUILD_LOCK_PATH = os.path.join(CACHE_DIR, 'build.lock')
+FILE_LOCK_PATH = os.path.join(BASE_DIR, 'data', 'file_io.lock')
+
+# When enabled, workers never build or re-embed anything at startup: they only
+# load the prebuilt artifacts and fail fast if they are missing.
+SHARED_ARTIFACTS_MODE = os.getenv("RAG_SHARED_ARTIFACTS", "0") == "1"
+
+# --- Artifact Bundles ---
+# `python -m app.build_artifacts --bundle PATH` packs the serving artifacts (and
+# precomputed summaries) into one .tar.gz with a sha256 for every file. With
+# RAG_ARTIFACT_BUNDLE set, the server installs that bundle into CACHE_DIR at
+# startup instead of building anything. A corrupt bundle, or one built for
+# another version or other settings, stops it from serving. The expected
+# version is RAG_ARTIFACT_BUNDLE_VERSION, or else the local knowledge base's
+# version if there is one.
+ARTIFACT_BUNDLE_PATH = os.getenv("RAG_ARTIFACT_BUNDLE")
+ARTIFACT_BUNDLE_VERSION = os.getenv("RAG_ARTIFACT_BUNDLE_VERSION")
+SUMMARIES_PATH = os.path.join(CACHE_DIR, 'summaries.json')
+
+# --- Live Reload ---
+# Poll the knowledge base (in shared-artifact mode: the manifest) every N
+# seconds and swap in a new pipeline when it changes. 0 disables the watcher.
+RELOAD_POLL_SECONDS = float(os.getenv("RAG_RELOAD_POLL_SECONDS", "0"))
+# Required in the X-Admin-Token header by the admin endpoints; unset disables them.
+ADMIN_TOKEN = os.getenv("RAG_ADMIN_TOKEN")
+
+# --- Sharded Search ---
+# With RAG_SEARCH_SHARDS=N (2 or more) the child-chunk vectors are split into
+# N slices under SHARDS_PATH, each searched by its own worker process, and the
+# per-shard top-k are merged. Until every shard is up, and whenever one fails
+# or misses SHARD_SEARCH_TIMEOUT_SECONDS, searches use the in-process index.
+SEARCH_SHARDS = int(os.getenv("RAG_SEARCH_SHARDS", "0"))
+SHARDS_PATH = os.path.join(CACHE_DIR, 'faiss_shards')
+SHARD_SEARCH_TIMEOUT_SECONDS = float(os.getenv("RAG_SHARD_SEARCH_TIMEOUT_SECONDS", "2"))
+SHARD_START_TIMEOUT_SECONDS = 120
+SHARD_RESTART_MAX_BACKOFF_SECONDS = 30
+# FAISS threads per shard process; the shards themselves provide the parallelism.
+SHARD_THREADS = 1
+# Number of server worker processes (set by gunicorn.conf.py). Sharding needs a
+# single worker: each worker would otherwise start its own set of shards.
+SERVER_WORKERS = int(os.getenv("RAG_SERVER_WORKERS", "1"))
+
+
+
+# --- Multi-Tenancy ---
+# Each subdirectory of TENANTS_DIR is a separate knowledge base, selected per
+# request with the `tenant` field or the X-Tenant header. Its index, docstore
+# and embedding cache live under TENANT_CACHE_DIR/<tenant>; they are loaded on
+# first use and the least recently used tenants are unloaded once the loaded
+# ones exceed the memory budget. Requests without a tenant use the default
+# knowledge base above.
+TENANTS_DIR = os.getenv("RAG_TENANTS_DIR", os.path.join(PROJECT_ROOT, 'data', 'tenants'))
+TENANT_CACHE_DIR = os.path.join(CACHE_DIR, 'tenants')
+TENANT_MEMORY_BUDGET_MB = float(os.getenv("RAG_TENANT_MEMORY_BUDGET_MB", "512"))
+TENANT_HEADER = "X-Tenant"
+# Per-tenant caches are smaller than the default knowledge base's, since many can be loaded at once.
+TENANT_EMBEDDING_CACHE_MAX_ENTRIES = 2000
+TENANT_RETRIEVAL_CACHE_MAX_ENTRIES = 200
 
 # --- Model & Embedding Configuration ---
 EMBEDDING_MODEL = "models/embedding-001"
+# Content-addressed embedding cache: an in-memory LRU in front of a persistent
+# SQLite store, keyed by model, task and text hash. Shared by all workers.
+EMBEDDING_CACHE_PATH = os.path.join(CACHE_DIR, 'embedding_cache.sqlite3')
+EMBEDDING_CACHE_MAX_ENTRIES = 10000
 LLM_MODEL = "gemini-2.0-flash"
 LLM_TEMPERATURE = 0.2
+# Upper bound on a single model request, so calls abandoned at a deadline don't linger.
+LLM_REQUEST_TIMEOUT_SECONDS = 60
+
+# "google" uses the Gemini models above. "stand-in" uses local, offline models
+# (hashed embeddings and a canned LLM with configurable latency) for load and
+# deadline testing; see app/stand_ins.py.
+MODEL_BACKEND = os.getenv("RAG_MODEL_BACKEND", "google")
+STAND_IN_LLM_DELAY_SECONDS = float(os.getenv("RAG_STAND_IN_DELAY_SECONDS", "0.5"))
+STAND_IN_LLM_TAIL_PROBABILITY = float(os.getenv("RAG_STAND_IN_TAIL_PROBABILITY", "0.05"))
+STAND_IN_LLM_TAIL_DELAY_SECONDS = float(os.getenv("RAG_STAND_IN_TAIL_DELAY_SECONDS", "8"))
 
 # Prices are per 1 million tokens. Source: https://ai.google.dev/pricing
 INPUT_TOKEN_PRICE_PER_MILLION = 0.35
@@ -33,8 +112,104 @@ PARENT_CHUNK_SIZE = 2000
 PARENT_CHUNK_OVERLAP = 200
 CHILD_CHUNK_SIZE = 400
 CHILD_CHUNK_OVERLAP = 50
+# LRU cache from normalized standalone questions to ranked parent-document IDs.
+RETRIEVAL_CACHE_MAX_ENTRIES = 1000
+# Follow-up questions are rewritten into standalone ones by the LLM only when a
+# local check finds they refer back to the conversation. Rewrites are cached
+# by the question plus the last REWRITE_HISTORY_MESSAGES messages, which are
+# also all the rewrite prompt sees (0 sends the whole history, uncacheable in practice).
+REWRITE_CLASSIFIER_ENABLED = os.getenv("RAG_REWRITE_CLASSIFIER", "1") == "1"
+REWRITE_HISTORY_MESSAGES = 6
+REWRITE_CACHE_MAX_ENTRIES = 1000
+# Finished answers to questions asked without history, and document summaries,
+# per index version (0 disables a cache).
+ANSWER_CACHE_MAX_ENTRIES = 500
+SUMMARY_CACHE_MAX_ENTRIES = 200
+# /api/query/batch: largest accepted batch and how many answers are generated at once.
+BATCH_QUERY_MAX_ITEMS = 100
+BATCH_QUERY_MAX_CONCURRENCY = 4
+
+# --- Deadlines & Hedging ---
+# Default time budget for answering a query; clients may ask for less (or up
+# to the maximum) with `deadline_ms`. When generation can't finish in time the
+# answer falls back to the most relevant retrieved sentences.
+REQUEST_DEADLINE_SECONDS = float(os.getenv("RAG_REQUEST_DEADLINE_SECONDS", "20"))
+MAX_REQUEST_DEADLINE_SECONDS = 60
+REWRITE_DEADLINE_SHARE = 0.25
+FALLBACK_RESERVE_SECONDS = 0.25
+FALLBACK_MAX_SENTENCES = 4
+# Hedging starts a second LLM attempt once the first has run longer than the
+# given percentile of that stage's recent latencies.
+HEDGING_ENABLED = os.getenv("RAG_HEDGING", "0") == "1"
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 20
+DEADLINE_EXECUTOR_WORKERS = 32
+# Threads shared by the concurrent stages of the query and document handlers.
+STAGE_GRAPH_WORKERS = 32
+
+# --- Cache Warm-Up ---
+# After startup, a background thread mines the most recent query-log entries
+# for the most frequent history-free questions and /api/get_document topics.
+# It warms the embedding and retrieval caches for the top WARMUP_TOP_QUERIES
+# questions (embedding calls only). Then it pre-generates answers and summaries,
+# most popular first, until either LLM budget is spent. Every worker process
+# warms its own caches, so the budget applies per process.
+WARMUP_ENABLED = os.getenv("RAG_WARMUP", "1") == "1"
+WARMUP_MAX_LLM_CALLS = int(os.getenv("RAG_WARMUP_MAX_LLM_CALLS", "20"))
+WARMUP_MAX_TOKENS = int(os.getenv("RAG_WARMUP_MAX_TOKENS", "100000"))
+WARMUP_TOP_QUERIES = 200
+WARMUP_LOG_MAX_LINES = 50000
+# Synthetic traffic that must not shape the warm-up: evaluation.py's user and
+# replay_logs.py's default prefix. Requests sent with `no_cache` are skipped too.
+WARMUP_EXCLUDED_USER_PREFIXES = ("evaluation_", "replay-")
 
 # --- Recommendation Configuration ---
 RECOMMENDATION_THRESHOLD_HIGH = 0.45
 RECOMMENDATION_THRESHOLD_LOW = 0.35
-MAX_RECOMMENDATIONS = 3
\ No newline at end of file
+MAX_RECOMMENDATIONS = 3
+
+# --- Backend Client Configuration ---
+API_BASE_URL = os.getenv("BACKEND_URL", "http://127.0.0.1:5000")
+API_CONNECT_TIMEOUT_SECONDS = 3
+API_READ_TIMEOUT_SECONDS = 120
+API_MAX_RETRIES = 5
+API_RETRY_BACKOFF_SECONDS = 0.5
+API_POOL_SIZE = 10
+
+# --- Memory Diagnostics ---
+# Take a tracemalloc snapshot every N seconds and keep the top allocation growth
+# against the previous and the first snapshot (0 disables). Tracing slows every
+# allocation, so enable it for soak tests and leak hunts rather than by default.
+MEMORY_SNAPSHOT_INTERVAL_SECONDS = float(os.getenv("RAG_MEMORY_SNAPSHOT_SECONDS", "0"))
+MEMORY_TRACE_FRAMES = 1
+MEMORY_SNAPSHOT_HISTORY = 12
+MEMORY_DIFF_TOP_N = 15
+
+# --- Request Profiling ---
+# Requests are profiled at random at the given sample rate when profiling is
+# enabled, or on demand when they carry the header below. The header needs the
+# admin token unless profiling is enabled. Only one request is profiled at a time.
+PROFILING_ENABLED = os.getenv("RAG_PROFILING", "0") == "1"
+PROFILING_SAMPLE_RATE = float(os.getenv("RAG_PROFILING_SAMPLE_RATE", "0.01"))
+PROFILING_HEADER = "X-Profile-Request"
+
+# --- Isolated Indexes ---
+def use_cache_dir(cache_dir: str, share_embedding_cache: bool = True):
+    """
+    Points every per-index artifact path at `cache_dir`, for tools that build
+    several indexes side by side (one per process). Call it before importing
+    `app.rag_pipeline`, which creates its build lock from these paths.
+    """
+    global CACHE_DIR, VECTORSTORE_PATH, DOCSTORE_PATH, DOC_EMBEDDINGS_PATH, DOC_EMBEDDINGS_INDEX_PATH
+    global ARTIFACT_MANIFEST_PATH, BUILD_LOCK_PATH, EMBEDDING_CACHE_PATH, SHARDS_PATH, SUMMARIES_PATH
+    CACHE_DIR = cache_dir
+    VECTORSTORE_PATH = os.path.join(cache_dir, 'faiss_pdr_index')
+    DOCSTORE_PATH = os.path.join(cache_dir, 'pdr_docstore.pkl')
+    DOC_EMBEDDINGS_PATH = os.path.join(cache_dir, 'doc_embeddings.npy')
+    DOC_EMBEDDINGS_INDEX_PATH = os.path.join(cache_dir, 'doc_embeddings_index.json')
+    ARTIFACT_MANIFEST_PATH = os.path.join(cache_dir, 'manifest.json')
+    BUILD_LOCK_PATH = os.path.join(cache_dir, 'build.lock')
+    SHARDS_PATH = os.path.join(cache_dir, 'faiss_shards')
+    SUMMARIES_PATH = os.path.join(cache_dir, 'summaries.json')
+    if not share_embedding_cache:
+        EMBEDDING_CACHE_PATH = os.path.join(cache_dir, 'embedding_cache.sqlite3')
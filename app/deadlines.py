@@ -0,0 +1,170 @@
+# app/deadlines.py
+# Per-request deadlines for the model-bound stages of a request (question
+# rewriting, retrieval, generation). Each stage runs on a shared executor and is
+# waited on only for the time the request has left; a stage that overruns is
+# abandoned and the caller degrades instead of passing model tail latency on to
+# the user. Slow LLM calls can optionally be hedged: once an attempt has run
+# longer than the stage's recent latency percentile, a second one is started
+# and the first result wins.
+
+import math
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Optional
+
+from . import config, profiling, telemetry
+
+class DeadlineExceeded(Exception):
+    """Raised when a stage can't finish before the request's deadline."""
+    def __init__(self, stage: str):
+        super().__init__(f"Deadline exceeded during '{stage}'.")
+        self.stage = stage
+
+class Deadline:
+    """A point in time by which the request must be answered."""
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+class LatencyTracker:
+    """Rolling window of successful stage latencies, used to decide when to hedge."""
+    def __init__(self, window: int = 200):
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            self._samples[stage].append(seconds)
+
+    def percentile(self, stage: str, pct: float, min_samples: int = 1) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples[stage])
+        if len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, math.ceil(pct / 100 * len(samples)) - 1)]
+
+stage_latencies = LatencyTracker()
+# Abandoned attempts keep their worker until the model call returns (the
+# model's own request timeout bounds that), so the pool is sized generously.
+_executor = ThreadPoolExecutor(max_workers=config.DEADLINE_EXECUTOR_WORKERS, thread_name_prefix="stage")
+
+def run_stage(stage: str, fn: Callable, deadline: Deadline, reserve_seconds: float = 0.0,
+              max_seconds: Optional[float] = None, hedge: bool = False):
+    """
+    Runs `fn()` and returns its result, waiting at most until `reserve_seconds`
+    before the deadline (and no longer than `max_seconds`). Attempts that are
+    no longer needed are cancelled if they haven't started yet and ignored
+    otherwise. Raises DeadlineExceeded if nothing finished in time.
+    """
+    budget = deadline.remaining() - reserve_seconds
+    if max_seconds is not None:
+        budget = min(budget, max_seconds)
+    if budget <= 0:
+        telemetry.DEADLINE_EXCEEDED.inc(stage=stage)
+        raise DeadlineExceeded(stage)
+    give_up_at = time.monotonic() + budget
+
+    hedge_after = None
+    if hedge and config.HEDGING_ENABLED:
+        hedge_after = stage_latencies.percentile(stage, config.HEDGE_PERCENTILE, config.HEDGE_MIN_SAMPLES)
+
+    submitted_at = {}
+    def submit():
+        future = _executor.submit(profiling.bind(fn))
+        submitted_at[future] = time.monotonic()
+        return future
+
+    pending = {submit()}
+    last_error = None
+    try:
+        while pending:
+            now = time.monotonic()
+            hedge_due = hedge_after is not None and len(submitted_at) == 1
+            wait_for = give_up_at - now
+            if hedge_due:
+                wait_for = min(wait_for, submitted_at[next(iter(submitted_at))] + hedge_after - now)
+            done, pending = wait(pending, timeout=max(0.0, wait_for), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                if future.exception() is None:
+                    stage_latencies.observe(stage, time.monotonic() - submitted_at[future])
+                    return future.result()
+                last_error = future.exception()
+            if not pending and last_error is not None:
+                raise last_error
+
+            if time.monotonic() >= give_up_at:
+                telemetry.DEADLINE_EXCEEDED.inc(stage=stage)
+                raise DeadlineExceeded(stage)
+            if hedge_due and not done:
+                telemetry.HEDGED_CALLS.inc(stage=stage)
+                pending.add(submit())
+    finally:
+        for future in pending:
+            future.cancel()
+
+# ==============================================================================
+# --- EXTRACTIVE FALLBACK ---
+# ==============================================================================
+_STOPWORDS = {
+    "the", "and", "for", "are", "was", "what", "which", "who", "how", "why", "does", "did",
+    "this", "that", "with", "from", "about", "into", "can", "you", "your", "explain", "tell",
+    "more", "please", "its", "there", "their", "have", "has", "use", "used", "work", "works",
+}
+
+def _terms(text: str) -> set:
+    return {term for term in re.findall(r"[a-z0-9]{3,}", text.lower()) if term not in _STOPWORDS}
+
+def _sentences(text: str) -> list:
+    """Splits markdown into plain sentences, skipping headings, code fences and table rows."""
+    sentences = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith(("#", "```", "|", "---")):
+            continue
+        line = re.sub(r"^[-*>\d.\s]+", "", line).replace("**", "").replace("`", "")
+        sentences.extend(s.strip() for s in re.split(r"(?<=[.!?])\s+", line) if len(s.strip()) > 20)
+    return sentences
+
+def extractive_answer(question: str, docs: list, max_sentences: Optional[int] = None) -> str:
+    """
+    Builds an answer from the retrieved documents alone: the sentences sharing
+    the most terms with the question, in document order, with their sources.
+    """
+    max_sentences = max_sentences or config.FALLBACK_MAX_SENTENCES
+    question_terms = _terms(question)
+    candidates = []
+    for doc_rank, doc in enumerate(docs):
+        for position, sentence in enumerate(_sentences(doc.page_content)):
+            score = len(question_terms & _terms(sentence))
+            candidates.append((-score, doc_rank, position, sentence))
+    if not candidates:
+        return ("I'm sorry, I couldn't put together an answer in time. "
+                "Please try again in a moment.")
+
+    # Keep the best-matching sentences, then restore reading order.
+    selected = sorted(sorted(candidates)[:max_sentences], key=lambda c: (c[1], c[2]))
+    sources = list(dict.fromkeys(docs[doc_rank].metadata.get('topic', 'Unknown') for _, doc_rank, _, _ in selected))
+    lines = [f"- {sentence} [{sources.index(docs[doc_rank].metadata.get('topic', 'Unknown')) + 1}]"
+             for _, doc_rank, _, sentence in selected]
+    return (
+        "I couldn't generate a full answer in time, so here are the most relevant passages from the documentation:\n\n"
+        + "\n".join(lines)
+        + "\n\nSources:\n" + "\n".join(f"{i + 1}. {topic}" for i, topic in enumerate(sources))
+    )
+
+def extractive_summary(text: str, max_sentences: Optional[int] = None) -> str:
+    """Fallback for document summaries: the opening sentences of the document."""
+    sentences = _sentences(text)[:max_sentences or config.FALLBACK_MAX_SENTENCES]
+    if not sentences:
+        return "I'm sorry, I couldn't summarize this document in time. Please try again in a moment."
+    return "I couldn't generate a summary in time, so here is how the document begins:\n\n" + " ".join(sentences)
@@ -0,0 +1,184 @@
+# app/embedding_cache.py
+# Content-addressed cache around the configured embeddings model. Every embed
+# call in the app (retriever searches, profile updates, document embeddings,
+# ingestion) goes through it, so each distinct text is embedded once across
+# requests, worker processes and restarts.
+
+import hashlib
+import inspect
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from . import config, telemetry
+
+# Keys per `IN (...)` lookup. Older SQLite builds allow only 999 bound variables
+# per statement (32766 since 3.32), and ingestion looks up every chunk at once.
+_LOOKUP_CHUNK_SIZE = 900
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an `Embeddings` object with an in-memory LRU over a persistent SQLite
+    store. Keys hash the model name, the task ("query" or "document", which some
+    providers embed differently) and the text. The LRU holds float32 arrays
+    (about 3 KB per 768-dim vector instead of 25 KB as a list of Python floats);
+    they are converted to lists only when returned through the LangChain interface.
+    """
+    def __init__(self, base: Embeddings, model_name: str, store_path: Optional[str] = None,
+                 max_entries: Optional[int] = None):
+        self.base = base
+        self.model_name = model_name
+        self.store_path = store_path or config.EMBEDDING_CACHE_PATH
+        self.max_entries = max_entries or config.EMBEDDING_CACHE_MAX_ENTRIES
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0, "model_calls": 0}
+        self._in_flight = {}
+
+        os.makedirs(os.path.dirname(self.store_path), exist_ok=True)
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+
+    # --- Storage helpers ---
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread; WAL lets concurrent worker processes read while one writes.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.store_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _key(self, task: str, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\x00{task}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _remember(self, key: str, vector: np.ndarray):
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _lookup(self, keys: List[str]) -> dict:
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+            self._stats["memory_hits"] += len(found)
+        telemetry.CACHE_LOOKUPS.inc(len(found), cache="embedding", result="memory_hit")
+
+        missing = [key for key in keys if key not in found]
+        if missing:
+            rows = []
+            for start in range(0, len(missing), _LOOKUP_CHUNK_SIZE):
+                chunk = missing[start:start + _LOOKUP_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                rows.extend(self._connection().execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk).fetchall())
+            for key, blob in rows:
+                vector = np.frombuffer(blob, dtype=np.float64).astype(np.float32)
+                found[key] = vector
+                self._remember(key, vector)
+            with self._lock:
+                self._stats["disk_hits"] += len(rows)
+            telemetry.CACHE_LOOKUPS.inc(len(rows), cache="embedding", result="disk_hit")
+        return found
+
+    def _store(self, items: dict):
+        with self._connection() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, np.asarray(vector, dtype=np.float64).tobytes()) for key, vector in items.items()],
+            )
+        for key, vector in items.items():
+            self._remember(key, vector)
+
+    def _supports_batched_queries(self) -> bool:
+        # Providers whose batch call takes a task type (e.g. Google) can embed
+        # many queries in one request; others fall back to one call per query.
+        return "task_type" in inspect.signature(self.base.embed_documents).parameters
+
+    def _embed_missing(self, task: str, missing: dict) -> dict:
+        texts_to_embed = list(missing.values())
+        if task == "document":
+            vectors, model_calls = self.base.embed_documents(texts_to_embed), 1
+        elif len(texts_to_embed) > 1 and self._supports_batched_queries():
+            vectors, model_calls = self.base.embed_documents(texts_to_embed, task_type="RETRIEVAL_QUERY"), 1
+        else:
+            vectors, model_calls = [self.base.embed_query(text) for text in texts_to_embed], len(texts_to_embed)
+        new_items = {key: np.asarray(vector, dtype=np.float32) for key, vector in zip(missing, vectors)}
+        self._store(new_items)
+        with self._lock:
+            self._stats["misses"] += len(missing)
+            self._stats["model_calls"] += model_calls
+        telemetry.CACHE_LOOKUPS.inc(len(missing), cache="embedding", result="miss")
+        telemetry.EMBEDDING_CALLS.inc(model_calls, task=task)
+        telemetry.EMBEDDING_TEXTS.inc(len(missing), task=task)
+        return new_items
+
+    def _embed(self, task: str, texts: List[str]) -> List[np.ndarray]:
+        keys = [self._key(task, text) for text in texts]
+        found = self._lookup(list(dict.fromkeys(keys)))
+
+        # Embed each distinct missing text once, in a single model call. Texts
+        # another thread is already embedding (e.g. the retriever and the
+        # profile update of the same request) are waited for, not re-embedded.
+        missing = {key: text for key, text in zip(keys, texts) if key not in found}
+        owned, in_flight = {}, {}
+        with self._lock:
+            for key, text in missing.items():
+                if key in self._memory:
+                    # Finished by another thread since the lookup above.
+                    found[key] = self._memory[key]
+                elif key in self._in_flight:
+                    in_flight[key] = self._in_flight[key]
+                else:
+                    owned[key] = text
+                    self._in_flight[key] = Future()
+            self._stats["coalesced"] += len(in_flight)
+        if owned:
+            try:
+                new_items = self._embed_missing(task, owned)
+            except BaseException as error:
+                for key in owned:
+                    self._in_flight[key].set_exception(error)
+                raise
+            finally:
+                with self._lock:
+                    futures = {key: self._in_flight.pop(key) for key in owned}
+            for key, future in futures.items():
+                future.set_result(new_items[key])
+            found.update(new_items)
+        for key, future in in_flight.items():
+            found[key] = future.result()
+        return [found[key] for key in keys]
+
+    # --- Embeddings interface ---
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed("query", [text])[0].tolist()
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embeds several texts as queries, batching the cache misses into one model call where possible."""
+        return [vector.tolist() for vector in self._embed("query", list(texts))] if texts else []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [vector.tolist() for vector in self._embed("document", list(texts))] if texts else []
+
+    def stats(self) -> dict:
+        """Returns hit counters for this process since startup."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        hits = stats["memory_hits"] + stats["disk_hits"] + stats["coalesced"]
+        lookups = hits + stats["misses"]
+        stats["hit_rate"] = round(hits / lookups, 4) if lookups else None
+        return stats
@@ -2,21 +2,23 @@
 
 # --- Core Imports ---
 import time
+_import_started_at = time.perf_counter()
+import hmac
 import threading
 import os
 import re
+import uuid
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
 # --- Third-party Imports ---
-import numpy as np
-from flask import Flask, request, jsonify, g
-from scipy.spatial.distance import cosine
-from langchain_core.messages import HumanMessage, AIMessage
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import ChatPromptTemplate
+# numpy and LangChain are imported inside the handlers that use them,
+# so the app can start serving health checks before the heavy stack is loaded.
+from flask import Flask, Response, request, jsonify, g, stream_with_context
 
 # --- Local Application Imports ---
-from . import config, utils, rag_pipeline
+from . import config, deadlines, memory, utils, rag_pipeline, recommender, rewriting, stage_graph, telemetry, tenants, profiling, warmup
 
 # ==============================================================================
 # --- 1. FLASK APP & BACKGROUND INITIALIZATION ---
@@ -28,36 +30,195 @@ os.makedirs(config.CACHE_DIR, exist_ok=True)
 def run_rag_initialization():
     with app.app_context():
         rag_pipeline.initialize_rag_pipeline()
+    if rag_pipeline.get_rag_pipeline_status():
+        memory.log_startup_report()
+        memory.start_snapshot_watcher()
+        # Readiness is already reported; the warm-up only fills caches in the background.
+        warmup.start_warmup()
+    rag_pipeline.start_reload_watcher()
 
 initialization_thread = threading.Thread(target=run_rag_initialization, daemon=True)
 initialization_thread.start()
+print(f"⏱️ Flask app importable in {round((time.perf_counter() - _import_started_at) * 1000)} ms; RAG pipeline initializing in background.")
 
 # ==============================================================================
 # --- 2. HELPER FUNCTIONS & PROFILE MANAGEMENT ---
 # ==============================================================================
-def _format_topic_title(topic_id: str) -> str:
-    if not topic_id: return "Unknown Topic"
-    title_part = re.sub(r'^\d{2}(_\d{2})?-', '', topic_id)
-    return title_part.replace('-', ' ').replace('_', ' ').title()
+# Opening of the answer the system prompt asks for when the context can't answer the question.
+FAILURE_SIGNAL = "I'm sorry, I don't have enough information to answer that question"
 
-def _update_user_profile(user_id: str, query_text: str, source_topics: list):
-    user_profiles = utils.load_user_profiles()
-    profile = user_profiles.setdefault(user_id, {
-        "query_history": [], "inferred_interests": [], "profile_vector": None
-    })
-    profile["query_history"].append({"query": query_text, "timestamp": datetime.utcnow().isoformat()})
+def _pipeline_unavailable(*stages):
+    """Returns a 503 response if any of the given stages is not ready yet, else None."""
+    missing = [stage for stage in stages if not rag_pipeline.is_stage_ready(stage)]
+    if not missing:
+        return None
+    telemetry.INITIALIZATION_UNAVAILABLE.inc(endpoint=request.endpoint)
+    report = rag_pipeline.get_initialization_report()
+    if report["status"] == "failed":
+        message = "RAG pipeline initialization failed. Check the server logs."
+    else:
+        message = "RAG pipeline is still initializing. Please try again shortly."
+    return jsonify({"error": message, "status": report["status"], "waiting_for": missing, "stages": report["stages"]}), 503
+
+def _request_pipeline():
+    """
+    Returns the pipeline snapshot for the request's tenant (the `tenant` field or
+    the X-Tenant header) and None, or None and an error response. Requests
+    without a tenant are served from the default knowledge base.
+    """
+    data = request.get_json(silent=True)
+    tenant = (data.get("tenant") if isinstance(data, dict) else None) or request.headers.get(config.TENANT_HEADER)
+    if not tenant:
+        return rag_pipeline.get_snapshot(), None
+    try:
+        return tenants.registry.get(tenant), None
+    except tenants.TenantError as e:
+        return None, (jsonify({"error": str(e), "tenant": tenant}), e.status)
+
+def _fold_query_into_profile(profile: dict, query_text: str, source_topics: list, query_vector, timestamp: str = None):
+    """Applies one query to a profile in place: history, consulted topics and the decayed profile vector."""
+    import numpy as np
+
+    profile["query_history"].append({"query": query_text, "timestamp": timestamp or datetime.utcnow().isoformat()})
     profile["inferred_interests"].extend(t for t in source_topics if t and t not in profile["inferred_interests"])
 
-    query_vector = rag_pipeline.embeddings.embed_query(query_text)
     if profile.get("profile_vector") and profile["profile_vector"] is not None:
         old_vector = np.array(profile["profile_vector"])
         new_vector_np = np.add(np.multiply(old_vector, 0.8), np.multiply(query_vector, 0.2))
         profile["profile_vector"] = new_vector_np.tolist()
     else:
-        profile["profile_vector"] = query_vector
-        
-    utils.save_user_profiles(user_profiles)
+        profile["profile_vector"] = list(query_vector)
+
+def _apply_profile_updates(user_id: str, updates: list, reset: bool = False, keep_steps: bool = False,
+                           query_vectors: list = None):
+    """
+    Folds a sequence of `{"query", "topics"[, "timestamp"]}` updates into the user's
+    profile, in order. Returns the updated profile and, if `keep_steps` is set, a
+    snapshot of the recommendation inputs after each update. Callers that have
+    already embedded the queries pass the vectors in `query_vectors`.
+    """
+    # Embed outside the lock (a single batched call for a replay); the
+    # read-modify-write below must be atomic across threads and worker
+    # processes, but shouldn't wait on a network call.
+    if query_vectors is None:
+        query_vectors = rag_pipeline.embeddings.embed_queries([update["query"] for update in updates])
+    steps = []
+    with utils.file_lock:
+        user_profiles = utils.load_user_profiles()
+        if reset:
+            user_profiles.pop(user_id, None)
+        profile = user_profiles.setdefault(user_id, {
+            "query_history": [], "inferred_interests": [], "profile_vector": None
+        })
+        for update, query_vector in zip(updates, query_vectors):
+            _fold_query_into_profile(profile, update["query"], update.get("topics", []), query_vector, update.get("timestamp"))
+            if keep_steps:
+                steps.append({"profile_vector": profile["profile_vector"], "inferred_interests": list(profile["inferred_interests"])})
+        utils.save_user_profiles(user_profiles)
+    return profile, steps
+
+def _update_user_profile(user_id: str, query_text: str, source_topics: list, query_vector=None) -> dict:
+    """Folds a query into the user's profile vector and returns the updated profile."""
+    profile, _ = _apply_profile_updates(user_id, [{"query": query_text, "topics": source_topics}],
+                                        query_vectors=None if query_vector is None else [query_vector])
     print(f"Updated profile for user {user_id} based on query: '{query_text[:50]}...'")
+    return profile
+
+def _parse_profile_updates(items) -> list:
+    """Validates client-supplied `{"query", "topics"}` items, or returns None if malformed."""
+    if not isinstance(items, list) or not items:
+        return None
+    updates = []
+    for item in items:
+        if not isinstance(item, dict) or not isinstance(item.get("query"), str) or not item["query"].strip():
+            return None
+        topics = item.get("topics", [])
+        if not isinstance(topics, list):
+            return None
+        topics = [utils.normalize_topic(topic) for topic in topics]
+        updates.append({"query": item["query"], "topics": [topic for topic in topics if topic]})
+    return updates
+
+def _request_deadline(data: dict) -> deadlines.Deadline:
+    """The client's `deadline_ms` (capped at the configured maximum), or the default deadline."""
+    seconds = config.REQUEST_DEADLINE_SECONDS
+    deadline_ms = data.get('deadline_ms')
+    if isinstance(deadline_ms, (int, float)) and not isinstance(deadline_ms, bool) and deadline_ms > 0:
+        seconds = min(deadline_ms / 1000, config.MAX_REQUEST_DEADLINE_SECONDS)
+    # Time already spent in the request counts against the budget.
+    return deadlines.Deadline(seconds - (time.time() - g.start_time))
+
+def _usage_summary(latency_ms: float, input_tokens: int, output_tokens: int, cost: float) -> dict:
+    """Per-request latency, token and cost figures returned to clients (e.g. the evaluation script)."""
+    return {
+        "latency_ms": round(latency_ms), "input_tokens": input_tokens, "output_tokens": output_tokens,
+        "total_tokens": input_tokens + output_tokens, "cost": cost,
+    }
+
+def _answer_batch_item(pipeline, index: int, question: str, retrieval: dict, user_id: str, request_id: str) -> dict:
+    """Generates the answer for one batch question from its already-retrieved parent documents."""
+    started = time.time()
+    try:
+        docs = [doc for doc in pipeline.retriever.docstore.mget(retrieval["parent_ids"]) if doc is not None]
+        token_callback = utils.TokenUsageCallback()
+        answer = pipeline.question_answer_chain.invoke(
+            {"input": question, "chat_history": [], "context": docs},
+            config={"callbacks": [token_callback]}
+        )
+    except Exception as e:
+        telemetry.ERRORS.inc(exception=type(e).__name__)
+        print(f"❌ Batch item {index} failed: {e}")
+        return {"index": index, "question": question, "error": str(e)}
+
+    # Unanswerable questions get no sources; unlike /api/query, no suggestions are generated for them.
+    source_topics = [] if FAILURE_SIGNAL in answer else sorted(set(doc.metadata.get('topic', 'Unknown') for doc in docs))
+    latency = (time.time() - started) * 1000
+    input_tokens = token_callback.get_total_prompt_tokens()
+    output_tokens = token_callback.get_total_completion_tokens()
+    cost = utils.calculate_cost(input_tokens, output_tokens)
+    retrieval_stats = {key: value for key, value in retrieval.items() if key != "parent_ids"}
+
+    utils.log_query({
+        "timestamp": datetime.utcnow().isoformat(), "request_id": request_id, "batch_index": index,
+        "user_id": user_id, "query": question, "answer": answer, "sources": source_topics,
+        "latency_ms": round(latency), "input_tokens": input_tokens,
+        "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens,
+        "cost": cost, "retrieval_cache": retrieval_stats
+    })
+    return {
+        "index": index, "question": question, "answer": answer, "sources": source_topics,
+        "usage": _usage_summary(latency, input_tokens, output_tokens, cost), "retrieval_cache": retrieval_stats,
+    }
+
+def _run_query_batch(pipeline, questions: list, retrievals: list, user_id: str, request_id: str):
+    """Yields batch results as their answers complete, generating at most BATCH_QUERY_MAX_CONCURRENCY at once."""
+    workers = min(config.BATCH_QUERY_MAX_CONCURRENCY, len(questions))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch-query") as pool:
+        futures = [
+            pool.submit(profiling.bind(_answer_batch_item), pipeline, i, question, retrieval, user_id, request_id)
+            for i, (question, retrieval) in enumerate(zip(questions, retrievals))
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+def _batch_summary(results: list, retrievals: list, retrieval_ms: float, started: float) -> dict:
+    answered = [result for result in results if "error" not in result]
+    input_tokens = sum(result["usage"]["input_tokens"] for result in answered)
+    output_tokens = sum(result["usage"]["output_tokens"] for result in answered)
+    return {
+        "count": len(results), "errors": len(results) - len(answered),
+        "retrieval": {
+            "cache_hits": sum(1 for retrieval in retrievals if retrieval["hit"]),
+            "searched": sum(1 for retrieval in retrievals if not retrieval["hit"]),
+            "latency_ms": round(retrieval_ms),
+        },
+        "usage": _usage_summary((time.time() - started) * 1000, input_tokens, output_tokens,
+                                sum(result["usage"]["cost"] for result in answered)),
+    }
+
+def _compute_recommendations(user_profile: dict, pipeline) -> list:
+    """Ranks topics the user hasn't consulted yet by similarity to their profile vector."""
+    return recommender.recommend_for_profiles([user_profile], pipeline.doc_embedding_matrix, pipeline.doc_topic_ids)[0]
 
 # ==============================================================================
 # --- 3. FLASK API ENDPOINTS ---
@@ -65,17 +226,117 @@ def _update_user_profile(user_id: str, query_text: str, source_topics: list):
 @app.before_request
 def before_request_func():
     g.start_time = time.time()
+    # Client IDs are kept only if they are safe to use in log entries and profile file names.
+    client_request_id = request.headers.get("X-Request-ID", "")
+    g.request_id = client_request_id if profiling.REQUEST_ID_PATTERN.match(client_request_id) else uuid.uuid4().hex
+    g.profiler = None
+    if profiling.should_profile(request.headers, _has_admin_token()):
+        g.profiler = profiling.RequestProfiler.start(g.request_id, request.url_rule.rule if request.url_rule else request.path)
+    g.traced_before = memory.traced_bytes()
+
+@app.after_request
+def after_request_func(response):
+    memory.record_request(request.url_rule.rule if request.url_rule else "unmatched", g.get("traced_before"))
+    if g.get("profiler") is not None:
+        g.profiler.stop(response.status_code)
+        g.profiler = None
+    response.headers["X-Request-ID"] = g.get("request_id", "")
+    # Label by route rule, not raw path, to keep the series count bounded.
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    telemetry.HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    telemetry.HTTP_LATENCY.observe(time.time() - g.get("start_time", time.time()), endpoint=endpoint)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def handle_metrics():
+    telemetry.PIPELINE_READY.set(1 if rag_pipeline.get_rag_pipeline_status() else 0)
+    memory.update_gauges()
+    return Response(telemetry.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+@app.route('/api/health', methods=['GET'])
+def handle_health():
+    report = rag_pipeline.get_initialization_report()
+    if rag_pipeline.is_stage_ready("models"):
+        report["embedding_cache"] = rag_pipeline.embeddings.stats()
+    if rag_pipeline.retrieval_cache is not None:
+        report["retrieval_cache"] = rag_pipeline.retrieval_cache.stats()
+    if rag_pipeline.answer_cache is not None:
+        report["answer_cache"] = rag_pipeline.answer_cache.stats()
+        report["summary_cache"] = rag_pipeline.summary_cache.stats()
+    report["rewrite_cache"] = rewriting.cache.stats()
+    report["warmup"] = warmup.status()
+    if rag_pipeline.shard_coordinator is not None:
+        report["shards"] = rag_pipeline.shard_coordinator.status()
+    report["reload"] = rag_pipeline.get_reload_status()
+    report["tenants"] = tenants.registry.status()
+    return jsonify(report), 200 if report["ready"] else 503
+
+def _has_admin_token() -> bool:
+    return bool(config.ADMIN_TOKEN) and hmac.compare_digest(request.headers.get("X-Admin-Token", ""), config.ADMIN_TOKEN)
+
+def _admin_forbidden():
+    """Returns a 403 response unless the request carries the configured admin token, else None."""
+    if not config.ADMIN_TOKEN:
+        return jsonify({"error": "Admin endpoints are disabled. Set RAG_ADMIN_TOKEN to enable them."}), 403
+    if not _has_admin_token():
+        return jsonify({"error": "Invalid admin token."}), 403
+    return None
+
+@app.route('/api/admin/reload', methods=['GET', 'POST'])
+def handle_reload():
+    """POST starts a background knowledge-base reload; GET reports the last one."""
+    forbidden = _admin_forbidden()
+    if forbidden: return forbidden
+    if request.method == 'GET':
+        return jsonify(rag_pipeline.get_reload_status())
+
+    unavailable = _pipeline_unavailable("chain")
+    if unavailable: return unavailable
+    if rag_pipeline.reload_lock.locked():
+        return jsonify(rag_pipeline.get_reload_status()), 409
+    threading.Thread(target=rag_pipeline.reload_pipeline, kwargs={"trigger": "admin"}, name="kb-reload", daemon=True).start()
+    return jsonify({"status": "reload started", "index_version": rag_pipeline.index_version}), 202
+
+@app.route('/api/admin/memory', methods=['GET'])
+def handle_memory():
+    """
+    Resident memory broken down by component, plus the per-endpoint allocation
+    totals and recent snapshot diffs when memory snapshots are enabled.
+    `?components=0` skips the breakdown, which walks every cached object.
+    """
+    forbidden = _admin_forbidden()
+    if forbidden: return forbidden
+    include_components = request.args.get("components", "1") != "0" and rag_pipeline.get_rag_pipeline_status()
+    report = memory.memory_report(include_components=include_components)
+    report["endpoints"] = memory.endpoint_report()
+    report["snapshots"] = memory.snapshot_report()
+    return jsonify(report)
+
+@app.route('/api/admin/tenants/<tenant>', methods=['DELETE'])
+def handle_unload_tenant(tenant):
+    """Unloads a tenant's pipeline; its next request loads it again, picking up knowledge-base changes."""
+    forbidden = _admin_forbidden()
+    if forbidden: return forbidden
+    if not tenants.registry.unload(tenant):
+        return jsonify({"error": f"Tenant '{tenant}' is not loaded."}), 404
+    return jsonify({"status": "unloaded", "tenant": tenant}), 200
 
 @app.errorhandler(Exception)
 def handle_exception(e):
+    telemetry.ERRORS.inc(exception=type(e).__name__)
     import traceback
     traceback.print_exc()
     return jsonify({"error": "An internal server error occurred.", "details": str(e)}), 500
 
 @app.route('/api/query', methods=['POST'])
 def handle_query():
-    if not rag_pipeline.get_rag_pipeline_status():
-        return jsonify({"error": "RAG pipeline is still initializing. Please try again shortly."}), 503
+    unavailable = _pipeline_unavailable("chain")
+    if unavailable: return unavailable
+    pipeline, tenant_error = _request_pipeline()
+    if tenant_error: return tenant_error
+    from langchain_core.messages import HumanMessage, AIMessage
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_core.prompts import ChatPromptTemplate
 
     data = request.get_json()
     if not data or 'query' not in data or 'user_id' not in data:
@@ -83,23 +344,22 @@ def handle_query():
 
     user_query = data['query']
     user_id = data['user_id']
+    include_recommendations = bool(data.get('include_recommendations', False))
+    # Bypasses the answer cache, so evaluation and replay runs measure the full pipeline.
+    no_cache = bool(data.get('no_cache', False))
     chat_history_messages = [
         HumanMessage(content=msg['content']) if msg['role'] == 'user' else AIMessage(content=msg['content'])
         for msg in data.get('chat_history', [])
     ]
 
     token_callback = utils.TokenUsageCallback()
-    result = rag_pipeline.rag_chain.invoke(
-        {"input": user_query, "chat_history": chat_history_messages},
-        config={"callbacks": [token_callback]}
-    )
-    generated_answer = result.get('answer', "An unexpected error occurred.")
-    
-    # +++ NEW: Enhanced graceful failure logic based on the new prompt's uncertainty protocol +++
-    failure_signal = "I'm sorry, I don't have enough information to answer that question"
-    source_topics = []
+    stats_callback = utils.RequestStatsCallback()
+    deadline = _request_deadline(data)
 
-    if failure_signal in generated_answer:
+    def suggest(result):
+        # +++ NEW: Enhanced graceful failure logic based on the new prompt's uncertainty protocol +++
+        if FAILURE_SIGNAL not in result['answer']:
+            return None
         # If the RAG chain couldn't find an answer, we provide helpful suggestions.
         print("INFO: RAG chain failed to find an answer. Generating helpful suggestions.")
         
@@ -116,22 +376,58 @@ def handle_query():
         suggestion_chain = suggestion_prompt | rag_pipeline.llm | StrOutputParser()
         
         # Get all available topics from the recommendation cache.
-        all_topics = list(rag_pipeline.doc_embeddings_cache.keys())
+        all_topics = list(pipeline.doc_embeddings_cache.keys())
         # The same token_callback is used here, so it will correctly sum the tokens from both LLM calls.
-        suggested_questions_str = suggestion_chain.invoke(
-            {"topics": "\n- ".join(all_topics)},
-            config={"callbacks": [token_callback]}
-        )
-        
-        # Construct a more user-friendly and helpful failure message.
-        follow_up_message = "\n\nTo give you an idea of what I can answer, you could ask me something like:"
-        generated_answer = f"{generated_answer}{follow_up_message}\n{suggested_questions_str}"
+        try:
+            return deadlines.run_stage("suggest", lambda: suggestion_chain.invoke(
+                {"topics": "\n- ".join(all_topics)},
+                config={"callbacks": [token_callback]}
+            ), deadline)
+        except deadlines.DeadlineExceeded:
+            # The suggestions are a nicety; past the deadline the plain answer is returned.
+            result["degraded"].append("suggest")
+            return None
+
+    def update_profile(result, query_vector):
+        # Only answered queries say anything about the user's interests.
+        if FAILURE_SIGNAL in result['answer']:
+            return None
+        source_topics = sorted(set(doc.metadata.get('topic', 'Unknown') for doc in result.get('context', [])))
+        return _update_user_profile(user_id, user_query, source_topics, query_vector)
+
+    # The profile embedding only needs the question, so it runs while the answer
+    # is being generated; the profile update and the suggestions wait for it.
+    graph = stage_graph.StageGraph()
+    graph.add("profile_embedding", lambda: rag_pipeline.embeddings.embed_query(user_query))
+    graph.add("answer", lambda: rag_pipeline.answer_query(
+        pipeline, user_query, chat_history_messages, [token_callback, stats_callback], deadline, use_cache=not no_cache))
+    graph.add("suggestions", suggest, after=["answer"])
+    graph.add("profile", update_profile, after=["answer", "profile_embedding"])
+    if include_recommendations:
+        # Score against the profile we just updated in memory; only an unanswered
+        # query (which leaves the profile untouched) needs to read it from disk.
+        graph.add("recommendations", lambda profile: _compute_recommendations(
+            profile if profile is not None else utils.load_user_profiles().get(user_id), pipeline), after=["profile"])
+    stages = graph.wait()
+
+    result = stages["answer"]
+    generated_answer = result.get('answer', "An unexpected error occurred.")
+    if FAILURE_SIGNAL in generated_answer:
+        suggested_questions_str = stages["suggestions"]
+        if suggested_questions_str:
+            # Construct a more user-friendly and helpful failure message.
+            follow_up_message = "\n\nTo give you an idea of what I can answer, you could ask me something like:"
+            generated_answer = f"{generated_answer}{follow_up_message}\n{suggested_questions_str}"
         source_topics = ["None"] # Mark as no sources found for logging.
     else:
-        # If the query was successful, extract the sources and update the user profile.
-        source_docs = result.get('context', [])
-        source_topics = sorted(list(set(doc.metadata.get('topic', 'Unknown') for doc in source_docs)))
-        _update_user_profile(user_id, user_query, source_topics)
+        source_topics = sorted(set(doc.metadata.get('topic', 'Unknown') for doc in result.get('context', [])))
+
+    response_body = {"answer": generated_answer, "sources": source_topics}
+    if result["degraded"]:
+        response_body["degraded"] = result["degraded"]
+    if include_recommendations:
+        response_body["recommendations"] = stages["recommendations"]
+    stage_ms = {**graph.stage_ms, **result["stage_ms"]}
 
     # --- Performance and Cost Logging ---
     latency = (time.time() - g.start_time) * 1000
@@ -140,58 +436,153 @@ def handle_query():
     cost = utils.calculate_cost(input_tokens, output_tokens)
 
     utils.log_query({
-        "timestamp": datetime.utcnow().isoformat(), "user_id": user_id,
+        "timestamp": datetime.utcnow().isoformat(), "request_id": g.request_id, "user_id": user_id,
         "query": user_query, "answer": generated_answer, "sources": source_topics,
         "latency_ms": round(latency), "input_tokens": input_tokens,
         "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens,
-        "cost": cost
+        "cost": cost, "retrieval_cache": stats_callback.stats.get("retrieval_cache"),
+        "deadline_ms": round(deadline.seconds * 1000), "degraded": result["degraded"], "stage_ms": stage_ms,
+        "rewrite": result["rewrite"], "no_cache": no_cache
     })
-    return jsonify({"answer": generated_answer, "sources": source_topics})
+    response_body["usage"] = _usage_summary(latency, input_tokens, output_tokens, cost)
+    return jsonify(response_body)
+
+@app.route('/api/query/batch', methods=['POST'])
+def handle_query_batch():
+    """
+    Answers many independent (history-free) questions in one request. Retrieval
+    is shared across the batch; answers are generated concurrently. With
+    `"stream": true`, results are sent as NDJSON lines in completion order,
+    followed by a final `{"summary": ...}` line.
+    """
+    unavailable = _pipeline_unavailable("chain")
+    if unavailable: return unavailable
+    pipeline, tenant_error = _request_pipeline()
+    if tenant_error: return tenant_error
+
+    data = request.get_json() or {}
+    questions = data.get('questions')
+    if not isinstance(questions, list) or not questions or not all(isinstance(q, str) and q.strip() for q in questions):
+        return jsonify({"error": "Request must include a non-empty 'questions' list of strings"}), 400
+    if len(questions) > config.BATCH_QUERY_MAX_ITEMS:
+        return jsonify({"error": f"A batch may contain at most {config.BATCH_QUERY_MAX_ITEMS} questions"}), 400
+
+    user_id = data.get('user_id', 'batch')
+    request_id = g.request_id
+    started = g.start_time
+
+    retrieval_started = time.time()
+    retrievals = pipeline.cached_retriever.get_parent_ids_batch(questions)
+    retrieval_ms = (time.time() - retrieval_started) * 1000
+    print(f"Batch {request_id}: retrieved context for {len(questions)} questions in {round(retrieval_ms)} ms "
+          f"({sum(1 for r in retrievals if r['hit'])} from cache).")
+
+    if data.get('stream', False):
+        def generate():
+            results = []
+            for result in _run_query_batch(pipeline, questions, retrievals, user_id, request_id):
+                results.append(result)
+                yield json.dumps(result) + "\n"
+            yield json.dumps({"summary": _batch_summary(results, retrievals, retrieval_ms, started)}) + "\n"
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    results = sorted(_run_query_batch(pipeline, questions, retrievals, user_id, request_id), key=lambda result: result["index"])
+    return jsonify({"results": results, "summary": _batch_summary(results, retrievals, retrieval_ms, started)})
 
 @app.route('/api/recommendations', methods=['POST'])
 def handle_recommendations():
-    if not rag_pipeline.get_rag_pipeline_status():
-        return jsonify({"error": "RAG pipeline is initializing. Please try again."}), 503
+    # Recommendations only need the pre-computed document embeddings, so they
+    # are served as soon as that stage is done, before the chain is built.
+    unavailable = _pipeline_unavailable("embedding_cache")
+    if unavailable: return unavailable
+    pipeline, tenant_error = _request_pipeline()
+    if tenant_error: return tenant_error
 
     data = request.get_json()
     if 'user_id' not in data: return jsonify({"error": "Missing 'user_id'"}), 400
     user_id = data['user_id']
     
     user_profiles = utils.load_user_profiles()
-    user_profile = user_profiles.get(user_id)
-    if not user_profile or not user_profile.get("profile_vector"):
-        return jsonify({"recommendations": []})
+    return jsonify({"recommendations": _compute_recommendations(user_profiles.get(user_id), pipeline)})
 
-    profile_vector = np.array(user_profile["profile_vector"])
-    consulted_topics = set(user_profile.get("inferred_interests", []))
-    
-    all_doc_scores = [(1 - cosine(profile_vector, np.array(doc_data["embedding"])), topic_id) 
-                      for topic_id, doc_data in rag_pipeline.doc_embeddings_cache.items()]
-    all_doc_scores.sort(key=lambda x: x[0], reverse=True)
+@app.route('/api/profile/update', methods=['POST'])
+def handle_profile_update():
+    """Applies a single query to a user's profile without running the RAG chain."""
+    data = request.get_json() or {}
+    include_recommendations = bool(data.get('include_recommendations', False))
+    unavailable = _pipeline_unavailable("models", *(["embedding_cache"] if include_recommendations else []))
+    if unavailable: return unavailable
+    pipeline, tenant_error = _request_pipeline()
+    if tenant_error: return tenant_error
 
-    recommendations, seen_topic_ids, seen_parent_topics = [], set(), set()
-    
-    def get_parent_topic(topic_id):
-        match = re.match(r"(\d{2}_[a-zA-Z_-]+)", topic_id)
-        return match.group(1) if match else topic_id
-
-    for score, topic_id in all_doc_scores:
-        if len(recommendations) >= config.MAX_RECOMMENDATIONS: break
-        if topic_id in consulted_topics or topic_id in seen_topic_ids: continue
-        parent_topic = get_parent_topic(topic_id)
-        if parent_topic not in seen_parent_topics:
-            recommendations.append({"topic_id": topic_id, "title": _format_topic_title(topic_id), "explanation": "Based on your recent interests, you might find this helpful."})
-            seen_topic_ids.add(topic_id)
-            seen_parent_topics.add(parent_topic)
-            
-    if len(recommendations) < config.MAX_RECOMMENDATIONS:
-        for score, topic_id in all_doc_scores:
-            if len(recommendations) >= config.MAX_RECOMMENDATIONS: break
-            if topic_id not in consulted_topics and topic_id not in seen_topic_ids:
-                recommendations.append({"topic_id": topic_id, "title": _format_topic_title(topic_id), "explanation": "This related topic might also be of interest."})
-                seen_topic_ids.add(topic_id)
-                
-    return jsonify({"recommendations": recommendations})
+    updates = _parse_profile_updates([{"query": data.get("query"), "topics": data.get("topics", [])}])
+    if 'user_id' not in data or updates is None:
+        return jsonify({"error": "Request must include 'user_id' and 'query' (and optionally a 'topics' list)"}), 400
+
+    profile, _ = _apply_profile_updates(data['user_id'], updates)
+    response_body = {"user_id": data['user_id'], "applied": 1}
+    if include_recommendations:
+        response_body["recommendations"] = _compute_recommendations(profile, pipeline)
+    return jsonify(response_body)
+
+@app.route('/api/profile/replay', methods=['POST'])
+def handle_profile_replay():
+    """
+    Replays a list of queries into a user's profile with one batched embedding
+    call. With `include_recommendations`, returns the recommendations the user
+    would have seen after each step.
+    """
+    data = request.get_json() or {}
+    include_recommendations = bool(data.get('include_recommendations', False))
+    unavailable = _pipeline_unavailable("models", *(["embedding_cache"] if include_recommendations else []))
+    if unavailable: return unavailable
+    pipeline, tenant_error = _request_pipeline()
+    if tenant_error: return tenant_error
+
+    updates = _parse_profile_updates(data.get("queries"))
+    if 'user_id' not in data or updates is None:
+        return jsonify({"error": "Request must include 'user_id' and a non-empty 'queries' list of {'query', 'topics'}"}), 400
+
+    user_id = data['user_id']
+    profile, steps = _apply_profile_updates(user_id, updates, reset=bool(data.get('reset', False)), keep_steps=include_recommendations)
+    print(f"Replayed {len(updates)} queries into the profile of user {user_id} in {round((time.time() - g.start_time) * 1000)} ms.")
+
+    response_body = {"user_id": user_id, "applied": len(updates)}
+    if include_recommendations:
+        response_body["steps"] = [
+            {"query": update["query"], "recommendations": _compute_recommendations(step, pipeline)}
+            for update, step in zip(updates, steps)
+        ]
+        response_body["recommendations"] = response_body["steps"][-1]["recommendations"]
+    return jsonify(response_body)
+
+@app.route('/api/recommendations/batch', methods=['POST'])
+def handle_recommendations_batch():
+    """
+    Scores many users in one matrix operation, reading the profile file once.
+    Without `user_ids`, every user with a profile vector is scored.
+    """
+    unavailable = _pipeline_unavailable("embedding_cache")
+    if unavailable: return unavailable
+    pipeline, tenant_error = _request_pipeline()
+    if tenant_error: return tenant_error
+
+    data = request.get_json() or {}
+    user_ids = data.get('user_ids')
+    if user_ids is not None and (not isinstance(user_ids, list) or not all(isinstance(u, str) for u in user_ids)):
+        return jsonify({"error": "'user_ids' must be a list of strings"}), 400
+
+    user_profiles = utils.load_user_profiles()
+    if user_ids is None:
+        user_ids = [user_id for user_id, profile in user_profiles.items() if profile.get("profile_vector")]
+    recommendations = recommender.recommend_for_users(
+        user_ids, user_profiles, pipeline.doc_embedding_matrix, pipeline.doc_topic_ids
+    )
+    unknown = [user_id for user_id in user_ids if not (user_profiles.get(user_id) or {}).get("profile_vector")]
+    # Profiles built with another embedding model get no recommendations instead of failing the batch.
+    mismatched = [user_id for user_id in user_ids
+                  if recommender.dimension_mismatch(user_profiles.get(user_id), pipeline.doc_embedding_matrix)]
+    return jsonify({"recommendations": recommendations, "unknown_users": unknown, "dimension_mismatch_users": mismatched})
 
 @app.route('/api/feedback', methods=['POST'])
 def handle_feedback():
@@ -204,8 +595,10 @@ def handle_feedback():
 
 @app.route('/api/get_document', methods=['POST'])
 def get_document_by_topic():
-    if not rag_pipeline.get_rag_pipeline_status():
-        return jsonify({"error": "The RAG pipeline is still initializing. Please try again shortly."}), 503
+    unavailable = _pipeline_unavailable("models", "embedding_cache")
+    if unavailable: return unavailable
+    pipeline, tenant_error = _request_pipeline()
+    if tenant_error: return tenant_error
 
     data = request.get_json()
     if not data or not all(k in data for k in ['topic', 'user_id']):
@@ -213,27 +606,31 @@ def get_document_by_topic():
     
     topic_to_find = utils.normalize_topic(data['topic'])
     user_id = data['user_id']
-    document_data = rag_pipeline.doc_embeddings_cache.get(topic_to_find)
+    document_data = pipeline.doc_embeddings_cache.get(topic_to_find)
 
     if not document_data:
         return jsonify({"answer": f"Sorry, I could not find a document for the topic: {topic_to_find}."}), 404
 
-    prompt = ChatPromptTemplate.from_template(
-        "You are an AI assistant. A user has requested information about '{topic}'. Below is the full text of the relevant document. "
-        "Provide a comprehensive summary of this document, capturing the key points clearly and in a friendly, helpful tone.\n\n"
-        "Document Content:\n---\n{context}\n---\n\nSummary:"
-    )
-    summarization_chain = prompt | rag_pipeline.llm | StrOutputParser()
-    
     token_callback = utils.TokenUsageCallback()
-    summary = summarization_chain.invoke(
-        {"topic": topic_to_find, "context": document_data['content']},
-        config={"callbacks": [token_callback]}
-    )
-    answer = f"{summary}\n\n**Source:** {topic_to_find}"
-    
-    query_for_profile = f"Please explain more about '{_format_topic_title(topic_to_find)}'"
-    _update_user_profile(user_id, query_for_profile, [topic_to_find])
+    degraded = []
+    deadline = _request_deadline(data)
+    no_cache = bool(data.get('no_cache', False))
+
+    def summarize():
+        result = rag_pipeline.summarize_document(pipeline, topic_to_find, document_data['content'], [token_callback], deadline,
+                                                 use_cache=not no_cache)
+        degraded.extend(result["degraded"])
+        return result["summary"]
+
+    # The profile update doesn't depend on the summary, so both run at once.
+    query_for_profile = f"Please explain more about '{recommender.format_topic_title(topic_to_find)}'"
+    graph = stage_graph.StageGraph()
+    graph.add("summary", summarize)
+    graph.add("profile", lambda: _update_user_profile(user_id, query_for_profile, [topic_to_find]))
+    if data.get('include_recommendations', False):
+        graph.add("recommendations", lambda profile: _compute_recommendations(profile, pipeline), after=["profile"])
+    stages = graph.wait()
+    answer = f"{stages['summary']}\n\n**Source:** {topic_to_find}"
     
     latency = (time.time() - g.start_time) * 1000
     input_tokens = token_callback.get_total_prompt_tokens()
@@ -241,14 +638,20 @@ def get_document_by_topic():
     cost = utils.calculate_cost(input_tokens, output_tokens)
 
     utils.log_query({
-        "timestamp": datetime.utcnow().isoformat(), "user_id": user_id,
+        "timestamp": datetime.utcnow().isoformat(), "request_id": g.request_id, "user_id": user_id,
         "query": query_for_profile, "answer": answer, "sources": [topic_to_find],
         "latency_ms": round(latency), "input_tokens": input_tokens,
         "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens,
-        "cost": cost
+        "cost": cost, "degraded": degraded, "stage_ms": graph.stage_ms, "no_cache": no_cache
     })
     
-    return jsonify({"answer": answer, "sources": [topic_to_find]})
+    response_body = {"answer": answer, "sources": [topic_to_find]}
+    if degraded:
+        response_body["degraded"] = degraded
+    if data.get('include_recommendations', False):
+        response_body["recommendations"] = stages["recommendations"]
+    response_body["usage"] = _usage_summary(latency, input_tokens, output_tokens, cost)
+    return jsonify(response_body)
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
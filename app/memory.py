@@ -0,0 +1,258 @@
+# app/memory.py
+# Memory accounting for the backend:
+# - a per-component breakdown (FAISS index, child and parent docstores,
+#   recommendation cache, embedding, retrieval, answer and summary caches,
+#   tenants) next to the process's resident memory, printed at startup and
+#   served at /api/admin/memory;
+# - optional periodic tracemalloc snapshots, each diffed against the previous
+#   one and against the first one taken after startup, so slow growth over a
+#   long uptime can be traced to the lines that allocate it;
+# - per-endpoint net traced allocations, to tell which requests the growth follows.
+#
+# Tracing is shared with request profiling (app/profiling.py) through
+# start_tracing()/stop_tracing(), so neither stops tracemalloc under the other.
+
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict, deque
+from datetime import datetime
+
+from . import config, telemetry
+
+# ==============================================================================
+# --- 1. SHARED TRACING ---
+# ==============================================================================
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+_tracing_started_here = False
+
+def start_tracing(frames: int = 1):
+    """Starts tracemalloc unless it's already running. Every call must be paired with stop_tracing()."""
+    global _tracing_users, _tracing_started_here
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            _tracing_started_here = True
+        _tracing_users += 1
+
+def stop_tracing():
+    """Stops tracemalloc once its last user is done, if it was started through start_tracing()."""
+    global _tracing_users, _tracing_started_here
+    with _tracing_lock:
+        _tracing_users = max(0, _tracing_users - 1)
+        if _tracing_users == 0 and _tracing_started_here:
+            tracemalloc.stop()
+            _tracing_started_here = False
+
+def traced_bytes():
+    """Current traced memory in bytes, or None when tracemalloc isn't running."""
+    return tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+
+# ==============================================================================
+# --- 2. COMPONENT BREAKDOWN ---
+# ==============================================================================
+def resident_bytes():
+    """The process's current resident set size, where the platform exposes it."""
+    try:
+        with open("/proc/self/statm", 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return None
+
+def deep_size(root) -> int:
+    """
+    Approximate heap size of an object graph: sys.getsizeof over every object
+    reachable through containers and instance attributes, counting shared
+    objects once. numpy arrays count their buffer only if they own it, so
+    views into memory-mapped files cost just their header.
+    """
+    import numpy as np
+
+    seen, stack, total = set(), [root], 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, type):
+            continue
+        seen.add(id(obj))
+        if isinstance(obj, np.ndarray):
+            total += sys.getsizeof(obj) if not obj.flags.owndata else obj.nbytes + sys.getsizeof(obj)
+            continue
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            stack.extend(obj)
+        elif hasattr(obj, "__dict__"):
+            stack.append(vars(obj))
+    return total
+
+def _mb(num_bytes) -> float:
+    return None if num_bytes is None else round(num_bytes / 1e6, 2)
+
+def component_breakdown(pipeline=None) -> dict:
+    """
+    Estimated memory of each long-lived component of a pipeline snapshot (the
+    default knowledge base's unless given), in MB. Memory-mapped components
+    are reported separately: their pages are shared between workers and only
+    count towards a process's resident memory once touched.
+    """
+    import numpy as np
+    from . import rag_pipeline, tenants
+
+    pipeline = pipeline or rag_pipeline.get_snapshot()
+    components = {}
+    if pipeline.retriever is not None:
+        vectorstore = pipeline.retriever.vectorstore
+        index = vectorstore.index
+        components["faiss_index"] = {
+            "mb": _mb(index.ntotal * getattr(index, "code_size", index.d * 4)), "vectors": index.ntotal, "memory_mapped": True,
+            # False while sharded search has released the backend's copy (app/sharding.py).
+            "mapped_in_backend": getattr(index, "loaded", True),
+        }
+        child_docs = getattr(vectorstore.docstore, "_dict", {})
+        components["faiss_child_docstore"] = {"mb": _mb(deep_size(child_docs) + deep_size(vectorstore.index_to_docstore_id)),
+                                              "documents": len(child_docs)}
+        parents = pipeline.retriever.docstore.store
+        components["parent_docstore"] = {"mb": _mb(deep_size(parents)), "documents": len(parents)}
+    if pipeline.doc_embedding_matrix is not None:
+        components["doc_embedding_matrix"] = {"mb": _mb(pipeline.doc_embedding_matrix.nbytes), "topics": len(pipeline.doc_topic_ids),
+                                              "memory_mapped": isinstance(pipeline.doc_embedding_matrix, np.memmap)}
+        # Content strings and per-topic views into the matrix above.
+        components["doc_embeddings_cache"] = {"mb": _mb(deep_size(pipeline.doc_embeddings_cache)), "topics": len(pipeline.doc_embeddings_cache)}
+    if rag_pipeline.embeddings is not None:
+        components["embedding_cache"] = {"mb": _mb(deep_size(rag_pipeline.embeddings._memory)), "entries": len(rag_pipeline.embeddings._memory)}
+    if rag_pipeline.retrieval_cache is not None:
+        components["retrieval_cache"] = {"mb": _mb(deep_size(rag_pipeline.retrieval_cache._entries)), "entries": len(rag_pipeline.retrieval_cache._entries)}
+    for name in ("answer_cache", "summary_cache"):
+        cache = getattr(rag_pipeline, name)
+        if cache is not None:
+            components[name] = {"mb": _mb(deep_size(cache._entries)), "entries": len(cache._entries)}
+    tenant_status = tenants.registry.status()
+    components["tenants"] = {"mb": tenant_status["memory_used_mb"], "loaded": len(tenant_status["loaded"]), "estimated": True}
+    return components
+
+_startup_report = None
+
+def memory_report(include_components: bool = True) -> dict:
+    """Resident memory (with growth since startup), the component breakdown and tracing state."""
+    rss = resident_bytes()
+    report = {"rss_mb": _mb(rss), "timestamp": datetime.utcnow().isoformat()}
+    if _startup_report is not None and rss is not None and _startup_report["rss_mb"] is not None:
+        report["rss_growth_since_startup_mb"] = round(report["rss_mb"] - _startup_report["rss_mb"], 2)
+    if include_components:
+        components = component_breakdown()
+        report["components"] = components
+        accounted = sum(c["mb"] or 0 for c in components.values() if not c.get("memory_mapped"))
+        report["accounted_heap_mb"] = round(accounted, 2)
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        report["traced"] = {"current_mb": _mb(current), "peak_mb": _mb(peak)}
+    return report
+
+def log_startup_report():
+    """Prints the component breakdown once the pipeline is loaded and keeps it as the growth baseline."""
+    global _startup_report
+    _startup_report = memory_report()
+    print(f"Memory after startup: {_startup_report['rss_mb']} MB resident, "
+          f"~{_startup_report['accounted_heap_mb']} MB of it in the components below.")
+    for name, component in _startup_report["components"].items():
+        details = ", ".join(f"{key}={value}" for key, value in component.items() if key != "mb")
+        print(f"   {name:<22} {component['mb']:>9} MB  ({details})")
+    return _startup_report
+
+# ==============================================================================
+# --- 3. PER-ENDPOINT ALLOCATIONS ---
+# ==============================================================================
+_endpoint_lock = threading.Lock()
+_endpoint_stats = defaultdict(lambda: {"requests": 0, "net_bytes": 0, "max_net_bytes": 0})
+
+def record_request(endpoint: str, traced_before):
+    """
+    Adds a request's net traced allocation (memory still held when it
+    returned) to its endpoint's totals. Concurrent requests share one traced
+    counter, so under load the numbers are indicative rather than exact.
+    """
+    traced_after = traced_bytes()
+    if traced_before is None or traced_after is None:
+        return
+    net = traced_after - traced_before
+    with _endpoint_lock:
+        stats = _endpoint_stats[endpoint]
+        stats["requests"] += 1
+        stats["net_bytes"] += net
+        stats["max_net_bytes"] = max(stats["max_net_bytes"], net)
+
+def endpoint_report() -> dict:
+    with _endpoint_lock:
+        return {endpoint: {"requests": s["requests"], "net_mb": _mb(s["net_bytes"]), "max_net_mb": _mb(s["max_net_bytes"]),
+                           "avg_net_kb": round(s["net_bytes"] / s["requests"] / 1e3, 1) if s["requests"] else None}
+                for endpoint, s in _endpoint_stats.items()}
+
+# ==============================================================================
+# --- 4. PERIODIC SNAPSHOTS ---
+# ==============================================================================
+_snapshot_diffs = deque(maxlen=config.MEMORY_SNAPSHOT_HISTORY)
+_snapshot_filters = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+def _top_growth(snapshot, reference, limit: int) -> list:
+    return [{"location": str(stat.traceback), "size_diff_kb": round(stat.size_diff / 1e3, 1), "size_kb": round(stat.size / 1e3, 1),
+             "count_diff": stat.count_diff}
+            for stat in snapshot.compare_to(reference, 'lineno')[:limit]]
+
+def snapshot_report() -> list:
+    return list(_snapshot_diffs)
+
+def start_snapshot_watcher(interval_seconds: float = None):
+    """
+    Starts tracing and a daemon thread that snapshots allocations every
+    interval, keeping the top growth against the previous snapshot and against
+    the first one. Returns the thread, or None when disabled.
+    """
+    interval_seconds = config.MEMORY_SNAPSHOT_INTERVAL_SECONDS if interval_seconds is None else interval_seconds
+    if interval_seconds <= 0:
+        return None
+    start_tracing(config.MEMORY_TRACE_FRAMES)
+
+    def watch():
+        baseline = previous = tracemalloc.take_snapshot().filter_traces(_snapshot_filters)
+        while True:
+            time.sleep(interval_seconds)
+            snapshot = tracemalloc.take_snapshot().filter_traces(_snapshot_filters)
+            traced, _ = tracemalloc.get_traced_memory()
+            since_start = _top_growth(snapshot, baseline, config.MEMORY_DIFF_TOP_N)
+            _snapshot_diffs.append({
+                "timestamp": datetime.utcnow().isoformat(), "traced_mb": _mb(traced), "rss_mb": _mb(resident_bytes()),
+                "since_previous": _top_growth(snapshot, previous, config.MEMORY_DIFF_TOP_N),
+                "since_start": since_start,
+                "endpoints": endpoint_report(),
+            })
+            previous = snapshot
+            if since_start and since_start[0]["size_diff_kb"] > 0:
+                print(f"Memory snapshot: {_mb(traced)} MB traced; largest growth since start: "
+                      f"{since_start[0]['location']} (+{since_start[0]['size_diff_kb']} KB).")
+
+    thread = threading.Thread(target=watch, name="memory-snapshots", daemon=True)
+    thread.start()
+    print(f"Taking allocation snapshots every {interval_seconds:g} s.")
+    return thread
+
+def update_gauges():
+    rss = resident_bytes()
+    if rss is not None:
+        telemetry.PROCESS_RESIDENT_BYTES.set(rss)
+    if tracemalloc.is_tracing():
+        telemetry.TRACED_MEMORY_BYTES.set(tracemalloc.get_traced_memory()[0])
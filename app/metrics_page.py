@@ -5,10 +5,15 @@ import json
 import os
 import sys
 import subprocess
+import requests
 # --- FIX: Use an absolute import from the 'app' package ---
 from app import config 
+from app.client import get_default_client
 
 EVALUATION_RESULTS_PATH = "evaluation_results.json"
+EVALUATION_HISTORY_DIR = "evaluation_history"
+# evaluation.py exits with this code when the run regresses against its baseline.
+REGRESSION_EXIT_CODE = 2
 
 def run_evaluation():
     """Triggers the evaluation.py script as a subprocess."""
@@ -35,7 +40,13 @@ def run_evaluation():
             st.success("✅ Evaluation complete!")
             
     except subprocess.CalledProcessError as e:
-        st.error(f"Evaluation script failed with exit code {e.returncode}.")
+        if e.returncode == REGRESSION_EXIT_CODE:
+            st.warning("Evaluation finished, but the run regressed against the baseline. See the log for details.")
+            if os.path.exists(EVALUATION_RESULTS_PATH):
+                with open(EVALUATION_RESULTS_PATH, 'r') as f:
+                    st.session_state.evaluation_results = json.load(f)
+        else:
+            st.error(f"Evaluation script failed with exit code {e.returncode}.")
         st.session_state.evaluation_output = e.stdout + "\n" + e.stderr
     except FileNotFoundError:
         st.error("Could not find the `evaluation.py` script. Make sure it is in the project root directory.")
@@ -71,10 +82,61 @@ def reset_metrics():
     st.rerun()
 
 
+def display_backend_status():
+    """Shows the backend's startup report, stage by stage."""
+    try:
+        report = get_default_client().health(timeout=3)
+    except requests.exceptions.RequestException:
+        st.error(f"Backend is not reachable at `{config.API_BASE_URL}`.")
+        return
+
+    status_labels = {"ready": "🟢 Ready", "initializing": "🟡 Initializing", "failed": "🔴 Initialization failed"}
+    col1, col2 = st.columns(2)
+    col1.metric("Backend Status", status_labels.get(report.get("status"), report.get("status")))
+    col2.metric("Startup Time (ms)", report.get("elapsed_ms") or "-")
+    if report.get("status") != "ready":
+        stages = pd.DataFrame.from_dict(report.get("stages", {}), orient="index")
+        st.dataframe(stages, use_container_width=True)
+
+def load_evaluation_history() -> pd.DataFrame:
+    """Loads every stored evaluation run into one row per run."""
+    rows = []
+    if not os.path.isdir(EVALUATION_HISTORY_DIR):
+        return pd.DataFrame(rows)
+    for filename in sorted(os.listdir(EVALUATION_HISTORY_DIR)):
+        if not filename.endswith('.json'):
+            continue
+        with open(os.path.join(EVALUATION_HISTORY_DIR, filename), 'r') as f:
+            run = json.load(f)
+        perf = run.get('performance_summary', {})
+        rows.append({
+            "timestamp": pd.to_datetime(run['run']['timestamp']),
+            "answer_score": run['rag_summary']['avg_answer_score'],
+            "retrieval_score": run['rag_summary']['avg_retrieval_score'],
+            "rec_hit_rate": run['rec_summary']['hit_rate'],
+            "latency_p50_ms": perf.get('latency_ms', {}).get('p50'),
+            "latency_p95_ms": perf.get('latency_ms', {}).get('p95'),
+            "avg_tokens": perf.get('avg_total_tokens'),
+            "total_cost": perf.get('total_cost'),
+        })
+    return pd.DataFrame(rows)
+
+def display_evaluation_trends():
+    """Charts quality and performance across all stored evaluation runs."""
+    history_df = load_evaluation_history()
+    if len(history_df) < 2:
+        return
+    history_df = history_df.set_index('timestamp')
+    st.markdown("#### Trends Across Evaluation Runs")
+    st.line_chart(history_df[['answer_score', 'retrieval_score', 'rec_hit_rate']])
+    st.line_chart(history_df[['latency_p50_ms', 'latency_p95_ms']])
+    st.line_chart(history_df[['avg_tokens']])
+
 def display_metrics():
     """Renders the content of the metrics dashboard."""
     st.header("📊 Metrics Dashboard")
     st.markdown("This dashboard provides real-time insights into the AI's performance, cost, and user satisfaction.")
+    display_backend_status()
 
     # --- NEW: Evaluation Section ---
     st.markdown("---")
@@ -95,9 +157,22 @@ def display_metrics():
         col2.metric("RAG Retrieval Score", f"{rag_summary['avg_retrieval_score']:.1%}", help="Source retrieval accuracy (recall)")
         col3.metric("Rec. Hit Rate", f"{rec_summary['hit_rate']:.1%}", help="Correctly predicted next topic")
 
+        perf_summary = results.get('performance_summary')
+        if perf_summary and perf_summary['latency_ms']['p50'] is not None:
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Latency p50 / p95 (ms)", f"{perf_summary['latency_ms']['p50']:.0f} / {perf_summary['latency_ms']['p95']:.0f}")
+            col2.metric("Avg. Tokens per Question", f"{perf_summary['avg_total_tokens'] or 0:.0f}")
+            col3.metric("Evaluation Cost (USD)", f"${perf_summary['total_cost']:.4f}")
+
+        regressions = results.get('baseline_comparison', {}).get('regressions', [])
+        if regressions:
+            st.warning("Regressions against the baseline:\n" + "\n".join(f"- {r}" for r in regressions))
+
         with st.expander("Show Detailed RAG Results"):
             st.dataframe(pd.DataFrame(results['rag_details']), use_container_width=True)
 
+    display_evaluation_trends()
+
     if 'evaluation_output' in st.session_state and st.session_state.evaluation_output:
         with st.expander("Show Full Evaluation Log"):
             st.code(st.session_state.evaluation_output, language='bash')
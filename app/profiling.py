@@ -0,0 +1,213 @@
+# app/profiling.py
+# Opt-in, per-request profiling. A profiled request writes a CPU profile
+# (`<request_id>.prof`, readable with pstats/snakeviz), an allocation diff
+# (`<request_id>.alloc.txt`) and a small metadata file to PROFILES_DIR. The
+# request ID is also stored in the query log, so profiles can be matched to it.
+#
+# Aggregate the top functions across many captured profiles with:
+#   python -m app.profiling [--sort cumulative] [--limit 30] [--endpoint /api/query]
+
+import argparse
+import contextvars
+import cProfile
+import functools
+import glob
+import json
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+from . import config, memory
+
+# Only one request is profiled at a time; concurrent candidates are skipped.
+_profiling_slot = threading.Lock()
+_active_session = None
+# The session of the request a thread is working for. Set on the request thread,
+# carried into pool threads by `bind()`, and copied into LangChain's executors.
+_current_session = contextvars.ContextVar("profiling_session", default=None)
+
+# Profile files are named after the request ID, so only IDs of this shape are accepted.
+REQUEST_ID_PATTERN = re.compile(r"^[0-9a-f-]{1,64}$")
+
+def should_profile(headers, is_admin: bool) -> bool:
+    """
+    The profiling header is honoured from admins (valid X-Admin-Token), or from
+    anyone while profiling is enabled; otherwise requests are only sampled.
+    """
+    if headers.get(config.PROFILING_HEADER, "").lower() in ("1", "true", "yes") and (is_admin or config.PROFILING_ENABLED):
+        return True
+    return config.PROFILING_ENABLED and random.random() < config.PROFILING_SAMPLE_RATE
+
+def _profile_new_thread(frame, event, arg):
+    """
+    Installed with threading.setprofile in threads started while a request is
+    profiled (such as LangChain's per-call executors, which copy the caller's
+    context). Attaches a profiler once the thread runs work for the profiled
+    request; threads working for other requests are left alone, and the hook
+    removes itself once the session is over.
+    """
+    session = _active_session
+    if session is None:
+        sys.setprofile(None)
+    elif _current_session.get() is session:
+        sys.setprofile(None)
+        session.add_thread_profiler()
+
+def bind(fn):
+    """
+    Wraps a callable submitted to a long-lived thread pool, so that it is
+    profiled with the request submitting it. The pool thread enables its own
+    profiler and disables it again when the call returns. A no-op unless the
+    calling request is being profiled.
+    """
+    session = _current_session.get()
+    if session is None:
+        return fn
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        # Drop a pending new-thread hook, so it can't attach a profiler that nobody disables.
+        sys.setprofile(None)
+        token = _current_session.set(session)
+        profiler = None
+        if sys.version_info < (3, 12) and _active_session is session:
+            profiler = session.add_thread_profiler()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            _current_session.reset(token)
+    return run
+
+class RequestProfiler:
+    """
+    Captures a CPU profile and an allocation snapshot diff for one request.
+    Work the request hands to the app's thread pools is profiled through
+    `bind()`, and threads LangChain starts for it through the new-thread hook.
+    On Python 3.12+ cProfile already covers every thread.
+    """
+    def __init__(self, request_id: str, endpoint: str):
+        self.request_id = request_id
+        self.endpoint = endpoint
+        self._profilers = []
+        self._lock = threading.Lock()
+        self._tracing = False
+
+    @classmethod
+    def start(cls, request_id: str, endpoint: str):
+        """Returns a running profiler, or None if another request is being profiled."""
+        global _active_session
+        if not REQUEST_ID_PATTERN.match(request_id):
+            raise ValueError(f"Invalid request ID for a profile file name: {request_id!r}")
+        if not _profiling_slot.acquire(blocking=False):
+            return None
+        session = cls(request_id, endpoint)
+        try:
+            # Shared with the memory snapshots, which may already be tracing.
+            memory.start_tracing(25)
+            session._tracing = True
+            session._snapshot_before = tracemalloc.take_snapshot()
+            session._started_at = time.perf_counter()
+            _active_session = session
+            session._context_token = _current_session.set(session)
+            if sys.version_info < (3, 12):
+                threading.setprofile(_profile_new_thread)
+            session.add_thread_profiler()
+        except Exception:
+            session._release()
+            raise
+        return session
+
+    def add_thread_profiler(self):
+        """Starts a profiler on the calling thread. The same thread must disable it."""
+        profiler = cProfile.Profile()
+        profiler.enable()
+        with self._lock:
+            self._profilers.append(profiler)
+        return profiler
+
+    def _release(self):
+        global _active_session
+        threading.setprofile(None)
+        _active_session = None
+        token = getattr(self, "_context_token", None)
+        if token is not None:
+            try:
+                _current_session.reset(token)
+            except ValueError:
+                _current_session.set(None)  # Stopped from another context.
+        if self._tracing:
+            memory.stop_tracing()
+        _profiling_slot.release()
+
+    def stop(self, status_code: int):
+        """Stops profiling and writes the profile, allocation diff and metadata files."""
+        try:
+            # Profilers only stop on the thread that enabled them: this one stops the
+            # request thread's, and bound pool threads stopped theirs when their call returned.
+            self._profilers[0].disable()
+            with self._lock:
+                profilers = list(self._profilers)
+            duration_ms = round((time.perf_counter() - self._started_at) * 1000)
+            snapshot_after = tracemalloc.take_snapshot()
+            _, peak_bytes = tracemalloc.get_traced_memory()
+
+            os.makedirs(config.PROFILES_DIR, exist_ok=True)
+            base_path = os.path.join(config.PROFILES_DIR, self.request_id)
+            stats = pstats.Stats(*profilers)
+            stats.dump_stats(f"{base_path}.prof")
+
+            top_allocations = snapshot_after.compare_to(self._snapshot_before, 'lineno')[:30]
+            with open(f"{base_path}.alloc.txt", 'w', encoding='utf-8') as f:
+                f.write(f"Top allocation growth for request {self.request_id} ({self.endpoint})\n\n")
+                f.write("\n".join(str(stat) for stat in top_allocations) + "\n")
+
+            with open(f"{base_path}.json", 'w', encoding='utf-8') as f:
+                json.dump({
+                    "request_id": self.request_id, "endpoint": self.endpoint, "status": status_code,
+                    "timestamp": datetime.utcnow().isoformat(), "duration_ms": duration_ms,
+                    "threads_profiled": len(profilers), "traced_peak_bytes": peak_bytes,
+                }, f, indent=4)
+            print(f"Saved request profile to '{base_path}.prof'.")
+        finally:
+            self._release()
+
+# ==============================================================================
+# --- AGGREGATION CLI ---
+# ==============================================================================
+def aggregate_profiles(profiles_dir: str, endpoint: str = None):
+    """Merges every captured profile (optionally for one endpoint) into a single pstats.Stats."""
+    paths = []
+    for path in sorted(glob.glob(os.path.join(profiles_dir, "*.prof"))):
+        meta_path = path[:-len(".prof")] + ".json"
+        if endpoint and os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                if json.load(f).get("endpoint") != endpoint:
+                    continue
+        paths.append(path)
+    return (pstats.Stats(*paths) if paths else None), len(paths)
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregate the top functions across captured request profiles.")
+    parser.add_argument("--dir", default=config.PROFILES_DIR, help="Directory containing the .prof files.")
+    parser.add_argument("--sort", default="cumulative", choices=["cumulative", "tottime", "ncalls"], help="Sort key.")
+    parser.add_argument("--limit", type=int, default=30, help="Number of functions to show.")
+    parser.add_argument("--endpoint", default=None, help="Only include profiles for this endpoint (e.g. /api/query).")
+    args = parser.parse_args()
+
+    stats, count = aggregate_profiles(args.dir, args.endpoint)
+    if stats is None:
+        print(f"No profiles found in '{args.dir}'.")
+        return
+    print(f"Aggregated {count} profiles from '{args.dir}'.")
+    stats.strip_dirs().sort_stats(args.sort).print_stats(args.limit)
+
+if __name__ == "__main__":
+    main()
@@ -3,141 +3,747 @@
 # --- Core Imports ---
 import os
 import json
+import hashlib
 import pickle
 import threading
+import time
+from datetime import datetime
+from contextlib import contextmanager
 
 # --- Third-party Imports ---
-from langchain_community.document_loaders import DirectoryLoader, TextLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings, GoogleGenerativeAI
-from langchain_community.vectorstores import FAISS
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.chains import create_history_aware_retriever, create_retrieval_chain
-from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain.retrievers import ParentDocumentRetriever
-from langchain.storage import InMemoryStore
+# LangChain, FAISS and the Google SDK are imported lazily inside the
+# initialization stage that first needs them. Importing this module (and
+# therefore `app.main`) stays cheap, so the API can answer health checks and
+# serve lightweight endpoints while the heavy stack is still loading.
 
 # --- Local Application Imports ---
-from . import config
+from . import config, rewriting, telemetry, utils
 
 # ==============================================================================
 # --- 1. GLOBAL STATE VARIABLES ---
 # ==============================================================================
 embeddings, llm, retriever, rag_chain = None, None, None, None
+# The chain's parts, for callers that run its stages themselves (batching, deadlines).
+rewrite_chain, cached_retriever, question_answer_chain = None, None, None
 doc_embeddings_cache = {}
+# Read-only (memory-mapped) matrix of document embeddings; row i belongs to doc_topic_ids[i].
+doc_embedding_matrix, doc_topic_ids = None, []
+build_lock = utils.InterProcessLock(config.BUILD_LOCK_PATH)
+# Identifies the knowledge base and settings the loaded index was built from.
+index_version = None
+retrieval_cache = None
+# Finished answers (history-free questions) and document summaries, by index version.
+answer_cache, summary_cache = None, None
+# Scatter-gather search over shard processes, when RAG_SEARCH_SHARDS is set (app/sharding.py).
+shard_coordinator = None
 initialization_lock = threading.Lock()
 initialization_done = False
 
+# The knowledge-base-dependent globals are replaced together under `swap_lock`
+# on reload; request handlers read them through `get_snapshot()`.
+swap_lock = threading.Lock()
+reload_lock = threading.Lock()
+reload_status = {"state": "idle", "trigger": None, "from_version": None, "to_version": None,
+                 "started_at": None, "duration_ms": None, "error": None}
+
+# Ordered list of initialization stages. Each stage is reported individually
+# through `get_initialization_report()` so clients can tell "booting" from "broken".
+INITIALIZATION_STAGES = ("models", "index_load", "docstore", "embedding_cache", "chain")
+stage_lock = threading.Lock()
+stage_status = {name: {"state": "pending", "duration_ms": None, "error": None} for name in INITIALIZATION_STAGES}
+initialization_started_at = None
+initialization_finished_at = None
+
 # ==============================================================================
-# --- 2. PIPELINE INITIALIZATION ---
+# --- 2. STAGE TRACKING ---
 # ==============================================================================
 def get_rag_pipeline_status():
     return initialization_done
 
+class PipelineSnapshot:
+    """
+    A consistent view of everything built from one version of the knowledge base.
+    Handlers take one at the start of a request, so a reload that swaps the
+    globals mid-request can't mix components from two versions.
+    """
+    def __init__(self, index_version, retriever, rag_chain, rewrite_chain, cached_retriever, question_answer_chain,
+                 doc_embeddings_cache, doc_embedding_matrix, doc_topic_ids):
+        self.index_version = index_version
+        self.retriever = retriever
+        self.rag_chain = rag_chain
+        self.rewrite_chain = rewrite_chain
+        self.cached_retriever = cached_retriever
+        self.question_answer_chain = question_answer_chain
+        self.doc_embeddings_cache = doc_embeddings_cache
+        self.doc_embedding_matrix = doc_embedding_matrix
+        self.doc_topic_ids = doc_topic_ids
+
+def get_snapshot() -> PipelineSnapshot:
+    with swap_lock:
+        return PipelineSnapshot(index_version, retriever, rag_chain, rewrite_chain, cached_retriever, question_answer_chain,
+                                doc_embeddings_cache, doc_embedding_matrix, doc_topic_ids)
+
+def is_stage_ready(stage: str) -> bool:
+    """Returns True once the given initialization stage has completed successfully."""
+    return stage_status[stage]["state"] == "done"
+
+def get_initialization_report() -> dict:
+    """Returns a snapshot of per-stage progress and overall startup timing."""
+    with stage_lock:
+        stages = {name: dict(info) for name, info in stage_status.items()}
+    failed = any(info["state"] == "failed" for info in stages.values())
+    if initialization_done:
+        status = "ready"
+    elif failed:
+        status = "failed"
+    else:
+        status = "initializing"
+
+    elapsed_ms = None
+    if initialization_started_at is not None:
+        end = initialization_finished_at or time.perf_counter()
+        elapsed_ms = round((end - initialization_started_at) * 1000)
+    return {"status": status, "ready": initialization_done, "elapsed_ms": elapsed_ms, "stages": stages}
+
+@contextmanager
+def _stage(name: str):
+    """Marks a stage as running, then done or failed, recording its duration."""
+    with stage_lock:
+        stage_status[name].update(state="running", duration_ms=None, error=None)
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        with stage_lock:
+            stage_status[name].update(state="failed", duration_ms=round((time.perf_counter() - started) * 1000), error=str(e))
+        raise
+    duration_ms = round((time.perf_counter() - started) * 1000)
+    with stage_lock:
+        stage_status[name].update(state="done", duration_ms=duration_ms)
+    print(f"⏱️ Stage '{name}' finished in {duration_ms} ms.")
+
+# ==============================================================================
+# --- 3. SHARED ARTIFACT BUILD ---
+# ==============================================================================
+def embedding_model_name() -> str:
+    """Identifies the embedding model in cache keys and index versions."""
+    return "stand-in/hash-embeddings-256" if config.MODEL_BACKEND == "stand-in" else config.EMBEDDING_MODEL
+
+def _create_models():
+    from .embedding_cache import CachedEmbeddings
+    if config.MODEL_BACKEND == "stand-in":
+        from .stand_ins import DelayedFakeLLM, HashEmbeddings
+        base_embeddings = HashEmbeddings(size=256)
+        llm = DelayedFakeLLM(delay_seconds=config.STAND_IN_LLM_DELAY_SECONDS, tail_probability=config.STAND_IN_LLM_TAIL_PROBABILITY,
+                             tail_delay_seconds=config.STAND_IN_LLM_TAIL_DELAY_SECONDS)
+    else:
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings, GoogleGenerativeAI
+        base_embeddings = GoogleGenerativeAIEmbeddings(model=config.EMBEDDING_MODEL)
+        llm = GoogleGenerativeAI(model=config.LLM_MODEL, temperature=config.LLM_TEMPERATURE, timeout=config.LLM_REQUEST_TIMEOUT_SECONDS)
+    embeddings = CachedEmbeddings(base_embeddings, model_name=embedding_model_name())
+    return embeddings, llm
+
+def _make_splitters():
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    parent_splitter = RecursiveCharacterTextSplitter(chunk_size=config.PARENT_CHUNK_SIZE, chunk_overlap=config.PARENT_CHUNK_OVERLAP)
+    child_splitter = RecursiveCharacterTextSplitter(chunk_size=config.CHILD_CHUNK_SIZE, chunk_overlap=config.CHILD_CHUNK_OVERLAP)
+    return parent_splitter, child_splitter
+
+def _artifact_path(path: str, cache_dir: str = None) -> str:
+    """A path from the config, or the file of the same name under another cache directory (e.g. a tenant's)."""
+    return path if cache_dir is None else os.path.join(cache_dir, os.path.relpath(path, config.CACHE_DIR))
+
+_build_locks = {}
+_build_locks_guard = threading.Lock()
+
+def get_build_lock(cache_dir: str = None) -> "utils.InterProcessLock":
+    """The build lock of a cache directory. One instance per directory, since the lock is re-entrant per instance."""
+    if cache_dir is None:
+        return build_lock
+    with _build_locks_guard:
+        if cache_dir not in _build_locks:
+            _build_locks[cache_dir] = utils.InterProcessLock(_artifact_path(config.BUILD_LOCK_PATH, cache_dir))
+        return _build_locks[cache_dir]
+
+def _topic_from_source(source: str) -> str:
+    return os.path.splitext(os.path.basename(source))[0]
+
+def _atomic_write(path: str, mode: str, writer):
+    """Writes a file under a temporary name and renames it into place."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    encoding = None if 'b' in mode else 'utf-8'
+    with open(tmp_path, mode, encoding=encoding) as f:
+        writer(f)
+    os.replace(tmp_path, path)
+
+def compute_index_version(knowledge_base_path: str = None) -> str:
+    """Hashes the knowledge-base files together with the settings that shape the index."""
+    knowledge_base_path = knowledge_base_path or config.KNOWLEDGE_BASE_PATH
+    digest = hashlib.sha256(json.dumps({
+        "embedding_model": embedding_model_name(),
+        "chunking": [config.PARENT_CHUNK_SIZE, config.PARENT_CHUNK_OVERLAP, config.CHILD_CHUNK_SIZE, config.CHILD_CHUNK_OVERLAP],
+    }, sort_keys=True).encode('utf-8'))
+    for root, dirs, files in os.walk(knowledge_base_path):
+        dirs.sort()
+        for name in sorted(files):
+            if not name.endswith('.md'):
+                continue
+            path = os.path.join(root, name)
+            digest.update(os.path.relpath(path, knowledge_base_path).replace(os.sep, '/').encode('utf-8'))
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+def _prebuilt_artifacts() -> bool:
+    """Whether the artifacts come from a separate build step (shared mode or a bundle) instead of this process."""
+    return config.SHARED_ARTIFACTS_MODE or bool(config.ARTIFACT_BUNDLE_PATH)
+
+def _artifacts_ready(cache_dir: str = None) -> bool:
+    """The manifest is written last, so its presence marks a complete build."""
+    return all(os.path.exists(_artifact_path(path, cache_dir)) for path in (
+        os.path.join(config.VECTORSTORE_PATH, 'index.faiss'), config.DOCSTORE_PATH,
+        config.DOC_EMBEDDINGS_PATH, config.DOC_EMBEDDINGS_INDEX_PATH, config.ARTIFACT_MANIFEST_PATH,
+    ))
+
+def _ingest_knowledge_base(embeddings, cache_dir: str = None, knowledge_base_path: str = None):
+    """Runs the full ingestion and saves the FAISS index and parent docstore to the cache."""
+    from langchain_community.document_loaders import DirectoryLoader, TextLoader
+    from langchain_community.vectorstores import FAISS
+    from langchain.retrievers import ParentDocumentRetriever
+    from langchain.storage import InMemoryStore
+
+    print("Performing full data ingestion...")
+    vectorstore_path, docstore_path = _artifact_path(config.VECTORSTORE_PATH, cache_dir), _artifact_path(config.DOCSTORE_PATH, cache_dir)
+    os.makedirs(cache_dir or config.CACHE_DIR, exist_ok=True)
+    loader = DirectoryLoader(knowledge_base_path or config.KNOWLEDGE_BASE_PATH, glob="**/*.md", loader_cls=TextLoader, show_progress=True, use_multithreading=True, loader_kwargs={"encoding": "utf-8"})
+    all_docs = loader.load()
+
+    vectorstore = FAISS.from_texts(texts=["_"], embedding=embeddings) # Dummy init
+    store = InMemoryStore()
+
+    parent_splitter, child_splitter = _make_splitters()
+    temp_retriever = ParentDocumentRetriever(vectorstore=vectorstore, docstore=store, child_splitter=child_splitter, parent_splitter=parent_splitter)
+    print(f"Adding {len(all_docs)} documents to the retriever...")
+    temp_retriever.add_documents(all_docs, ids=None)
+
+    # Tag parents with their topic before pickling so workers don't have to.
+    for doc in store.mget(list(store.yield_keys())):
+        doc.metadata['topic'] = _topic_from_source(doc.metadata['source'])
+
+    print("Saving populated components to cache...")
+    # Save next to the live files and swap them in, so a forced rebuild never
+    # truncates an index that running workers still have memory-mapped.
+    staging_path = f"{vectorstore_path}.{os.getpid()}.tmp"
+    temp_retriever.vectorstore.save_local(staging_path)
+    os.makedirs(vectorstore_path, exist_ok=True)
+    for filename in os.listdir(staging_path):
+        os.replace(os.path.join(staging_path, filename), os.path.join(vectorstore_path, filename))
+    os.rmdir(staging_path)
+    _atomic_write(docstore_path, 'wb', lambda f: pickle.dump(store, f))
+    print("✅ Ingestion complete and components cached.")
+    return store
+
+def _compute_doc_embeddings(store, embeddings, cache_dir: str = None):
+    """Embeds one representative parent chunk per topic and saves the matrix to the cache."""
+    import numpy as np
+
+    # The last parent chunk of each topic represents it, as the in-memory cache always did.
+    topic_doc_ids = {}
+    all_doc_ids = list(store.yield_keys())
+    for doc_id, doc in zip(all_doc_ids, store.mget(all_doc_ids)):
+        topic_doc_ids[_topic_from_source(doc.metadata['source'])] = doc_id
+    topics = list(topic_doc_ids)
+    docs = store.mget([topic_doc_ids[topic] for topic in topics])
+
+    print(f"Embedding {len(docs)} documents for recommendations...")
+    # Query embeddings, as before, but batched into one model call instead of one per topic.
+    texts = [doc.page_content for doc in docs]
+    if hasattr(embeddings, "embed_queries"):
+        vectors = embeddings.embed_queries(texts)
+    else:
+        vectors = [embeddings.embed_query(text) for text in texts]
+    matrix = np.array(vectors, dtype=np.float32)
+    _atomic_write(_artifact_path(config.DOC_EMBEDDINGS_PATH, cache_dir), 'wb', lambda f: np.save(f, matrix))
+    _atomic_write(_artifact_path(config.DOC_EMBEDDINGS_INDEX_PATH, cache_dir), 'w', lambda f: json.dump(
+        [{"topic": topic, "doc_id": topic_doc_ids[topic]} for topic in topics], f, indent=4))
+    return len(topics)
+
+def build_artifacts(embeddings=None, force: bool = False, cache_dir: str = None, knowledge_base_path: str = None) -> dict:
+    """
+    One-time build step for every serving artifact: FAISS index, parent docstore,
+    document-embedding matrix and manifest. Safe to call from several processes at
+    once; only the first one builds, the others wait and reuse the result.
+    `cache_dir` and `knowledge_base_path` select another knowledge base (a tenant's).
+    """
+    manifest_path = _artifact_path(config.ARTIFACT_MANIFEST_PATH, cache_dir)
+    with get_build_lock(cache_dir):
+        current_version = compute_index_version(knowledge_base_path)
+        built_version = _load_manifest(cache_dir)["index_version"] if os.path.exists(manifest_path) else None
+        if not force and _artifacts_ready(cache_dir) and built_version == current_version:
+            return _load_manifest(cache_dir)
+
+        if embeddings is None:
+            embeddings, _ = _create_models()
+        os.makedirs(cache_dir or config.CACHE_DIR, exist_ok=True)
+        index_cached = (os.path.exists(_artifact_path(os.path.join(config.VECTORSTORE_PATH, 'index.faiss'), cache_dir))
+                        and os.path.exists(_artifact_path(config.DOCSTORE_PATH, cache_dir)))
+        # An index from an older knowledge base (or older settings) is re-ingested;
+        # one from before manifests existed is assumed current.
+        if force or not index_cached or built_version not in (None, current_version):
+            store = _ingest_knowledge_base(embeddings, cache_dir, knowledge_base_path)
+        else:
+            store = _load_docstore(cache_dir)
+        num_topics = _compute_doc_embeddings(store, embeddings, cache_dir)
+
+        manifest = {
+            "index_version": current_version,
+            "built_at": datetime.utcnow().isoformat(),
+            "embedding_model": embedding_model_name(),
+            "parent_documents": len(list(store.yield_keys())),
+            "topics": num_topics,
+            "chunking": {
+                "parent_chunk_size": config.PARENT_CHUNK_SIZE, "parent_chunk_overlap": config.PARENT_CHUNK_OVERLAP,
+                "child_chunk_size": config.CHILD_CHUNK_SIZE, "child_chunk_overlap": config.CHILD_CHUNK_OVERLAP,
+            },
+        }
+        _atomic_write(manifest_path, 'w', lambda f: json.dump(manifest, f, indent=4))
+        print(f"✅ Serving artifacts built in '{cache_dir or config.CACHE_DIR}'.")
+        return manifest
+
+# ==============================================================================
+# --- 4. ARTIFACT LOADING ---
+# ==============================================================================
+def read_faiss_index(index_path: str):
+    """Reads a FAISS index memory-mapped where the index type supports it."""
+    import faiss
+
+    mmap_flag = getattr(faiss, 'IO_FLAG_MMAP_IFC', None)
+    try:
+        return faiss.read_index(index_path, mmap_flag) if mmap_flag is not None else faiss.read_index(index_path)
+    except RuntimeError:
+        # Index types without mmap support are read into memory instead.
+        return faiss.read_index(index_path)
+
+def _load_vectorstore(embeddings, cache_dir: str = None):
+    """Loads the FAISS index memory-mapped, so worker processes share its pages."""
+    from langchain_community.vectorstores import FAISS
+
+    vectorstore_path = _artifact_path(config.VECTORSTORE_PATH, cache_dir)
+    index = read_faiss_index(os.path.join(vectorstore_path, 'index.faiss'))
+    with open(os.path.join(vectorstore_path, 'index.pkl'), 'rb') as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embeddings, index, docstore, index_to_docstore_id)
+
+def _load_manifest(cache_dir: str = None) -> dict:
+    with open(_artifact_path(config.ARTIFACT_MANIFEST_PATH, cache_dir), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    # Manifests written before index versioning fall back to their build time.
+    manifest.setdefault("index_version", manifest.get("built_at"))
+    return manifest
+
+def _load_docstore(cache_dir: str = None):
+    with open(_artifact_path(config.DOCSTORE_PATH, cache_dir), 'rb') as f:
+        return pickle.load(f)
+
+def _load_doc_embeddings(store, cache_dir: str = None):
+    """Returns the memory-mapped embedding matrix, its topic order and the recommendation cache."""
+    import numpy as np
+
+    matrix = np.load(_artifact_path(config.DOC_EMBEDDINGS_PATH, cache_dir), mmap_mode='r')
+    with open(_artifact_path(config.DOC_EMBEDDINGS_INDEX_PATH, cache_dir), 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+    docs = store.mget([entry["doc_id"] for entry in entries])
+    cache = {
+        entry["topic"]: {"content": doc.page_content, "embedding": matrix[row]}
+        for row, (entry, doc) in enumerate(zip(entries, docs))
+    }
+    return matrix, [entry["topic"] for entry in entries], cache
+
+def _make_retriever(vectorstore, store):
+    from langchain.retrievers import ParentDocumentRetriever
+    for doc in store.mget(list(store.yield_keys())):
+        doc.metadata['topic'] = _topic_from_source(doc.metadata['source'])
+    parent_splitter, child_splitter = _make_splitters()
+    return ParentDocumentRetriever(vectorstore=vectorstore, docstore=store, child_splitter=child_splitter, parent_splitter=parent_splitter)
+
+def _build_rag_chain(llm, retriever, index_version, cache=None, shards=None):
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+    from langchain.chains import create_history_aware_retriever, create_retrieval_chain
+    from langchain.chains.combine_documents import create_stuff_documents_chain
+    from .retrieval_cache import CachedParentRetriever
+
+    # +++ NEW: Load few-shot examples from the external JSON file. +++
+    print("Loading few-shot examples for the system prompt...")
+    try:
+        with open(config.FEW_SHOT_EXAMPLES_PATH, 'r', encoding='utf-8') as f:
+            few_shot_examples = json.load(f)
+        # Format the examples into a single string to be injected into the prompt.
+        rag_examples_formatted = "\n\n".join([
+            f"## EXAMPLE {i+1}\n\n**User's Question:**\n{ex['user_query']}\n\n**Retrieved Context Summary (for illustration):**\n{ex['context_summary']}\n\n**Your Ideal Answer:**\n{ex['assistant_answer']}"
+            for i, ex in enumerate(few_shot_examples['rag_examples'])
+        ])
+        print("✅ Few-shot RAG examples loaded and formatted.")
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        print(f"⚠️ Warning: Could not load or parse '{config.FEW_SHOT_EXAMPLES_PATH}'. Prompts will not include examples. Error: {e}")
+        rag_examples_formatted = "*(No examples loaded)*"
+
+    # Recontextualization prompt to make follow-up questions standalone
+    recontextualization_prompt = ChatPromptTemplate.from_messages([
+        ("system", "Given a chat history and a follow-up question, rephrase the follow-up question to be a standalone question that captures all relevant context."),
+        MessagesPlaceholder(variable_name="chat_history"),
+        ("user", "{input}")
+    ])
+    # The retrieval cache sits between the rewriter and the retriever, keyed by the standalone question.
+    cached_retriever = CachedParentRetriever(retriever=retriever, cache=cache or retrieval_cache, index_version=index_version, shards=shards)
+    history_aware_retriever = create_history_aware_retriever(llm, cached_retriever, recontextualization_prompt)
+
+    # +++ NEW: Load the main system prompt from the external prompt.md file. +++
+    with open(config.SYSTEM_PROMPT_PATH, 'r', encoding='utf-8') as f:
+        system_template = f.read()
+
+    # +++ NEW: Inject the formatted few-shot examples into the prompt template. +++
+    final_system_template = system_template.replace("{rag_examples}", rag_examples_formatted)
+
+    # Create the final prompt template for the RAG chain.
+    # This uses the dynamically loaded and formatted template.
+    qa_prompt = ChatPromptTemplate.from_messages([
+        ("system", final_system_template),
+        MessagesPlaceholder(variable_name="chat_history"),
+        # This 'user' message is a LangChain convention for the final step.
+        # LangChain will automatically populate {context} from the retriever
+        # and {input} from the user's query.
+        ("user", "User's Question: {input}\n\nRetrieved Context:\n{context}")
+    ])
+
+    question_answer_chain = create_stuff_documents_chain(llm, qa_prompt)
+    # The same rewrite step the history-aware retriever runs, for answer_query's staged execution.
+    rewrite_chain = recontextualization_prompt | llm | StrOutputParser()
+    return create_retrieval_chain(history_aware_retriever, question_answer_chain), rewrite_chain, cached_retriever, question_answer_chain
+
+def _start_shards(retriever, version: str):
+    """Starts shard processes for an index version in the background, if sharded search is enabled."""
+    if config.SEARCH_SHARDS < 2:
+        return None
+    if config.SERVER_WORKERS > 1:
+        # Every worker would start its own shards next to its own index: memory grows as workers x shards.
+        print(f"⚠️ Sharded search is disabled: it needs a single server worker, not {config.SERVER_WORKERS}.")
+        return None
+    from .sharding import ShardCoordinator
+    return ShardCoordinator(retriever, version).start()
+
+def load_snapshot(embeddings, llm, cache, cache_dir: str = None) -> PipelineSnapshot:
+    """
+    Loads a complete pipeline from prebuilt artifacts, e.g. a tenant's, without
+    touching the globals. Files are read under the directory's build lock.
+    """
+    with get_build_lock(cache_dir):
+        version = _load_manifest(cache_dir)["index_version"]
+        vectorstore = _load_vectorstore(embeddings, cache_dir)
+        store = _load_docstore(cache_dir)
+        matrix, topic_ids, doc_cache = _load_doc_embeddings(store, cache_dir)
+    new_retriever = _make_retriever(vectorstore, store)
+    new_chain, new_rewrite_chain, new_cached_retriever, new_qa_chain = _build_rag_chain(llm, new_retriever, version, cache)
+    return PipelineSnapshot(version, new_retriever, new_chain, new_rewrite_chain, new_cached_retriever, new_qa_chain,
+                            doc_cache, matrix, topic_ids)
+
+# ==============================================================================
+# --- 5. PIPELINE INITIALIZATION ---
+# ==============================================================================
 def initialize_rag_pipeline():
     global embeddings, llm, retriever, rag_chain, doc_embeddings_cache, initialization_done
+    global doc_embedding_matrix, doc_topic_ids, index_version, retrieval_cache, shard_coordinator
+    global answer_cache, summary_cache
+    global rewrite_chain, cached_retriever, question_answer_chain
+    global initialization_started_at, initialization_finished_at
 
     with initialization_lock:
         if initialization_done:
             return
 
         print("Initializing RAG pipeline...")
+        initialization_started_at = time.perf_counter()
+        initialization_finished_at = None
         try:
             # --- Step 1: Initialize Models ---
-            embeddings = GoogleGenerativeAIEmbeddings(model=config.EMBEDDING_MODEL)
-            llm = GoogleGenerativeAI(model=config.LLM_MODEL, temperature=config.LLM_TEMPERATURE)
-
-            # --- Step 2: Setup Retriever ---
-            parent_splitter = RecursiveCharacterTextSplitter(chunk_size=config.PARENT_CHUNK_SIZE, chunk_overlap=config.PARENT_CHUNK_OVERLAP)
-            child_splitter = RecursiveCharacterTextSplitter(chunk_size=config.CHILD_CHUNK_SIZE, chunk_overlap=config.CHILD_CHUNK_OVERLAP)
-
-            if os.path.exists(config.VECTORSTORE_PATH) and os.path.exists(config.DOCSTORE_PATH):
-                print("Loading retriever components from cache...")
-                vectorstore = FAISS.load_local(config.VECTORSTORE_PATH, embeddings, allow_dangerous_deserialization=True)
-                with open(config.DOCSTORE_PATH, 'rb') as f: store = pickle.load(f)
-                print("✅ Cached components loaded successfully.")
-            else:
-                print("No cache found. Performing full one-time data ingestion...")
-                os.makedirs(config.CACHE_DIR, exist_ok=True)
-                loader = DirectoryLoader(config.KNOWLEDGE_BASE_PATH, glob="**/*.md", loader_cls=TextLoader, show_progress=True, use_multithreading=True, loader_kwargs={"encoding": "utf-8"})
-                all_docs = loader.load()
-                
-                vectorstore = FAISS.from_texts(texts=["_"], embedding=embeddings) # Dummy init
-                store = InMemoryStore()
-                
-                temp_retriever = ParentDocumentRetriever(vectorstore=vectorstore, docstore=store, child_splitter=child_splitter, parent_splitter=parent_splitter)
-                print(f"Adding {len(all_docs)} documents to the retriever...")
-                temp_retriever.add_documents(all_docs, ids=None)
-                
-                print("Saving populated components to cache...")
-                temp_retriever.vectorstore.save_local(config.VECTORSTORE_PATH)
-                with open(config.DOCSTORE_PATH, 'wb') as f: pickle.dump(store, f)
-                print("✅ Ingestion complete and components cached.")
-
-            retriever = ParentDocumentRetriever(vectorstore=vectorstore, docstore=store, child_splitter=child_splitter, parent_splitter=parent_splitter)
-
-            # --- Step 3: Pre-compute Recommendation Cache ---
-            print("Pre-computing embeddings for all documents for recommendations...")
-            all_full_docs = list(store.mget(list(store.yield_keys())))
-            for doc in all_full_docs:
-                filename = os.path.basename(doc.metadata['source'])
-                topic_name = os.path.splitext(filename)[0]
-                doc.metadata['topic'] = topic_name
-                doc_embedding = embeddings.embed_query(doc.page_content)
-                doc_embeddings_cache[topic_name] = {"content": doc.page_content, "embedding": doc_embedding}
-            print(f"✅ Cached {len(doc_embeddings_cache)} document embeddings.")
-
-            # --- Step 4: Construct the Final Conversational RAG Chain ---
-            
-            # +++ NEW: Load few-shot examples from the external JSON file. +++
-            print("Loading few-shot examples for the system prompt...")
-            try:
-                with open(config.FEW_SHOT_EXAMPLES_PATH, 'r', encoding='utf-8') as f:
-                    few_shot_examples = json.load(f)
-                # Format the examples into a single string to be injected into the prompt.
-                rag_examples_formatted = "\n\n".join([
-                    f"## EXAMPLE {i+1}\n\n**User's Question:**\n{ex['user_query']}\n\n**Retrieved Context Summary (for illustration):**\n{ex['context_summary']}\n\n**Your Ideal Answer:**\n{ex['assistant_answer']}"
-                    for i, ex in enumerate(few_shot_examples['rag_examples'])
-                ])
-                print("✅ Few-shot RAG examples loaded and formatted.")
-            except (FileNotFoundError, json.JSONDecodeError) as e:
-                print(f"⚠️ Warning: Could not load or parse '{config.FEW_SHOT_EXAMPLES_PATH}'. Prompts will not include examples. Error: {e}")
-                rag_examples_formatted = "*(No examples loaded)*"
-
-            # Recontextualization prompt to make follow-up questions standalone
-            recontextualization_prompt = ChatPromptTemplate.from_messages([
-                ("system", "Given a chat history and a follow-up question, rephrase the follow-up question to be a standalone question that captures all relevant context."),
-                MessagesPlaceholder(variable_name="chat_history"),
-                ("user", "{input}")
-            ])
-            history_aware_retriever = create_history_aware_retriever(llm, retriever, recontextualization_prompt)
-
-            # +++ NEW: Load the main system prompt from the external prompt.md file. +++
-            with open(config.SYSTEM_PROMPT_PATH, 'r', encoding='utf-8') as f:
-                system_template = f.read()
-            
-            # +++ NEW: Inject the formatted few-shot examples into the prompt template. +++
-            final_system_template = system_template.replace("{rag_examples}", rag_examples_formatted)
-
-            # Create the final prompt template for the RAG chain.
-            # This uses the dynamically loaded and formatted template.
-            qa_prompt = ChatPromptTemplate.from_messages([
-                ("system", final_system_template),
-                MessagesPlaceholder(variable_name="chat_history"),
-                # This 'user' message is a LangChain convention for the final step.
-                # LangChain will automatically populate {context} from the retriever
-                # and {input} from the user's query.
-                ("user", "User's Question: {input}\n\nRetrieved Context:\n{context}")
-            ])
-
-            question_answer_chain = create_stuff_documents_chain(llm, qa_prompt)
-            rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
+            with _stage("models"):
+                embeddings, llm = _create_models()
+
+            # Artifacts are read under the build lock, so a rebuild running in
+            # another process can't replace files halfway through loading them.
+            with build_lock:
+                # --- Step 2: Load (or build) the Vector Index ---
+                with _stage("index_load"):
+                    if config.ARTIFACT_BUNDLE_PATH:
+                        # Only the manifest is compared when the bundle is already installed (e.g. by
+                        # gunicorn's pre-start step); otherwise it is verified and installed here.
+                        # A bad bundle fails initialization.
+                        from .bundles import ensure_installed
+                        ensure_installed(config.ARTIFACT_BUNDLE_PATH)
+                    if _prebuilt_artifacts():
+                        if not _artifacts_ready():
+                            raise RuntimeError(f"Shared artifacts not found in '{config.CACHE_DIR}'. Run `python -m app.build_artifacts` before starting the workers.")
+                    else:
+                        # A no-op unless the cache is missing or the knowledge base changed since it was built.
+                        build_artifacts(embeddings)
+                    print("Loading retriever components from cache...")
+                    index_version = _load_manifest()["index_version"]
+                    vectorstore = _load_vectorstore(embeddings)
+
+                # --- Step 3: Load the Parent Docstore and Setup Retriever ---
+                with _stage("docstore"):
+                    store = _load_docstore()
+                    retriever = _make_retriever(vectorstore, store)
+                    print("✅ Cached components loaded successfully.")
+
+                # --- Step 4: Load the Recommendation Cache ---
+                with _stage("embedding_cache"):
+                    doc_embedding_matrix, doc_topic_ids, doc_embeddings_cache = _load_doc_embeddings(store)
+                    print(f"✅ Loaded {len(doc_embeddings_cache)} document embeddings.")
+
+            # --- Step 5: Construct the Final Conversational RAG Chain ---
+            with _stage("chain"):
+                from .response_cache import ResponseCache
+                from .retrieval_cache import RetrievalCache
+                retrieval_cache = RetrievalCache()
+                answer_cache = ResponseCache("answer", config.ANSWER_CACHE_MAX_ENTRIES)
+                summary_cache = ResponseCache("summary", config.SUMMARY_CACHE_MAX_ENTRIES)
+                _load_precomputed_summaries(index_version)
+                shard_coordinator = _start_shards(retriever, index_version)
+                rag_chain, rewrite_chain, cached_retriever, question_answer_chain = _build_rag_chain(llm, retriever, index_version,
+                                                                                                    shards=shard_coordinator)
 
             initialization_done = True
-            print("✅ Advanced Conversational RAG pipeline is ready.")
+            initialization_finished_at = time.perf_counter()
+            print(f"✅ Advanced Conversational RAG pipeline is ready in {round((initialization_finished_at - initialization_started_at) * 1000)} ms.")
 
         except Exception as e:
+            initialization_finished_at = time.perf_counter()
             print(f"❌ CRITICAL ERROR during RAG pipeline initialization: {e}")
             import traceback
             traceback.print_exc()
-            initialization_done = False
\ No newline at end of file
+            initialization_done = False
+
+# ==============================================================================
+# --- 6. DEADLINE-AWARE ANSWERING ---
+# ==============================================================================
+def answer_query(pipeline: PipelineSnapshot, question: str, chat_history: list, callbacks: list, deadline,
+                 use_cache: bool = True) -> dict:
+    """
+    Runs the conversational RAG chain stage by stage (rewrite, retrieve,
+    generate) within `deadline`, degrading instead of overrunning it:
+    - rewrite: falls back to the question as asked;
+    - retrieve/generate: falls back to an extractive answer from whatever was retrieved.
+    The rewrite is skipped for self-contained follow-ups and reused when cached (app/rewriting.py).
+    Answers to questions without history are cached per index version, unless `use_cache` is off
+    (evaluation and replay traffic, which must measure the full pipeline).
+    Returns `answer` and `context` like the chain, plus the `degraded` stages, per-stage
+    timings and the `rewrite` decision (None without history).
+    """
+    from .deadlines import DeadlineExceeded, extractive_answer, run_stage
+    from .retrieval_cache import normalize_question
+
+    cache_key = normalize_question(question) if use_cache and not chat_history and answer_cache is not None else None
+    if cache_key is not None:
+        cached = answer_cache.get(pipeline.index_version, cache_key)
+        if cached is not None:
+            return {"answer": cached["answer"], "context": cached["context"], "degraded": [], "stage_ms": {"answer_cache": 0}, "rewrite": None}
+
+    run_config = {"callbacks": callbacks}
+    degraded, stage_ms = [], {}
+    standalone_question, docs = question, []
+
+    def timed(stage, fn, **kwargs):
+        started = time.perf_counter()
+        try:
+            return run_stage(stage, fn, deadline, **kwargs)
+        finally:
+            stage_ms[stage] = round((time.perf_counter() - started) * 1000)
+
+    rewrite = None
+    try:
+        # Without history the chain searches with the question as asked, so there is nothing to rewrite.
+        if chat_history:
+            history = rewriting.recent_history(chat_history)
+            plan = rewriting.plan(question, history)
+            rewrite = {key: plan[key] for key in ("action", "reason", "detail")}
+            if plan["action"] == "cached":
+                standalone_question = plan["standalone_question"]
+            elif plan["action"] == "rewrite":
+                try:
+                    standalone_question = timed("rewrite", lambda: pipeline.rewrite_chain.invoke(
+                        {"input": question, "chat_history": history}, config=run_config
+                    ), max_seconds=deadline.seconds * config.REWRITE_DEADLINE_SHARE, reserve_seconds=config.FALLBACK_RESERVE_SECONDS, hedge=True)
+                    rewriting.cache.put(plan["key"], standalone_question)
+                except DeadlineExceeded:
+                    degraded.append("rewrite")
+            if standalone_question != question:
+                rewrite["standalone_question"] = standalone_question
+
+        docs = timed("retrieve", lambda: pipeline.cached_retriever.invoke(standalone_question, config=run_config),
+                     reserve_seconds=config.FALLBACK_RESERVE_SECONDS)
+        answer = timed("generate", lambda: pipeline.question_answer_chain.invoke(
+            {"input": question, "chat_history": chat_history, "context": docs}, config=run_config
+        ), reserve_seconds=config.FALLBACK_RESERVE_SECONDS, hedge=True)
+    except DeadlineExceeded as e:
+        degraded.append(e.stage)
+        answer = extractive_answer(standalone_question, docs)
+        print(f"⚠️ Deadline of {deadline.seconds:g} s reached during '{e.stage}'; returned an extractive answer.")
+
+    if cache_key is not None and not degraded:
+        answer_cache.put(pipeline.index_version, cache_key, {"answer": answer, "context": docs})
+    return {"answer": answer, "context": docs, "degraded": degraded, "stage_ms": stage_ms, "rewrite": rewrite}
+
+SUMMARY_PROMPT = (
+    "You are an AI assistant. A user has requested information about '{topic}'. Below is the full text of the relevant document. "
+    "Provide a comprehensive summary of this document, capturing the key points clearly and in a friendly, helpful tone.\n\n"
+    "Document Content:\n---\n{context}\n---\n\nSummary:"
+)
+
+def _load_precomputed_summaries(version: str):
+    """Seeds the summary cache with the summaries shipped in an artifact bundle, if they match `version`."""
+    from .bundles import load_summaries
+    summaries = load_summaries(version)
+    for topic, summary in summaries.items():
+        summary_cache.put(version, topic, summary)
+    if summaries:
+        print(f"✅ Loaded {len(summaries)} precomputed summaries.")
+
+def summarize_document(pipeline: PipelineSnapshot, topic: str, content: str, callbacks: list, deadline,
+                       use_cache: bool = True) -> dict:
+    """
+    Summarizes a knowledge-base document for /api/get_document within `deadline`,
+    falling back to its opening sentences. Summaries are cached per index version
+    unless `use_cache` is off.
+    Returns the `summary` and the `degraded` stages.
+    """
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_core.prompts import ChatPromptTemplate
+    from .deadlines import DeadlineExceeded, extractive_summary, run_stage
+
+    use_cache = use_cache and summary_cache is not None
+    cached = summary_cache.get(pipeline.index_version, topic) if use_cache else None
+    if cached is not None:
+        return {"summary": cached, "degraded": []}
+    summarization_chain = ChatPromptTemplate.from_template(SUMMARY_PROMPT) | llm | StrOutputParser()
+    try:
+        summary = run_stage("summarize", lambda: summarization_chain.invoke(
+            {"topic": topic, "context": content}, config={"callbacks": callbacks}
+        ), deadline, reserve_seconds=config.FALLBACK_RESERVE_SECONDS, hedge=True)
+    except DeadlineExceeded:
+        return {"summary": extractive_summary(content), "degraded": ["summarize"]}
+    if use_cache:
+        summary_cache.put(pipeline.index_version, topic, summary)
+    return {"summary": summary, "degraded": []}
+
+# ==============================================================================
+# --- 7. LIVE RELOAD ---
+# ==============================================================================
+def get_reload_status() -> dict:
+    with swap_lock:
+        return dict(reload_status, index_version=index_version)
+
+def _set_reload_status(**changes):
+    with swap_lock:
+        reload_status.update(changes)
+
+def reload_pipeline(trigger: str = "manual") -> dict:
+    """
+    Builds a pipeline for the current knowledge base next to the live one and
+    swaps it in at once. Requests already running finish on the snapshot they
+    started with; the old components are freed when the last of them returns.
+    In shared-artifact mode nothing is built here: the reload picks up artifacts
+    rebuilt by `python -m app.build_artifacts`. Returns the reload status.
+    """
+    global retriever, rag_chain, rewrite_chain, cached_retriever, question_answer_chain
+    global doc_embeddings_cache, doc_embedding_matrix, doc_topic_ids, index_version, shard_coordinator
+
+    if not initialization_done:
+        raise RuntimeError("The RAG pipeline must finish initializing before it can be reloaded.")
+    if not reload_lock.acquire(blocking=False):
+        return get_reload_status()
+    try:
+        started = time.perf_counter()
+        _set_reload_status(state="running", trigger=trigger, from_version=index_version, to_version=None,
+                           started_at=datetime.utcnow().isoformat(), duration_ms=None, error=None)
+        print(f"🔄 Reloading RAG pipeline (trigger: {trigger})...")
+        try:
+            if not _prebuilt_artifacts():
+                build_artifacts(embeddings)
+            with build_lock:
+                new_version = _load_manifest()["index_version"]
+                if new_version == index_version:
+                    _set_reload_status(state="unchanged", to_version=new_version, duration_ms=round((time.perf_counter() - started) * 1000))
+                    telemetry.PIPELINE_RELOADS.inc(trigger=trigger, result="unchanged")
+                    print("✅ Knowledge base unchanged; keeping the current pipeline.")
+                    return get_reload_status()
+                vectorstore = _load_vectorstore(embeddings)
+                store = _load_docstore()
+                new_matrix, new_topic_ids, new_doc_cache = _load_doc_embeddings(store)
+            new_retriever = _make_retriever(vectorstore, store)
+            new_shards = _start_shards(new_retriever, new_version)
+            new_chain, new_rewrite_chain, new_cached_retriever, new_qa_chain = _build_rag_chain(llm, new_retriever, new_version,
+                                                                                                shards=new_shards)
+
+            with swap_lock:
+                retriever, rag_chain, rewrite_chain = new_retriever, new_chain, new_rewrite_chain
+                cached_retriever, question_answer_chain = new_cached_retriever, new_qa_chain
+                doc_embeddings_cache, doc_embedding_matrix, doc_topic_ids = new_doc_cache, new_matrix, new_topic_ids
+                old_version, index_version = index_version, new_version
+                old_shards, shard_coordinator = shard_coordinator, new_shards
+            if old_shards is not None:
+                # Searches still running on the old snapshot fall back to its in-process index.
+                threading.Thread(target=old_shards.close, name="shard-shutdown", daemon=True).start()
+            # Entries are keyed by version and the caches are shared with tenants,
+            # so only the replaced default version's entries are dropped.
+            retrieval_cache.invalidate(drop_version=old_version)
+            answer_cache.invalidate(drop_version=old_version)
+            summary_cache.invalidate(drop_version=old_version)
+            _load_precomputed_summaries(new_version)
+
+            duration_ms = round((time.perf_counter() - started) * 1000)
+            _set_reload_status(state="done", to_version=new_version, duration_ms=duration_ms)
+            telemetry.PIPELINE_RELOADS.inc(trigger=trigger, result="done")
+            print(f"✅ Swapped in knowledge base version {new_version} in {duration_ms} ms.")
+        except Exception as e:
+            _set_reload_status(state="failed", error=str(e), duration_ms=round((time.perf_counter() - started) * 1000))
+            telemetry.PIPELINE_RELOADS.inc(trigger=trigger, result="failed")
+            print(f"❌ Reload failed; still serving version {index_version}: {e}")
+            import traceback
+            traceback.print_exc()
+        return get_reload_status()
+    finally:
+        reload_lock.release()
+
+def _source_version() -> str:
+    """The version a reload would load: the knowledge base's, or the shared manifest's."""
+    return _load_manifest()["index_version"] if _prebuilt_artifacts() else compute_index_version()
+
+def start_reload_watcher(interval_seconds: float = None):
+    """Starts a daemon thread that reloads the pipeline whenever the source version changes."""
+    interval_seconds = config.RELOAD_POLL_SECONDS if interval_seconds is None else interval_seconds
+    if interval_seconds <= 0:
+        return None
+
+    def watch():
+        failed_version = None
+        while True:
+            time.sleep(interval_seconds)
+            if not initialization_done or reload_lock.locked():
+                continue
+            try:
+                version = _source_version()
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Reload watcher could not read the knowledge base version: {e}")
+                continue
+            # Don't retry a version that already failed until the files change again.
+            if version in (index_version, failed_version):
+                continue
+            print(f"Knowledge base changed ({index_version} -> {version}).")
+            status = reload_pipeline(trigger="watcher")
+            failed_version = version if status["state"] == "failed" else None
+
+    thread = threading.Thread(target=watch, name="kb-reload-watcher", daemon=True)
+    thread.start()
+    print(f"Watching the knowledge base for changes every {interval_seconds:g} s.")
+    return thread
@@ -0,0 +1,160 @@
+# app/recommender.py
+# Content-based topic recommendations. Every selected user's profile vector is
+# scored against every document embedding in one matrix multiply, and the
+# per-user exclusion and parent-topic diversity rules are applied as array
+# operations, so scoring N users costs one pass instead of N Python loops.
+#
+# Precompute recommendations for many users (e.g. for a nightly job) with:
+#   python -m app.recommender [--users ID [ID ...]] [--output recommendations.json]
+
+import argparse
+import json
+import re
+import sys
+
+from . import config, utils
+
+FIRST_PASS_EXPLANATION = "Based on your recent interests, you might find this helpful."
+SECOND_PASS_EXPLANATION = "This related topic might also be of interest."
+
+def format_topic_title(topic_id: str) -> str:
+    if not topic_id: return "Unknown Topic"
+    title_part = re.sub(r'^\d{2}(_\d{2})?-', '', topic_id)
+    return title_part.replace('-', ' ').replace('_', ' ').title()
+
+def get_parent_topic(topic_id: str) -> str:
+    match = re.match(r"(\d{2}_[a-zA-Z_-]+)", topic_id)
+    return match.group(1) if match else topic_id
+
+def _parent_groups(topic_ids: list):
+    """Returns each topic's parent-group number, plus a topic order that keeps every group contiguous."""
+    import numpy as np
+
+    group_numbers = {}
+    groups = np.array([group_numbers.setdefault(get_parent_topic(topic_id), len(group_numbers)) for topic_id in topic_ids])
+    order = np.argsort(groups, kind="stable")
+    starts = np.flatnonzero(np.r_[True, np.diff(groups[order]) != 0])
+    return groups, order, starts
+
+def score_profiles(profile_matrix, doc_matrix):
+    """Cosine similarity of every profile (rows) against every document (columns)."""
+    import numpy as np
+
+    profiles = np.asarray(profile_matrix, dtype=np.float64)
+    docs = np.asarray(doc_matrix, dtype=np.float64)
+    profile_norms = np.linalg.norm(profiles, axis=1, keepdims=True)
+    doc_norms = np.linalg.norm(docs, axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = (profiles / profile_norms) @ (docs / doc_norms).T
+    return np.nan_to_num(scores, nan=-np.inf)
+
+def rank_topics(scores, excluded, topic_ids: list, limit: int):
+    """
+    Picks up to `limit` topic columns per row. Topics are taken in score order,
+    first one per parent topic, then any remaining topic; excluded topics never.
+    Returns the picked column indices (-1 when a row runs out of topics) and
+    whether each pick came from the first, diversified pass.
+    """
+    import numpy as np
+
+    n_users, n_topics = scores.shape
+    order = np.argsort(-scores, axis=1, kind="stable")
+    rank = np.empty_like(order)
+    np.put_along_axis(rank, order, np.arange(n_topics)[None, :].repeat(n_users, axis=0), axis=1)
+
+    # A topic is "first of its parent" if it has the best rank among the
+    # non-excluded topics of its group.
+    groups, group_order, group_starts = _parent_groups(topic_ids)
+    candidate_rank = np.where(excluded, n_topics, rank)
+    best_rank_in_group = np.minimum.reduceat(candidate_rank[:, group_order], group_starts, axis=1)
+    first_of_parent = ~excluded & (candidate_rank == best_rank_in_group[:, groups])
+
+    # First-pass topics sort ahead of the rest; within each pass, by score.
+    key = np.where(first_of_parent, rank, rank + n_topics).astype(np.float64)
+    key[excluded] = np.inf
+    picks = np.argsort(key, axis=1, kind="stable")[:, :limit]
+    picked_keys = np.take_along_axis(key, picks, axis=1)
+    picks[np.isinf(picked_keys)] = -1
+    return picks, picked_keys < n_topics
+
+def dimension_mismatch(profile, doc_matrix) -> bool:
+    """True if the profile has a vector that can't be scored against the documents (e.g. from an older embedding model)."""
+    vector = (profile or {}).get("profile_vector")
+    return bool(vector) and len(vector) != doc_matrix.shape[1]
+
+def recommend_for_profiles(profiles: list, doc_matrix, topic_ids: list, limit: int = None) -> list:
+    """
+    Returns a recommendation list for each profile, in order. Profiles without a
+    vector, or with one of another dimension than the documents', get [].
+    """
+    import numpy as np
+
+    limit = limit or config.MAX_RECOMMENDATIONS
+    results = [[] for _ in profiles]
+    if not topic_ids:
+        return results
+    scored = [i for i, profile in enumerate(profiles)
+              if profile and profile.get("profile_vector") and not dimension_mismatch(profile, doc_matrix)]
+    if not scored:
+        return results
+
+    topic_positions = {topic_id: column for column, topic_id in enumerate(topic_ids)}
+    excluded = np.zeros((len(scored), len(topic_ids)), dtype=bool)
+    for row, i in enumerate(scored):
+        columns = [topic_positions[t] for t in profiles[i].get("inferred_interests", []) if t in topic_positions]
+        excluded[row, columns] = True
+
+    scores = score_profiles([profiles[i]["profile_vector"] for i in scored], doc_matrix)
+    picks, first_pass = rank_topics(scores, excluded, topic_ids, limit)
+    for row, i in enumerate(scored):
+        results[i] = [
+            {"topic_id": topic_ids[column], "title": format_topic_title(topic_ids[column]),
+             "explanation": FIRST_PASS_EXPLANATION if is_first else SECOND_PASS_EXPLANATION}
+            for column, is_first in zip(picks[row], first_pass[row]) if column >= 0
+        ]
+    return results
+
+def recommend_for_users(user_ids: list, user_profiles: dict, doc_matrix, topic_ids: list, limit: int = None) -> dict:
+    """Maps each user ID to its recommendations, scoring all of them in one pass."""
+    recommendations = recommend_for_profiles([user_profiles.get(user_id) for user_id in user_ids], doc_matrix, topic_ids, limit)
+    return dict(zip(user_ids, recommendations))
+
+def load_topic_matrix():
+    """Reads the document-embedding matrix and its topic order from the shared artifacts."""
+    import numpy as np
+
+    matrix = np.load(config.DOC_EMBEDDINGS_PATH, mmap_mode='r')
+    with open(config.DOC_EMBEDDINGS_INDEX_PATH, 'r', encoding='utf-8') as f:
+        topic_ids = [entry["topic"] for entry in json.load(f)]
+    return matrix, topic_ids
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute topic recommendations for many users at once.")
+    parser.add_argument("--users", nargs="+", help="User IDs to score (default: every user with a profile vector).")
+    parser.add_argument("--limit", type=int, default=config.MAX_RECOMMENDATIONS, help="Recommendations per user.")
+    parser.add_argument("--output", help="Write the result to this JSON file instead of stdout.")
+    args = parser.parse_args()
+
+    try:
+        doc_matrix, topic_ids = load_topic_matrix()
+    except FileNotFoundError:
+        print(f"❌ Document embeddings not found in '{config.CACHE_DIR}'. Run `python -m app.build_artifacts` first.", file=sys.stderr)
+        sys.exit(1)
+
+    user_profiles = utils.load_user_profiles()
+    user_ids = args.users or [user_id for user_id, profile in user_profiles.items() if profile.get("profile_vector")]
+    recommendations = recommend_for_users(user_ids, user_profiles, doc_matrix, topic_ids, args.limit)
+    mismatched = [user_id for user_id in user_ids if dimension_mismatch(user_profiles.get(user_id), doc_matrix)]
+    if mismatched:
+        print(f"⚠️ Skipped {len(mismatched)} profiles whose vectors don't match the document embeddings "
+              f"({doc_matrix.shape[1]} dimensions): {mismatched}", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(recommendations, f, indent=4)
+        print(f"✅ Wrote recommendations for {len(recommendations)} users to '{args.output}'.")
+    else:
+        print(json.dumps(recommendations, indent=4))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# app/response_cache.py
+# Caches finished LLM responses that depend only on the knowledge base: answers
+# to questions asked without chat history, and /api/get_document summaries.
+# Entries are keyed by index version, so a reload never serves a response
+# generated from an older knowledge base. Degraded responses (extractive
+# fallbacks after a deadline) are never cached.
+
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+from . import telemetry
+
+class ResponseCache:
+    """Thread-safe LRU of `(index_version, key) -> response`, with hit statistics."""
+    def __init__(self, name: str, max_entries: int):
+        self.name = name
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+
+    def get(self, index_version: str, key: str) -> Optional[Any]:
+        with self._lock:
+            value = self._entries.get((index_version, key))
+            if value is None:
+                self._stats["misses"] += 1
+            else:
+                self._entries.move_to_end((index_version, key))
+                self._stats["hits"] += 1
+        telemetry.CACHE_LOOKUPS.inc(cache=self.name, result="miss" if value is None else "hit")
+        return value
+
+    def contains(self, index_version: str, key: str) -> bool:
+        """Checks for an entry without counting a lookup (for cache warm-up)."""
+        with self._lock:
+            return (index_version, key) in self._entries
+
+    def put(self, index_version: str, key: str, value: Any):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[(index_version, key)] = value
+            self._entries.move_to_end((index_version, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, keep_version: Optional[str] = None, drop_version: Optional[str] = None):
+        """
+        Drops every entry, every entry built against another index version than
+        `keep_version`, or only the entries built against `drop_version`.
+        """
+        with self._lock:
+            if drop_version is not None:
+                stale = [entry_key for entry_key in self._entries if entry_key[0] == drop_version]
+            else:
+                stale = [entry_key for entry_key in self._entries if entry_key[0] != keep_version]
+            for entry_key in stale:
+                del self._entries[entry_key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._entries))
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else None
+        return stats
@@ -0,0 +1,170 @@
+# app/retrieval_cache.py
+# Caches retrieval results between the history-aware rewriter and the
+# ParentDocumentRetriever. A standalone question that was already answered
+# skips the vector search and maps straight to its ranked parent-document IDs.
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from . import config, telemetry, utils
+from .sharding import ShardUnavailable
+
+def normalize_question(question: str) -> str:
+    """Lowercases, collapses whitespace and drops trailing punctuation."""
+    return re.sub(r"\s+", " ", question).strip().lower().rstrip("?!.").strip()
+
+class RetrievalCache:
+    """
+    Thread-safe LRU of `(index_version, normalized question) -> ranked parent IDs`.
+    Each entry remembers how long its vector search took, so hits can report the latency they saved.
+    """
+    def __init__(self, max_entries: Optional[int] = None):
+        self.max_entries = max_entries or config.RETRIEVAL_CACHE_MAX_ENTRIES
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "saved_ms": 0.0}
+
+    def get(self, index_version: str, question: str):
+        key = (index_version, normalize_question(question))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+            else:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                self._stats["saved_ms"] += entry["search_ms"]
+        telemetry.CACHE_LOOKUPS.inc(cache="retrieval", result="miss" if entry is None else "hit")
+        return entry
+
+    def put(self, index_version: str, question: str, parent_ids: List[str], search_ms: float):
+        key = (index_version, normalize_question(question))
+        with self._lock:
+            self._entries[key] = {"parent_ids": list(parent_ids), "search_ms": search_ms}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, keep_version: Optional[str] = None, drop_version: Optional[str] = None):
+        """
+        Drops every entry, every entry built against another index version than
+        `keep_version`, or only the entries built against `drop_version`.
+        """
+        with self._lock:
+            if drop_version is not None:
+                stale = [key for key in self._entries if key[0] == drop_version]
+            else:
+                stale = [key for key in self._entries if key[0] != keep_version]
+            for key in stale:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._entries))
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else None
+        stats["saved_ms"] = round(stats["saved_ms"])
+        return stats
+
+class CachedParentRetriever(BaseRetriever):
+    """
+    Drop-in replacement for a ParentDocumentRetriever that consults a RetrievalCache first.
+    With `shards` (a ShardCoordinator), similarity searches go to the shard processes.
+    """
+    retriever: Any
+    cache: Any
+    index_version: str
+    shards: Any = None
+
+    def search_parent_ids(self, query: str) -> List[str]:
+        """Runs the child-chunk vector search and returns unique parent IDs in rank order."""
+        retriever = self.retriever
+        if self.shards is not None and retriever.search_type == "similarity":
+            return self._search_parent_ids_batch([query])[0]
+        if retriever.search_type == "mmr":
+            sub_docs = retriever.vectorstore.max_marginal_relevance_search(query, **retriever.search_kwargs)
+        elif retriever.search_type == "similarity_score_threshold":
+            sub_docs = [doc for doc, _ in retriever.vectorstore.similarity_search_with_relevance_scores(query, **retriever.search_kwargs)]
+        else:
+            sub_docs = retriever.vectorstore.similarity_search(query, **retriever.search_kwargs)
+        # Keep the rank order of the parents, as the ParentDocumentRetriever does.
+        return list(dict.fromkeys(doc.metadata[retriever.id_key] for doc in sub_docs if retriever.id_key in doc.metadata))
+
+    def _search_parent_ids_batch(self, queries: List[str]) -> List[List[str]]:
+        """Embeds all queries in one call and runs a single FAISS search for them."""
+        retriever = self.retriever
+        vectorstore = retriever.vectorstore
+        if retriever.search_type != "similarity" or not hasattr(vectorstore, "index"):
+            return [self.search_parent_ids(query) for query in queries]
+        import faiss
+        import numpy as np
+
+        embeddings = vectorstore.embeddings
+        if hasattr(embeddings, "embed_queries"):
+            vectors = embeddings.embed_queries(queries)
+        else:
+            vectors = [embeddings.embed_query(query) for query in queries]
+        matrix = np.asarray(vectors, dtype=np.float32)
+        if getattr(vectorstore, "_normalize_L2", False):
+            faiss.normalize_L2(matrix)
+        k = retriever.search_kwargs.get("k", 4)
+        if self.shards is not None:
+            try:
+                return self.shards.search(matrix, k)
+            except ShardUnavailable:
+                pass  # Counted by the coordinator; the in-process index gives the same results.
+        _, indices = vectorstore.index.search(matrix, k)
+
+        results = []
+        for row in indices:
+            sub_docs = [vectorstore.docstore.search(vectorstore.index_to_docstore_id[i]) for i in row if i != -1]
+            results.append(list(dict.fromkeys(
+                doc.metadata[retriever.id_key] for doc in sub_docs
+                if isinstance(doc, Document) and retriever.id_key in doc.metadata
+            )))
+        return results
+
+    def get_parent_ids_batch(self, queries: List[str]) -> List[dict]:
+        """
+        Resolves many standalone questions at once. Cache hits are served directly;
+        the distinct misses share one embedding call and one vector search.
+        Returns `{"parent_ids", "hit", ...}` per query, in input order.
+        """
+        results, misses = [None] * len(queries), {}
+        for i, query in enumerate(queries):
+            entry = self.cache.get(self.index_version, query)
+            if entry is not None:
+                results[i] = {"parent_ids": entry["parent_ids"], "hit": True, "saved_ms": round(entry["search_ms"])}
+            else:
+                misses.setdefault(normalize_question(query), []).append(i)
+
+        if misses:
+            started = time.perf_counter()
+            searched = self._search_parent_ids_batch([queries[positions[0]] for positions in misses.values()])
+            # The search cost is shared, so each miss is credited an equal slice of it.
+            search_ms = (time.perf_counter() - started) * 1000 / len(misses)
+            for positions, parent_ids in zip(misses.values(), searched):
+                self.cache.put(self.index_version, queries[positions[0]], parent_ids, search_ms)
+                for i in positions:
+                    results[i] = {"parent_ids": parent_ids, "hit": False, "search_ms": round(search_ms)}
+        return results
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        entry = self.cache.get(self.index_version, query)
+        if entry is not None:
+            parent_ids = entry["parent_ids"]
+            utils.record_request_stat(run_manager, "retrieval_cache", {"hit": True, "saved_ms": round(entry["search_ms"])})
+        else:
+            started = time.perf_counter()
+            parent_ids = self.search_parent_ids(query)
+            search_ms = (time.perf_counter() - started) * 1000
+            self.cache.put(self.index_version, query, parent_ids, search_ms)
+            utils.record_request_stat(run_manager, "retrieval_cache", {"hit": False, "search_ms": round(search_ms)})
+        return [doc for doc in self.retriever.docstore.mget(parent_ids) if doc is not None]
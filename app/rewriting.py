@@ -0,0 +1,124 @@
+# app/rewriting.py
+# Decides whether a follow-up question has to be rewritten into a standalone
+# one before retrieval. The rewrite is a full LLM round-trip, so:
+# - a cheap local classifier skips it for questions that already stand on
+#   their own ("What is FAISS?"). It's deliberately conservative: any pronoun,
+#   continuation or very short question still goes to the LLM;
+# - rewrites are cached by a fingerprint of the recent history and the
+#   question, and only that recent history is sent to the LLM, so a cached
+#   rewrite is exactly what the LLM would have been asked.
+
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from . import config, telemetry
+
+# Words that usually point back into the conversation.
+_REFERENCE_WORDS = {
+    "it", "its", "it's", "this", "that", "these", "those", "they", "them", "their", "theirs",
+    "he", "she", "him", "her", "his", "one", "ones", "former", "latter", "above", "previous",
+    "earlier", "same", "such", "there", "here", "else", "more", "another", "other", "again",
+    "also", "too", "instead", "then",
+}
+# Openings that continue the previous turn rather than start a new topic.
+_CONTINUATION_OPENERS = (
+    "and", "but", "so", "or", "also", "what about", "how about", "why not", "what if",
+    "can you", "could you", "please", "ok", "okay", "yes", "no",
+)
+_FILLER_WORDS = {
+    "what", "which", "who", "how", "why", "when", "where", "is", "are", "was", "were", "do", "does", "did",
+    "can", "could", "should", "would", "will", "the", "a", "an", "of", "to", "in", "on", "for", "with",
+    "and", "or", "me", "i", "you", "my", "your", "explain", "tell", "about", "show", "give", "example",
+}
+
+def classify(question: str) -> tuple:
+    """
+    Returns `(needs_rewrite, reason, detail)`. Only a question with no words
+    referring back, no continuation opener and at least two topical terms is
+    treated as self-contained.
+    """
+    text = question.strip().lower()
+    words = re.findall(r"[a-z0-9']+", text)
+    for word in words:
+        if word in _REFERENCE_WORDS:
+            return True, "reference_word", word
+    for opener in _CONTINUATION_OPENERS:
+        if text == opener or text.startswith(opener + " ") or text.startswith(opener + ","):
+            return True, "continuation", opener
+    topical = [word for word in words if word not in _FILLER_WORDS]
+    if len(topical) < 2 and not (topical and len(words) >= 3):
+        return True, "too_short", str(len(words))
+    return False, "self_contained", None
+
+def recent_history(chat_history: list) -> list:
+    """The part of the history the rewrite sees, and the cache key covers."""
+    return chat_history[-config.REWRITE_HISTORY_MESSAGES:] if config.REWRITE_HISTORY_MESSAGES else chat_history
+
+def fingerprint(question: str, history: list) -> str:
+    messages = [[getattr(message, "type", ""), getattr(message, "content", str(message))] for message in history]
+    payload = json.dumps({"history": messages, "question": re.sub(r"\s+", " ", question).strip()}, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class RewriteCache:
+    """Thread-safe LRU of `fingerprint -> standalone question`, with decision counters."""
+    def __init__(self, max_entries: Optional[int] = None):
+        self.max_entries = max_entries or config.REWRITE_CACHE_MAX_ENTRIES
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"skipped": 0, "hits": 0, "rewritten": 0}
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            standalone_question = self._entries.get(key)
+            if standalone_question is not None:
+                self._entries.move_to_end(key)
+        telemetry.CACHE_LOOKUPS.inc(cache="rewrite", result="miss" if standalone_question is None else "hit")
+        return standalone_question
+
+    def put(self, key: str, standalone_question: str):
+        with self._lock:
+            self._entries[key] = standalone_question
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def count(self, action: str):
+        with self._lock:
+            self._stats[action] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats, entries=len(self._entries))
+        decisions = stats["skipped"] + stats["hits"] + stats["rewritten"]
+        stats["llm_calls_avoided_rate"] = round((stats["skipped"] + stats["hits"]) / decisions, 4) if decisions else None
+        return stats
+
+cache = RewriteCache()
+
+def plan(question: str, history: list) -> dict:
+    """
+    Decides how to get the standalone question for a follow-up:
+    - `skip`: the question is self-contained and is searched as asked;
+    - `cached`: `standalone_question` holds an earlier rewrite of the same turn;
+    - `rewrite`: call the LLM, then `cache.put(plan["key"], ...)`.
+    """
+    if config.REWRITE_CLASSIFIER_ENABLED:
+        needs_rewrite, reason, detail = classify(question)
+    else:
+        needs_rewrite, reason, detail = True, "classifier_disabled", None
+    if not needs_rewrite:
+        decision = {"action": "skip", "reason": reason, "detail": detail}
+    else:
+        key = fingerprint(question, history)
+        standalone_question = cache.get(key)
+        if standalone_question is not None:
+            decision = {"action": "cached", "reason": reason, "detail": detail, "standalone_question": standalone_question}
+        else:
+            decision = {"action": "rewrite", "reason": reason, "detail": detail, "key": key}
+    cache.count({"skip": "skipped", "cached": "hits", "rewrite": "rewritten"}[decision["action"]])
+    telemetry.REWRITE_DECISIONS.inc(action=decision["action"], reason=reason)
+    return decision
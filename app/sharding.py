@@ -0,0 +1,474 @@
+# app/sharding.py
+# Optional sharded vector search (RAG_SEARCH_SHARDS=N). The child-chunk
+# vectors of the FAISS index are split into N contiguous slices, each held in
+# memory by its own worker process (`python -m app.sharding`). A search sends
+# the query vectors to every shard at once, merges their top-k hits by distance
+# and returns the parent-document IDs in rank order, exactly as one search over
+# the whole index would; the parents are then resolved through the docstore.
+#
+# The coordinator never makes a search worse than the in-process index: until
+# all shards are up, or when one fails or misses its timeout, it raises
+# ShardUnavailable and the caller searches the full (memory-mapped) index.
+# Failed workers are restarted in the background with a backoff.
+#
+# While every shard is up, the backend process doesn't keep the full index
+# mapped: the retriever's index is swapped for a ReleasableIndex, which maps
+# a version-pinned copy (`full.faiss` in the shard directory) only for fallback
+# searches. Sharding needs a single server worker (config.SERVER_WORKERS).
+
+import argparse
+import itertools
+import json
+import os
+import secrets
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, wait
+
+from . import config, telemetry
+
+class ShardUnavailable(Exception):
+    """A search the shards couldn't answer completely; callers fall back to the in-process index."""
+
+# Shard directories of running coordinators, which pruning must leave alone.
+_pinned_dirs = set()
+_pinned_lock = threading.Lock()
+
+# ==============================================================================
+# --- 1. SHARD ARTIFACTS ---
+# ==============================================================================
+def _shards_dir(index_version: str, num_shards: int) -> str:
+    return os.path.join(config.SHARDS_PATH, f"{index_version}-{num_shards}")
+
+def ensure_shards(retriever, index_version: str, num_shards: int) -> dict:
+    """
+    Splits the retriever's FAISS index into shard files (once per index version
+    and shard count) and returns their manifest. Each shard is a flat index of
+    its vectors plus the parent ID of every row. Older shard sets are removed.
+    """
+    import faiss
+    import numpy as np
+    from . import rag_pipeline
+
+    shards_dir = _shards_dir(index_version, num_shards)
+    manifest_path = os.path.join(shards_dir, 'manifest.json')
+    with rag_pipeline.get_build_lock():
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+
+        started = time.perf_counter()
+        vectorstore = retriever.vectorstore
+        index = vectorstore.index
+        num_shards = max(1, min(num_shards, index.ntotal))
+        os.makedirs(shards_dir, exist_ok=True)
+        shards = []
+        for shard_id, rows in enumerate(np.array_split(np.arange(index.ntotal), num_shards)):
+            start, count = int(rows[0]), len(rows)
+            shard_index = faiss.index_factory(index.d, "Flat", index.metric_type)
+            shard_index.add(index.reconstruct_n(start, count))
+            parent_ids = [vectorstore.docstore.search(vectorstore.index_to_docstore_id[row]).metadata.get(retriever.id_key)
+                          for row in range(start, start + count)]
+            index_file, parents_file = f"shard_{shard_id}.faiss", f"shard_{shard_id}_parents.json"
+            rag_pipeline._atomic_write(os.path.join(shards_dir, index_file), 'wb',
+                                       lambda f: f.write(faiss.serialize_index(shard_index).tobytes()))
+            rag_pipeline._atomic_write(os.path.join(shards_dir, parents_file), 'w', lambda f: json.dump(parent_ids, f))
+            shards.append({"shard": shard_id, "index_file": index_file, "parents_file": parents_file,
+                           "first_row": start, "vectors": count})
+
+        # A copy of the full index pinned to this version, for fallback searches once the
+        # live index is released. A hard link when the artifacts on disk are still this version.
+        full_index_path = os.path.join(shards_dir, "full.faiss")
+        source_path = os.path.join(config.VECTORSTORE_PATH, 'index.faiss')
+        try:
+            if rag_pipeline._load_manifest()["index_version"] != index_version:
+                raise OSError("the artifacts on disk belong to another version")
+            if os.path.exists(full_index_path):
+                os.remove(full_index_path)
+            os.link(source_path, full_index_path)
+        except OSError:
+            faiss.write_index(index, full_index_path)
+
+        manifest = {"index_version": index_version, "metric_type": int(index.metric_type), "shards": shards,
+                    "full_index_file": "full.faiss"}
+        rag_pipeline._atomic_write(manifest_path, 'w', lambda f: json.dump(manifest, f, indent=4))
+        with _pinned_lock:
+            pinned = set(_pinned_dirs)
+        for name in os.listdir(config.SHARDS_PATH):
+            path = os.path.join(config.SHARDS_PATH, name)
+            if path != shards_dir and path not in pinned:
+                shutil.rmtree(path, ignore_errors=True)
+        print(f"✅ Split {index.ntotal} vectors into {num_shards} shards in {round((time.perf_counter() - started) * 1000)} ms.")
+        return manifest
+
+# ==============================================================================
+# --- 2. SHARD WORKER ---
+# ==============================================================================
+def run_worker(shard_id: int, address, index_path: str, parents_path: str, threads: int):
+    """Loads one shard, then answers `(request_id, query_matrix, k)` messages until told to stop."""
+    import faiss
+    from multiprocessing.connection import Listener
+
+    faiss.omp_set_num_threads(threads)
+    started = time.perf_counter()
+    index = faiss.read_index(index_path)
+    with open(parents_path, 'r', encoding='utf-8') as f:
+        parent_ids = json.load(f)
+    load_ms = round((time.perf_counter() - started) * 1000)
+
+    # The coordinator passes the connection key through the environment, not the command line.
+    authkey = bytes.fromhex(os.environ.pop("RAG_SHARD_AUTHKEY"))
+    with Listener(address, authkey=authkey) as listener:
+        conn = listener.accept()
+    conn.send(("ready", index.ntotal, load_ms))
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break  # The coordinator went away.
+        if message is None:
+            break
+        request_id, matrix, k = message
+        try:
+            started = time.perf_counter()
+            distances, rows = index.search(matrix, k)
+            hits = [[(float(distance), parent_ids[row]) for distance, row in zip(row_distances, row_ids) if row != -1]
+                    for row_distances, row_ids in zip(distances, rows)]
+            conn.send((request_id, True, hits, (time.perf_counter() - started) * 1000))
+        except Exception as e:
+            conn.send((request_id, False, f"{type(e).__name__}: {e}", None))
+    conn.close()
+    print(f"[shard {shard_id}] Stopped.")
+
+# ==============================================================================
+# --- 3. COORDINATOR ---
+# ==============================================================================
+class ReleasableIndex:
+    """
+    Stands in for the backend's FAISS index while sharded search is on. The
+    index is dropped with `release()` and mapped again from `path` on the next
+    search (a fallback). Size attributes stay available while released.
+    """
+    def __init__(self, index, path: str):
+        self._index = index
+        self.path = path
+        self.ntotal, self.d, self.metric_type = index.ntotal, index.d, index.metric_type
+        self.code_size = getattr(index, "code_size", index.d * 4)
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._index is not None
+
+    def acquire(self):
+        with self._lock:
+            if self._index is None:
+                from .rag_pipeline import read_faiss_index
+                self._index = read_faiss_index(self.path)
+                print("🔄 Mapped the full FAISS index again for fallback searches.")
+            return self._index
+
+    def release(self):
+        # Searches already running keep their own reference until they finish.
+        with self._lock:
+            self._index = None
+
+    def search(self, matrix, k: int):
+        return self.acquire().search(matrix, k)
+
+    def __getattr__(self, name):
+        return getattr(self.acquire(), name)
+
+class _Shard:
+    def __init__(self, spec: dict, shards_dir: str):
+        self.shard_id = spec["shard"]
+        self.index_path = os.path.join(shards_dir, spec["index_file"])
+        self.parents_path = os.path.join(shards_dir, spec["parents_file"])
+        self.vectors = spec["vectors"]
+        self.state = "starting"
+        self.process, self.conn, self.generation = None, None, 0
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "timeouts": 0, "restarts": 0, "load_ms": None}
+        self.latencies_ms = deque(maxlen=1000)
+        self.search_ms = deque(maxlen=1000)
+
+class ShardCoordinator:
+    """Scatter-gather search over the shard processes of one index version."""
+    def __init__(self, retriever, index_version: str, num_shards: int = None):
+        self.retriever = retriever
+        self.index_version = index_version
+        self.num_shards = num_shards or config.SEARCH_SHARDS
+        self.metric_type = None
+        self._shards = []
+        self._closed = False
+        self._request_ids = itertools.count()
+        self._authkey = secrets.token_bytes(32)
+        self._socket_dir = tempfile.mkdtemp(prefix="rag-shards-")
+        self._stats = {"searches": 0, "fallbacks": 0, "error": None}
+        self._shards_dir, self._index = None, None
+
+    def start(self) -> "ShardCoordinator":
+        """Prepares the shard files and starts the workers in the background; searches fall back until they're up."""
+        def start_all():
+            try:
+                shards_dir = _shards_dir(self.index_version, self.num_shards)
+                with _pinned_lock:
+                    _pinned_dirs.add(shards_dir)
+                self._shards_dir = shards_dir
+                manifest = ensure_shards(self.retriever, self.index_version, self.num_shards)
+                self.metric_type = manifest["metric_type"]
+                self._shards = [_Shard(spec, shards_dir) for spec in manifest["shards"]]
+                if manifest.get("full_index_file"):
+                    vectorstore = self.retriever.vectorstore
+                    self._index = ReleasableIndex(vectorstore.index, os.path.join(shards_dir, manifest["full_index_file"]))
+                    vectorstore.index = self._index
+                threads = [threading.Thread(target=self._start_or_restart, args=(shard,), daemon=True) for shard in self._shards]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                if self.ready():
+                    print(f"✅ {len(self._shards)} search shards are up for index version {self.index_version}.")
+            except Exception as e:
+                self._stats["error"] = str(e)
+                print(f"❌ Could not start search shards; searching in-process: {e}")
+
+        threading.Thread(target=start_all, name="shard-startup", daemon=True).start()
+        return self
+
+    def _address(self, shard: _Shard):
+        if hasattr(socket, "AF_UNIX"):
+            path = os.path.join(self._socket_dir, f"shard-{shard.shard_id}.sock")
+            if os.path.exists(path):
+                os.remove(path)
+            return path, path
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        return ("127.0.0.1", port), f"127.0.0.1:{port}"
+
+    def _spawn(self, shard: _Shard):
+        """Starts a worker process for the shard and connects to it once it has loaded its slice."""
+        from multiprocessing.connection import Client
+
+        address, address_arg = self._address(shard)
+        env = dict(os.environ, RAG_SHARD_AUTHKEY=self._authkey.hex())
+        process = subprocess.Popen([
+            sys.executable, "-m", "app.sharding", "--shard-id", str(shard.shard_id), "--address", address_arg,
+            "--index", shard.index_path, "--parents", shard.parents_path, "--threads", str(config.SHARD_THREADS),
+        ], cwd=config.PROJECT_ROOT, env=env)
+        deadline = time.monotonic() + config.SHARD_START_TIMEOUT_SECONDS
+        try:
+            while True:
+                if process.poll() is not None:
+                    raise RuntimeError(f"worker exited with code {process.returncode}")
+                try:
+                    conn = Client(address, authkey=self._authkey)
+                    break
+                except (FileNotFoundError, ConnectionRefusedError):
+                    if time.monotonic() > deadline:
+                        raise RuntimeError(f"worker did not start within {config.SHARD_START_TIMEOUT_SECONDS:g} s")
+                    time.sleep(0.05)
+            if not conn.poll(max(0.0, deadline - time.monotonic())):
+                raise RuntimeError("worker did not report ready")
+            _, vectors, load_ms = conn.recv()
+        except BaseException:
+            process.kill()
+            raise
+
+        with shard.lock:
+            shard.process, shard.conn = process, conn
+            shard.generation += 1
+            shard.state = "ready"
+            shard.stats["load_ms"] = load_ms
+            generation = shard.generation
+        threading.Thread(target=self._read_responses, args=(shard, conn, generation),
+                         name=f"shard-{shard.shard_id}-reader", daemon=True).start()
+        self._update_healthy_gauge()
+
+    def _start_or_restart(self, shard: _Shard):
+        backoff = 1.0
+        while not self._closed:
+            try:
+                self._spawn(shard)
+                return
+            except Exception as e:
+                with shard.lock:
+                    shard.state = "down"
+                print(f"⚠️ Search shard {shard.shard_id} failed to start ({e}); retrying in {backoff:g} s.")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, config.SHARD_RESTART_MAX_BACKOFF_SECONDS)
+
+    def _read_responses(self, shard: _Shard, conn, generation: int):
+        while True:
+            try:
+                request_id, ok, payload, search_ms = conn.recv()
+            except (EOFError, OSError):
+                break
+            with shard.lock:
+                future = shard.pending.pop(request_id, None)
+            # A response for a search that already timed out is dropped.
+            if future is not None:
+                future.set_result((ok, payload, search_ms, time.perf_counter()))
+
+        with shard.lock:
+            if shard.generation != generation:
+                return
+            shard.state = "down"
+            pending, shard.pending = shard.pending, {}
+        for future in pending.values():
+            future.set_result((False, "shard process exited", None, time.perf_counter()))
+        self._update_healthy_gauge()
+        if not self._closed:
+            print(f"⚠️ Search shard {shard.shard_id} went down; restarting it.")
+            telemetry.SHARD_FAILURES.inc(shard=shard.shard_id, kind="down")
+            with shard.lock:
+                shard.stats["restarts"] += 1
+            threading.Thread(target=self._start_or_restart, args=(shard,), daemon=True).start()
+
+    def ready(self) -> bool:
+        return bool(self._shards) and all(shard.state == "ready" for shard in self._shards)
+
+    def _fallback(self, reason: str):
+        self._stats["fallbacks"] += 1
+        telemetry.SHARDED_SEARCHES.inc(result="fallback")
+        raise ShardUnavailable(reason)
+
+    def search(self, matrix, k: int) -> list:
+        """
+        Searches every shard for the (already normalized) query vectors and
+        returns, per query, the unique parent IDs of the merged top-k child
+        chunks in rank order. Raises ShardUnavailable unless all shards answered.
+        """
+        if self._closed or not self.ready():
+            self._fallback("not all shards are up")
+        sent = []
+        for shard in self._shards:
+            request_id, future = next(self._request_ids), Future()
+            with shard.lock:
+                shard.pending[request_id] = future
+                conn = shard.conn
+            started = time.perf_counter()
+            try:
+                with shard.send_lock:
+                    conn.send((request_id, matrix, k))
+            except (OSError, ValueError):
+                with shard.lock:
+                    shard.pending.pop(request_id, None)
+                self._fallback(f"shard {shard.shard_id} is unreachable")
+            sent.append((shard, request_id, future, started))
+
+        wait([future for _, _, future, _ in sent], timeout=config.SHARD_SEARCH_TIMEOUT_SECONDS)
+        hits, failed = [[] for _ in range(len(matrix))], []
+        for shard, request_id, future, started in sent:
+            with shard.lock:
+                shard.stats["requests"] += 1
+                if not future.done():
+                    shard.pending.pop(request_id, None)
+                    shard.stats["timeouts"] += 1
+                    telemetry.SHARD_FAILURES.inc(shard=shard.shard_id, kind="timeout")
+                    failed.append(shard.shard_id)
+                    continue
+            ok, payload, search_ms, finished = future.result()
+            if not ok:
+                with shard.lock:
+                    shard.stats["errors"] += 1
+                telemetry.SHARD_FAILURES.inc(shard=shard.shard_id, kind="error")
+                failed.append(shard.shard_id)
+                continue
+            with shard.lock:
+                shard.latencies_ms.append((finished - started) * 1000)
+                shard.search_ms.append(search_ms)
+            telemetry.SHARD_SEARCH_LATENCY.observe(finished - started, shard=shard.shard_id)
+            for query_hits, shard_hits in zip(hits, payload):
+                query_hits.extend(shard_hits)
+        if failed:
+            self._fallback(f"shards {failed} did not answer")
+
+        self._stats["searches"] += 1
+        telemetry.SHARDED_SEARCHES.inc(result="sharded")
+        if self._index is not None and self._index.loaded:
+            # Mapped again by a fallback; the shards are answering, so drop it.
+            self._index.release()
+        import faiss
+        # Smaller is closer for L2 distances; larger is closer for inner products.
+        larger_is_closer = self.metric_type == faiss.METRIC_INNER_PRODUCT
+        return [list(dict.fromkeys(parent_id for _, parent_id in sorted(query_hits, key=lambda hit: hit[0], reverse=larger_is_closer)[:k]
+                                   if parent_id is not None))
+                for query_hits in hits]
+
+    def _update_healthy_gauge(self):
+        telemetry.SHARDS_HEALTHY.set(sum(shard.state == "ready" for shard in self._shards))
+        if self._index is not None and self.ready() and not self._closed:
+            self._index.release()
+
+    def status(self) -> dict:
+        import numpy as np
+
+        shards = []
+        for shard in self._shards:
+            with shard.lock:
+                latencies, search_ms = list(shard.latencies_ms), list(shard.search_ms)
+                shards.append({
+                    "shard": shard.shard_id, "state": shard.state, "pid": shard.process.pid if shard.process else None,
+                    "vectors": shard.vectors, **shard.stats,
+                    "latency_p50_ms": round(float(np.percentile(latencies, 50)), 2) if latencies else None,
+                    "latency_p95_ms": round(float(np.percentile(latencies, 95)), 2) if latencies else None,
+                    "search_p50_ms": round(float(np.percentile(search_ms, 50)), 2) if search_ms else None,
+                })
+        return {"index_version": self.index_version, "ready": self.ready(),
+                "healthy": sum(shard["state"] == "ready" for shard in shards), **self._stats,
+                "full_index_mapped": self._index.loaded if self._index is not None else True, "shards": shards}
+
+    def close(self):
+        """Stops the workers. Searches still running on this coordinator fall back to the in-process index."""
+        self._closed = True
+        if self._index is not None:
+            # Mapped before the shard directory is unpinned and can be pruned.
+            self._index.acquire()
+        for shard in self._shards:
+            with shard.lock:
+                shard.state = "stopped"
+                shard.generation += 1
+                conn, process = shard.conn, shard.process
+            if conn is not None:
+                try:
+                    with shard.send_lock:
+                        conn.send(None)
+                except (OSError, ValueError):
+                    pass
+            if process is not None:
+                try:
+                    process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+            if conn is not None:
+                conn.close()
+        shutil.rmtree(self._socket_dir, ignore_errors=True)
+        with _pinned_lock:
+            _pinned_dirs.discard(self._shards_dir)
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs one search shard. Started by the backend when RAG_SEARCH_SHARDS is set.")
+    parser.add_argument("--shard-id", type=int, required=True)
+    parser.add_argument("--address", required=True, help="Unix socket path, or host:port.")
+    parser.add_argument("--index", required=True)
+    parser.add_argument("--parents", required=True)
+    parser.add_argument("--threads", type=int, default=config.SHARD_THREADS)
+    args = parser.parse_args()
+    address = args.address
+    if not hasattr(socket, "AF_UNIX"):
+        host, port = address.rsplit(":", 1)
+        address = (host, int(port))
+    run_worker(args.shard_id, address, args.index, args.parents, args.threads)
+
+if __name__ == "__main__":
+    main()
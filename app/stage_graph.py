@@ -0,0 +1,51 @@
+# app/stage_graph.py
+# A tiny dependency graph for the independent steps of a request handler.
+# Each stage starts as soon as the stages it depends on have finished, so work
+# that doesn't depend on the answer (such as embedding the query for the user
+# profile) overlaps with generation, and a handler's wall-clock time approaches
+# its longest chain of dependent stages instead of the sum of all of them.
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable
+
+from . import config, profiling
+
+# Stages only ever wait on stages submitted before them, and the pool runs
+# tasks in submission order, so a saturated pool can't deadlock on itself.
+_executor = ThreadPoolExecutor(max_workers=config.STAGE_GRAPH_WORKERS, thread_name_prefix="request-stage")
+
+class StageGraph:
+    """
+    Runs named stages concurrently. A stage's function receives the results of
+    the stages listed in `after`, in order. An exception in a stage is re-raised
+    by `result()` for it and for every stage that depends on it.
+    """
+    def __init__(self):
+        self._futures = {}
+        self._lock = threading.Lock()
+        self.stage_ms = {}
+
+    def add(self, name: str, fn: Callable, after: Iterable[str] = ()):
+        dependencies = [self._futures[dependency] for dependency in after]
+
+        def run():
+            inputs = [dependency.result() for dependency in dependencies]
+            started = time.perf_counter()
+            try:
+                return fn(*inputs)
+            finally:
+                with self._lock:
+                    self.stage_ms[name] = round((time.perf_counter() - started) * 1000)
+
+        # Pool threads outlive requests, so a profiled request hands them its session.
+        self._futures[name] = _executor.submit(profiling.bind(run))
+        return self
+
+    def result(self, name: str):
+        return self._futures[name].result()
+
+    def wait(self) -> dict:
+        """Waits for every stage and returns all results by name."""
+        return {name: future.result() for name, future in self._futures.items()}
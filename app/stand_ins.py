@@ -0,0 +1,74 @@
+# app/stand_ins.py
+# Local stand-ins for the Gemini models, selected with RAG_MODEL_BACKEND=stand-in.
+# They need no API key or network access, so the full server can be run under
+# load, and deadline/hedging behaviour can be reproduced, on any machine:
+#
+#   RAG_MODEL_BACKEND=stand-in RAG_STAND_IN_TAIL_PROBABILITY=0.2 python -m app.main
+
+import hashlib
+import math
+import random
+import re
+import time
+from typing import Any, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.llms import BaseLLM
+from langchain_core.outputs import Generation, LLMResult
+
+class HashEmbeddings(Embeddings):
+    """
+    Deterministic bag-of-words embeddings: each token is hashed into one of
+    `size` buckets and the vector is L2-normalized. Texts sharing words are
+    similar, which is enough for retrieval to behave sensibly in tests.
+    """
+    def __init__(self, size: int = 256):
+        self.size = size
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.size
+        for token in re.findall(r"[a-z0-9]+", text.lower()):
+            bucket = int.from_bytes(hashlib.md5(token.encode("utf-8")).digest()[:4], "little") % self.size
+            vector[bucket] += 1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+class DelayedFakeLLM(BaseLLM):
+    """
+    Canned LLM with a latency profile: every call sleeps `delay_seconds`
+    (+/- 20%), and with probability `tail_probability` sleeps `tail_delay_seconds`
+    instead. Token usage is reported like Gemini's, at ~4 characters per token.
+    """
+    delay_seconds: float = 0.5
+    tail_probability: float = 0.0
+    tail_delay_seconds: float = 8.0
+    seed: Optional[int] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "delayed-fake"
+
+    def _respond(self, prompt: str) -> str:
+        # Rewrite prompts get the follow-up question back; answers cite the first source.
+        if "rephrase the follow-up question" in prompt:
+            return prompt.rstrip().splitlines()[-1].split(":", 1)[-1].strip()
+        return "This is a stand-in answer generated without calling a real model [1].\n\nSources:\n1. stand-in"
+
+    def _generate(self, prompts: List[str], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> LLMResult:
+        rng = random.Random(self.seed) if self.seed is not None else random
+        generations = []
+        for prompt in prompts:
+            if rng.random() < self.tail_probability:
+                time.sleep(self.tail_delay_seconds)
+            else:
+                time.sleep(self.delay_seconds * rng.uniform(0.8, 1.2))
+            text = self._respond(prompt)
+            usage = {"input_tokens": len(prompt) // 4, "output_tokens": len(text) // 4}
+            generations.append([Generation(text=text, generation_info={"usage_metadata": usage})])
+        return LLMResult(generations=generations)
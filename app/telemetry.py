@@ -0,0 +1,133 @@
+# app/telemetry.py
+# In-process counters and fixed-bucket histograms for the Flask backend,
+# rendered in the Prometheus text exposition format at `/metrics`.
+# Recording is a dict update under a per-metric lock, cheap enough to stay on at
+# full traffic. Values are per process: with several workers, scrape each one.
+
+import bisect
+import threading
+from typing import Dict, Sequence, Tuple
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labelnames: Sequence[str], values: Tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        return self._header() + [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in values.items()]
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        with self._lock:
+            values = {key: {"counts": list(s["counts"]), "sum": s["sum"], "count": s["count"]} for key, s in self._values.items()}
+        lines = self._header()
+        for key, series in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series["counts"]):
+                cumulative += count
+                le_label = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series['sum']}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series['count']}")
+        return lines
+
+REGISTRY = []
+
+def render() -> str:
+    """Renders every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# ==============================================================================
+# --- METRIC DEFINITIONS ---
+# ==============================================================================
+HTTP_REQUESTS = Counter("rag_http_requests_total", "HTTP requests handled, by endpoint, method and status.", ("endpoint", "method", "status"))
+HTTP_LATENCY = Histogram("rag_http_request_duration_seconds", "HTTP request latency, by endpoint.", ("endpoint",))
+INITIALIZATION_UNAVAILABLE = Counter("rag_initialization_unavailable_total", "Requests rejected with 503 while the pipeline was initializing.", ("endpoint",))
+ERRORS = Counter("rag_errors_total", "Unhandled exceptions caught by the Flask error handler, by exception type.", ("exception",))
+PIPELINE_READY = Gauge("rag_pipeline_ready", "1 once the RAG pipeline has finished initializing.")
+PIPELINE_RELOADS = Counter("rag_pipeline_reloads_total", "Knowledge-base reloads, by trigger and result.", ("trigger", "result"))
+TENANT_LOADS = Counter("rag_tenant_loads_total", "Tenant pipelines loaded on first use, by result.", ("result",))
+TENANT_EVICTIONS = Counter("rag_tenant_evictions_total", "Tenant pipelines unloaded, by reason.", ("reason",))
+TENANTS_LOADED = Gauge("rag_tenants_loaded", "Tenant pipelines currently loaded.")
+PROCESS_RESIDENT_BYTES = Gauge("rag_process_resident_bytes", "Resident memory of this process.")
+TRACED_MEMORY_BYTES = Gauge("rag_traced_memory_bytes", "Memory traced by tracemalloc, while memory snapshots or profiling are on.")
+SHARDS_HEALTHY = Gauge("rag_shards_healthy", "Search shard processes that are up.")
+SHARDED_SEARCHES = Counter("rag_sharded_searches_total", "Vector searches in sharded mode, by whether the shards answered or the in-process index did.", ("result",))
+SHARD_SEARCH_LATENCY = Histogram("rag_shard_search_duration_seconds", "Round-trip latency of shard searches, by shard.", ("shard",))
+SHARD_FAILURES = Counter("rag_shard_failures_total", "Shard searches that failed, by shard and kind (timeout, error, down).", ("shard", "kind"))
+
+LLM_CALLS = Counter("rag_llm_calls_total", "Completed LLM calls.")
+LLM_LATENCY = Histogram("rag_llm_call_duration_seconds", "LLM call latency.")
+LLM_TOKENS = Counter("rag_llm_tokens_total", "LLM tokens, by direction.", ("direction",))
+LLM_COST = Counter("rag_llm_cost_usd_total", "Estimated LLM cost in USD.")
+DEADLINE_EXCEEDED = Counter("rag_deadline_exceeded_total", "Request stages abandoned at the request deadline, by stage.", ("stage",))
+HEDGED_CALLS = Counter("rag_hedged_calls_total", "Second attempts started for slow stages, by stage.", ("stage",))
+REWRITE_DECISIONS = Counter("rag_rewrite_decisions_total", "Follow-up questions by how the standalone question was obtained, and why.", ("action", "reason"))
+
+EMBEDDING_CALLS = Counter("rag_embedding_model_calls_total", "Calls made to the embeddings model, by task.", ("task",))
+EMBEDDING_TEXTS = Counter("rag_embedding_texts_embedded_total", "Texts sent to the embeddings model, by task.", ("task",))
+CACHE_LOOKUPS = Counter("rag_cache_lookups_total", "Cache lookups, by cache and result.", ("cache", "result"))
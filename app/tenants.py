@@ -0,0 +1,177 @@
+# app/tenants.py
+# Serves several knowledge bases ("tenants") from one deployment. Every
+# subdirectory of config.TENANTS_DIR is a tenant with its own FAISS index,
+# parent docstore and embedding cache under config.TENANT_CACHE_DIR/<tenant>.
+# A tenant's pipeline is built or loaded on its first request and kept in an
+# LRU; once the loaded tenants exceed the memory budget, the least recently
+# used ones are unloaded, so memory stays bounded however many tenants exist.
+# The models themselves are shared with the default knowledge base.
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from . import config, rag_pipeline, telemetry
+
+TENANT_NAME_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_-]{0,63}$")
+# Vectors in the embedding cache's memory LRU are float32 arrays.
+BYTES_PER_CACHED_DIMENSION = 4
+
+class TenantError(Exception):
+    """A tenant that can't be served; `status` is the HTTP status to answer with."""
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.status = status
+
+def tenant_paths(name: str):
+    """Returns a tenant's knowledge-base directory and cache directory."""
+    return os.path.join(config.TENANTS_DIR, name), os.path.join(config.TENANT_CACHE_DIR, name)
+
+def make_embeddings(base_embeddings, cache_dir: str):
+    """The tenant's own embedding cache in front of the shared embeddings model."""
+    from .embedding_cache import CachedEmbeddings
+    return CachedEmbeddings(base_embeddings, model_name=rag_pipeline.embedding_model_name(),
+                            store_path=os.path.join(cache_dir, 'embedding_cache.sqlite3'),
+                            max_entries=config.TENANT_EMBEDDING_CACHE_MAX_ENTRIES)
+
+def _footprint_bytes(snapshot, cache_dir: str) -> int:
+    """
+    Approximate memory a loaded tenant holds: its artifacts' size on disk (the
+    docstore is unpickled into the heap; the index and embedding matrix are
+    memory-mapped but their pages are touched by every search) plus its
+    embedding cache at capacity.
+    """
+    total = 0
+    for path in (config.VECTORSTORE_PATH, config.DOCSTORE_PATH, config.DOC_EMBEDDINGS_PATH):
+        path = rag_pipeline._artifact_path(path, cache_dir)
+        if os.path.isdir(path):
+            total += sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+        elif os.path.exists(path):
+            total += os.path.getsize(path)
+    dimensions = snapshot.doc_embedding_matrix.shape[1] if snapshot.doc_topic_ids else 0
+    return total + config.TENANT_EMBEDDING_CACHE_MAX_ENTRIES * dimensions * BYTES_PER_CACHED_DIMENSION
+
+class TenantRegistry:
+    """Thread-safe LRU of loaded tenant pipelines, bounded by an approximate memory budget."""
+    def __init__(self, memory_budget_mb: float = None):
+        self.memory_budget_bytes = (memory_budget_mb or config.TENANT_MEMORY_BUDGET_MB) * 1e6
+        self._loaded = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "loads": 0, "evictions": 0}
+
+    def available(self) -> list:
+        """Tenants with a knowledge base in TENANTS_DIR, loaded or not."""
+        if not os.path.isdir(config.TENANTS_DIR):
+            return []
+        return sorted(name for name in os.listdir(config.TENANTS_DIR)
+                      if TENANT_NAME_PATTERN.match(name) and os.path.isdir(os.path.join(config.TENANTS_DIR, name)))
+
+    def get(self, name: str) -> "rag_pipeline.PipelineSnapshot":
+        """
+        Returns the tenant's pipeline, loading it (and building its artifacts,
+        outside shared-artifact mode) on first use. Concurrent first requests for
+        the same tenant wait for a single load. Raises TenantError.
+        """
+        if not TENANT_NAME_PATTERN.match(name or ""):
+            raise TenantError(f"Invalid tenant name '{name}'.", 400)
+        with self._lock:
+            entry = self._loaded.get(name)
+            if entry is not None:
+                self._loaded.move_to_end(name)
+                self._stats["hits"] += 1
+                return entry["snapshot"]
+            future = self._loading.get(name)
+            loading_here = future is None
+            if loading_here:
+                future = self._loading[name] = Future()
+        if not loading_here:
+            return future.result()
+
+        try:
+            started = time.perf_counter()
+            snapshot, footprint = self._load(name)
+            load_ms = round((time.perf_counter() - started) * 1000)
+        except BaseException as e:
+            with self._lock:
+                del self._loading[name]
+            future.set_exception(e)
+            telemetry.TENANT_LOADS.inc(result="failed")
+            raise
+
+        with self._lock:
+            del self._loading[name]
+            self._loaded[name] = {"snapshot": snapshot, "footprint_bytes": footprint, "load_ms": load_ms}
+            self._stats["loads"] += 1
+            evicted = self._evict_over_budget(keep=name)
+            loaded_count = len(self._loaded)
+        future.set_result(snapshot)
+        telemetry.TENANT_LOADS.inc(result="done")
+        telemetry.TENANTS_LOADED.set(loaded_count)
+        print(f"✅ Loaded tenant '{name}' (version {snapshot.index_version}, ~{footprint / 1e6:.1f} MB) in {load_ms} ms.")
+        if evicted:
+            print(f"🔄 Unloaded least recently used tenants to stay within the memory budget: {', '.join(evicted)}.")
+        return snapshot
+
+    def _load(self, name: str):
+        from .retrieval_cache import RetrievalCache
+
+        knowledge_base_path, cache_dir = tenant_paths(name)
+        if not os.path.isdir(knowledge_base_path):
+            raise TenantError(f"Unknown tenant '{name}'.", 404)
+        # Each tenant gets its own embedding and retrieval caches in front of the shared models.
+        embeddings = make_embeddings(rag_pipeline.embeddings.base, cache_dir)
+        if config.SHARED_ARTIFACTS_MODE:
+            if not rag_pipeline._artifacts_ready(cache_dir):
+                raise TenantError(f"Artifacts for tenant '{name}' not found. Run `python -m app.build_artifacts --tenant {name}`.", 503)
+        else:
+            # A no-op unless the tenant's cache is missing or its knowledge base changed since it was built.
+            rag_pipeline.build_artifacts(embeddings, cache_dir=cache_dir, knowledge_base_path=knowledge_base_path)
+        snapshot = rag_pipeline.load_snapshot(embeddings, rag_pipeline.llm, RetrievalCache(config.TENANT_RETRIEVAL_CACHE_MAX_ENTRIES), cache_dir)
+        return snapshot, _footprint_bytes(snapshot, cache_dir)
+
+    def _evict_over_budget(self, keep: str) -> list:
+        """Unloads least recently used tenants until the rest fit the budget. Call with the lock held."""
+        evicted = []
+        while sum(entry["footprint_bytes"] for entry in self._loaded.values()) > self.memory_budget_bytes:
+            oldest = next(iter(self._loaded))
+            if oldest == keep:
+                # A tenant larger than the whole budget is still served, on its own.
+                break
+            del self._loaded[oldest]
+            evicted.append(oldest)
+        if evicted:
+            self._stats["evictions"] += len(evicted)
+            telemetry.TENANT_EVICTIONS.inc(len(evicted), reason="memory_budget")
+        return evicted
+
+    def unload(self, name: str) -> bool:
+        """
+        Drops a loaded tenant; its next request loads it again, picking up a
+        changed knowledge base. Requests already using it finish first.
+        """
+        with self._lock:
+            removed = self._loaded.pop(name, None) is not None
+            loaded_count = len(self._loaded)
+        if removed:
+            telemetry.TENANT_EVICTIONS.inc(reason="admin")
+            telemetry.TENANTS_LOADED.set(loaded_count)
+        return removed
+
+    def status(self) -> dict:
+        with self._lock:
+            loaded = {name: {"index_version": entry["snapshot"].index_version, "footprint_mb": round(entry["footprint_bytes"] / 1e6, 1),
+                             "load_ms": entry["load_ms"]} for name, entry in self._loaded.items()}
+            stats = dict(self._stats)
+        return {
+            "available": self.available(),
+            "loaded": loaded,
+            "memory_budget_mb": round(self.memory_budget_bytes / 1e6, 1),
+            "memory_used_mb": round(sum(entry["footprint_mb"] for entry in loaded.values()), 1),
+            **stats,
+        }
+
+registry = TenantRegistry()
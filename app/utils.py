@@ -3,12 +3,74 @@
 import json
 import threading
 import os
+import time
 from datetime import datetime
 from langchain_core.callbacks.base import BaseCallbackHandler
-from . import config
+from . import config, telemetry
 
-# Thread-safe lock for file operations
-file_lock = threading.Lock()
+try:
+    import fcntl
+
+    def _lock_file(handle):
+        fcntl.flock(handle.fileno(), fcntl.LOCK_EX)
+
+    def _unlock_file(handle):
+        fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+except ImportError:  # Windows
+    import msvcrt
+
+    def _lock_file(handle):
+        handle.seek(0)
+        while True:
+            try:
+                msvcrt.locking(handle.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                time.sleep(0.05)
+
+    def _unlock_file(handle):
+        handle.seek(0)
+        msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+
+class InterProcessLock:
+    """
+    Re-entrant lock that serializes access across threads *and* worker processes.
+    The lock file is reopened on every outermost acquire, because an OS file lock
+    held through a descriptor inherited across fork() would be shared by parent and child.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._handle = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._handle = open(self.path, 'a+')
+                _lock_file(self._handle)
+            except BaseException:
+                if self._handle:
+                    self._handle.close()
+                    self._handle = None
+                self._thread_lock.release()
+                raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._depth -= 1
+        if self._depth == 0:
+            _unlock_file(self._handle)
+            self._handle.close()
+            self._handle = None
+        self._thread_lock.release()
+        return False
+
+# Process-safe lock for profile and log file operations
+file_lock = InterProcessLock(config.FILE_LOCK_PATH)
 
 # +++ THE FIX: This function is now in the correct shared utility file +++
 def normalize_topic(topic: str) -> str:
@@ -29,18 +91,33 @@ class TokenUsageCallback(BaseCallbackHandler):
         super().__init__()
         self.prompt_tokens = 0
         self.completion_tokens = 0
+        self._call_started_at = {}
 
-    def on_llm_end(self, response, **kwargs):
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._call_started_at[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id=None, **kwargs):
         """
         Parses the response from the LLM to find token information.
         """
+        call_input_tokens, call_output_tokens = 0, 0
         for generation_chunk in response.generations:
             for generation in generation_chunk:
                 if generation.generation_info:
                     usage = generation.generation_info.get('usage_metadata', {})
                     if usage:
-                        self.prompt_tokens += usage.get('input_tokens', 0)
-                        self.completion_tokens += usage.get('output_tokens', 0)
+                        call_input_tokens += usage.get('input_tokens', 0)
+                        call_output_tokens += usage.get('output_tokens', 0)
+        self.prompt_tokens += call_input_tokens
+        self.completion_tokens += call_output_tokens
+
+        started_at = self._call_started_at.pop(run_id, None)
+        telemetry.LLM_CALLS.inc()
+        if started_at is not None:
+            telemetry.LLM_LATENCY.observe(time.perf_counter() - started_at)
+        telemetry.LLM_TOKENS.inc(call_input_tokens, direction="input")
+        telemetry.LLM_TOKENS.inc(call_output_tokens, direction="output")
+        telemetry.LLM_COST.inc(calculate_cost(call_input_tokens, call_output_tokens))
 
     def get_total_prompt_tokens(self):
         return self.prompt_tokens
@@ -55,6 +132,27 @@ class TokenUsageCallback(BaseCallbackHandler):
         self.prompt_tokens = 0
         self.completion_tokens = 0
 
+# --- Per-Request Pipeline Stats ---
+class RequestStatsCallback(BaseCallbackHandler):
+    """
+    Collects per-request events (cache hits, saved latency, ...) that pipeline
+    components report while a chain runs, so they can be added to the query log.
+    """
+    def __init__(self):
+        super().__init__()
+        self.stats = {}
+
+    def record(self, key: str, value):
+        self.stats[key] = value
+
+def record_request_stat(run_manager, key: str, value):
+    """Reports a stat to every RequestStatsCallback attached to the current run."""
+    if run_manager is None:
+        return
+    for handler in run_manager.handlers:
+        if isinstance(handler, RequestStatsCallback):
+            handler.record(key, value)
+
 # --- Cost Calculation Utility ---
 def calculate_cost(input_tokens: int, output_tokens: int) -> float:
     """Calculates the cost of an LLM call based on token usage and config prices."""
@@ -78,12 +176,14 @@ def load_user_profiles():
             return {}
 
 def save_user_profiles(profiles):
-    """Saves user profiles to the JSON file."""
+    """Saves user profiles to the JSON file, replacing it atomically."""
     with file_lock:
         profile_path = os.path.join(config.BASE_DIR, 'data', 'user_profiles.json')
         os.makedirs(os.path.dirname(profile_path), exist_ok=True)
-        with open(profile_path, 'w', encoding='utf-8') as f:
+        tmp_path = f"{profile_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
             json.dump(profiles, f, indent=4)
+        os.replace(tmp_path, profile_path)
 
 # --- Logging Functions ---
 def log_query(log_entry):
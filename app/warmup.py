@@ -0,0 +1,142 @@
+# app/warmup.py
+# Warms the caches after startup from historical traffic, so the first users
+# after a deploy don't all pay the full LLM latency for the most popular
+# questions and documents. The most recent query-log entries are mined for the
+# most frequent history-free questions and /api/get_document topics, then:
+# 1. the embedding and retrieval caches are filled for the top questions in one
+#    batched embedding call and vector search (no LLM calls);
+# 2. answers and summaries are generated, most popular first, until the LLM
+#    call or token budget is spent.
+# It runs on a daemon thread after the pipeline is ready and never delays readiness.
+
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+
+from . import config, rag_pipeline, utils
+from .retrieval_cache import normalize_question
+
+# /api/get_document logs its request as this profile query, with the topic as the only source.
+GET_DOCUMENT_QUERY_PATTERN = re.compile(r"^Please explain more about '.+'$")
+
+_status_lock = threading.Lock()
+_status = {"state": "idle"}
+
+def _set_status(**changes):
+    with _status_lock:
+        _status.update(changes)
+
+def status() -> dict:
+    with _status_lock:
+        return dict(_status)
+
+def mine_query_log(log_path: str = None, max_lines: int = None) -> dict:
+    """
+    Counts questions asked without history (by normalized form, keeping the most
+    recent wording) and requested document topics in the last `max_lines` log
+    lines. Degraded responses, follow-ups and evaluation or replay traffic
+    (`no_cache` requests and WARMUP_EXCLUDED_USER_PREFIXES) are skipped. Returns both lists as
+    `(text, count)` pairs, most frequent first. Entries written before the log
+    recorded `no_cache` can't tell follow-ups apart, so they are skipped too
+    (batch questions are always history-free).
+    """
+    log_path = log_path or config.QUERY_LOGS_PATH
+    if not os.path.exists(log_path):
+        return {"queries": [], "topics": []}
+    with utils.file_lock:
+        with open(log_path, 'r', encoding='utf-8') as f:
+            lines = deque(f, maxlen=max_lines or config.WARMUP_LOG_MAX_LINES)
+
+    query_counts, topic_counts, wording = Counter(), Counter(), {}
+    for line in lines:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            continue
+        query, sources = entry.get("query"), entry.get("sources") or []
+        if not isinstance(query, str) or entry.get("degraded") or entry.get("rewrite") or entry.get("no_cache"):
+            continue
+        if "no_cache" not in entry and "batch_index" not in entry:
+            continue
+        if str(entry.get("user_id", "")).startswith(config.WARMUP_EXCLUDED_USER_PREFIXES):
+            continue
+        if GET_DOCUMENT_QUERY_PATTERN.match(query) and len(sources) == 1 and "rewrite" not in entry:
+            topic_counts[utils.normalize_topic(sources[0])] += 1
+        else:
+            key = normalize_question(query)
+            query_counts[key] += 1
+            wording[key] = query
+    return {"queries": [(wording[key], count) for key, count in query_counts.most_common()],
+            "topics": topic_counts.most_common()}
+
+def warm_caches(pipeline=None, log_path: str = None) -> dict:
+    """Runs the warm-up against a pipeline snapshot (the default knowledge base's unless given) and returns its status."""
+    from .deadlines import Deadline
+
+    pipeline = pipeline or rag_pipeline.get_snapshot()
+    started = time.perf_counter()
+    _set_status(state="running", started_at=datetime.utcnow().isoformat(), index_version=pipeline.index_version,
+                duration_ms=None, error=None)
+    mined = mine_query_log(log_path)
+    queries, topics = mined["queries"], mined["topics"]
+
+    # --- 1. Embedding and retrieval caches ---
+    top_queries = [query for query, _ in queries[:config.WARMUP_TOP_QUERIES]]
+    if top_queries:
+        pipeline.cached_retriever.get_parent_ids_batch(top_queries)
+    _set_status(retrieval_warmed=len(top_queries))
+
+    # --- 2. Answer and summary caches, within the LLM budget ---
+    candidates = sorted([("query", query, count) for query, count in queries] + [("topic", topic, count) for topic, count in topics],
+                        key=lambda candidate: -candidate[2])
+    token_callback = utils.TokenUsageCallback()
+    llm_calls, answers, summaries, stopped_by = 0, 0, 0, None
+    for kind, text, _ in candidates:
+        tokens = token_callback.get_total_prompt_tokens() + token_callback.get_total_completion_tokens()
+        if llm_calls >= config.WARMUP_MAX_LLM_CALLS or tokens >= config.WARMUP_MAX_TOKENS:
+            stopped_by = "llm_calls" if llm_calls >= config.WARMUP_MAX_LLM_CALLS else "tokens"
+            break
+        deadline = Deadline(config.REQUEST_DEADLINE_SECONDS)
+        if kind == "query":
+            if rag_pipeline.answer_cache.contains(pipeline.index_version, normalize_question(text)):
+                continue
+            result = rag_pipeline.answer_query(pipeline, text, [], [token_callback], deadline)
+            answers += not result["degraded"]
+        else:
+            document_data = pipeline.doc_embeddings_cache.get(text)
+            if not document_data or rag_pipeline.summary_cache.contains(pipeline.index_version, text):
+                continue
+            result = rag_pipeline.summarize_document(pipeline, text, document_data['content'], [token_callback], deadline)
+            summaries += not result["degraded"]
+        llm_calls += 1
+        _set_status(llm_calls=llm_calls, tokens=token_callback.get_total_prompt_tokens() + token_callback.get_total_completion_tokens(),
+                    answers_warmed=answers, summaries_warmed=summaries)
+
+    tokens = token_callback.get_total_prompt_tokens() + token_callback.get_total_completion_tokens()
+    _set_status(state="done", duration_ms=round((time.perf_counter() - started) * 1000), llm_calls=llm_calls, tokens=tokens,
+                answers_warmed=answers, summaries_warmed=summaries, stopped_by=stopped_by,
+                candidates={"queries": len(queries), "topics": len(topics)})
+    return status()
+
+def start_warmup():
+    """Starts the warm-up on a daemon thread. Returns the thread, or None when disabled."""
+    if not config.WARMUP_ENABLED:
+        return None
+
+    def run():
+        try:
+            report = warm_caches()
+            print(f"✅ Cache warm-up done in {report['duration_ms']} ms: retrieval for {report['retrieval_warmed']} questions, "
+                  f"{report['answers_warmed']} answers and {report['summaries_warmed']} summaries "
+                  f"({report['llm_calls']} LLM calls, {report['tokens']} tokens).")
+        except Exception as e:
+            _set_status(state="failed", error=str(e))
+            print(f"⚠️ Cache warm-up failed: {e}")
+
+    thread = threading.Thread(target=run, name="cache-warmup", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,296 @@
+# benchmark_scaling.py
+# Shows how the pipeline scales with the size of the knowledge base. The
+# bundled knowledge base has 16 documents; this script generates synthetic
+# markdown corpora of any size (named `NN_NN-Topic-Name.md` like the real one,
+# so topic titles and parent-topic grouping behave the same) and benchmarks
+# every stage on them with the local stand-in embeddings, so no API key is
+# needed and no quota is spent:
+#
+#   ingestion            load, split, embed and index the corpus
+#   startup              load the FAISS index, docstore and document embeddings
+#   docstore memory      Python heap taken by the unpickled parent docstore
+#   search               retriever latency, and retrieval score on generated queries
+#   recommendations      scoring a batch of user profiles against every topic
+#
+# Usage:
+#   python benchmark_scaling.py generate --docs 10000 --out corpora/10k
+#   python benchmark_scaling.py run --sizes 100 1000 10000 [--plot scaling.png]
+
+import os
+import json
+import time
+import random
+import argparse
+import multiprocessing
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, List
+
+import numpy as np
+import pandas as pd
+
+from app import config
+
+# --- CONFIGURATION ---
+BENCHMARK_DIR = os.path.join(config.CACHE_DIR, "scaling_benchmark")
+BENCHMARK_RESULTS_PATH = "scaling_benchmark_results.json"
+QUERIES_FILENAME = "queries.json"
+# Every metric that gets its own scaling curve, with its axis label.
+PLOTTED_METRICS = {
+    "ingest_seconds": "Ingestion (s)",
+    "startup_seconds": "Startup (s)",
+    "docstore_memory_mb": "Docstore memory (MB)",
+    "index_size_mb": "Index size on disk (MB)",
+    "search_latency_p50_ms": "Search latency p50 (ms)",
+    "recommendation_ms_per_user": "Recommendations (ms/user)",
+}
+
+TITLE_WORDS = [
+    "Vector", "Index", "Cache", "Query", "Embedding", "Retriever", "Chunk", "Prompt", "Model", "Pipeline",
+    "Stream", "Shard", "Profile", "Token", "Latency", "Router", "Schema", "Session", "Worker", "Ranking",
+]
+COMMON_WORDS = [
+    "the", "system", "uses", "a", "to", "for", "each", "when", "this", "data", "request", "with",
+    "and", "is", "in", "of", "its", "then", "every", "user",
+]
+
+# ==============================================================================
+# --- 1. CORPUS GENERATION ---
+# ==============================================================================
+def _pseudo_words(count: int, rng: random.Random) -> List[str]:
+    """Pronounceable made-up terms, so topics have vocabularies that don't overlap by accident."""
+    syllables = ["ka", "lo", "mi", "ter", "vex", "su", "dra", "pol", "zen", "ri", "qua", "nor", "bel", "fi", "tan", "osh"]
+    words = set()
+    while len(words) < count:
+        words.add("".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+def topic_name(index: int, rng: random.Random) -> str:
+    """`NN_NN-Title-Words`, with a part number once the two-digit prefixes run out."""
+    group, section, cycle = index % 100, (index // 100) % 100, index // 10000
+    name = f"{group:02d}_{section:02d}-{'-'.join(rng.sample(TITLE_WORDS, 2))}"
+    return f"{name}-Part-{cycle + 1}" if cycle else name
+
+def generate_corpus(out_dir: str, num_docs: int, sections: int = 4, paragraphs: int = 2, sentences: int = 4,
+                    num_queries: int = 200, seed: int = 0) -> Dict[str, Any]:
+    """
+    Writes `num_docs` markdown documents, sharded into one subdirectory per
+    two-digit group, plus a query set whose expected source is the document
+    each query was drawn from.
+    """
+    rng = random.Random(seed)
+    vocabulary = _pseudo_words(5000, rng)
+    os.makedirs(out_dir, exist_ok=True)
+
+    queries = []
+    query_docs = set(rng.sample(range(num_docs), min(num_queries, num_docs)))
+    for i in range(num_docs):
+        topic = topic_name(i, rng)
+        # Mostly topic-specific terms, so a query built from them has a clear right answer.
+        topic_terms = rng.sample(vocabulary, 25)
+        lines = [f"# {topic.split('-', 1)[1].replace('-', ' ')}", ""]
+        for s in range(sections):
+            lines += [f"## Section {s + 1}", ""]
+            for _ in range(paragraphs):
+                paragraph = []
+                for _ in range(sentences):
+                    words = [rng.choice(topic_terms) if rng.random() < 0.6 else rng.choice(COMMON_WORDS)
+                             for _ in range(rng.randint(8, 16))]
+                    paragraph.append(" ".join(words).capitalize() + ".")
+                lines += [" ".join(paragraph), ""]
+        group_dir = os.path.join(out_dir, topic[:2])
+        os.makedirs(group_dir, exist_ok=True)
+        with open(os.path.join(group_dir, f"{topic}.md"), 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines))
+        if i in query_docs:
+            queries.append({"question": f"How does {' '.join(rng.sample(topic_terms, 4))} work?", "expected_sources": [topic]})
+
+    with open(os.path.join(out_dir, QUERIES_FILENAME), 'w', encoding='utf-8') as f:
+        json.dump(queries, f, indent=4)
+    return {"documents": num_docs, "queries": len(queries)}
+
+# ==============================================================================
+# --- 2. BENCHMARK ---
+# ==============================================================================
+def _size_mb(*paths: str) -> float:
+    total = 0
+    for path in paths:
+        if os.path.isdir(path):
+            total += sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+        elif os.path.exists(path):
+            total += os.path.getsize(path)
+    return round(total / 1e6, 2)
+
+def benchmark_corpus(corpus_dir: str, cache_dir: str, num_users: int = 100) -> Dict[str, Any]:
+    """
+    Builds an index over `corpus_dir` with the stand-in embeddings and times each
+    stage. Runs in a fresh process, since it rewrites the config module.
+    """
+    config.MODEL_BACKEND = "stand-in"
+    config.KNOWLEDGE_BASE_PATH = corpus_dir
+    config.use_cache_dir(cache_dir, share_embedding_cache=False)
+    # Imported only now: the pipeline creates its build lock from the config on import.
+    from app import rag_pipeline, recommender, utils
+
+    embeddings, _ = rag_pipeline._create_models()
+    started = time.perf_counter()
+    manifest = rag_pipeline.build_artifacts(embeddings, force=True)
+    ingest_seconds = time.perf_counter() - started
+
+    # Startup: the same loads a serving worker performs.
+    started = time.perf_counter()
+    vectorstore = rag_pipeline._load_vectorstore(embeddings)
+    index_load_seconds = time.perf_counter() - started
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    store = rag_pipeline._load_docstore()
+    docstore_seconds = time.perf_counter() - started
+    docstore_memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    doc_matrix, topic_ids, _ = rag_pipeline._load_doc_embeddings(store)
+    doc_embeddings_seconds = time.perf_counter() - started
+
+    # Search, with the queries embedded up front so only the search is timed.
+    retriever = rag_pipeline._make_retriever(vectorstore, store)
+    with open(os.path.join(corpus_dir, QUERIES_FILENAME), 'r', encoding='utf-8') as f:
+        queries = json.load(f)
+    embeddings.embed_queries([query["question"] for query in queries])
+    latencies_ms, retrieval_scores = [], []
+    for query in queries:
+        started = time.perf_counter()
+        docs = retriever.invoke(query["question"])
+        latencies_ms.append((time.perf_counter() - started) * 1000)
+        retrieved = {utils.normalize_topic(doc.metadata.get('topic', '')) for doc in docs}
+        retrieval_scores.append(float(utils.normalize_topic(query["expected_sources"][0]) in retrieved))
+
+    # Recommendations for a batch of synthetic users, each interested in a few random topics.
+    rng = np.random.default_rng(0)
+    profiles = []
+    for _ in range(num_users):
+        rows = rng.choice(len(topic_ids), size=min(3, len(topic_ids)), replace=False)
+        profiles.append({"profile_vector": np.asarray(doc_matrix[rows]).mean(axis=0).tolist(),
+                         "inferred_interests": [topic_ids[row] for row in rows]})
+    started = time.perf_counter()
+    recommender.recommend_for_profiles(profiles, doc_matrix, topic_ids)
+    recommendation_seconds = time.perf_counter() - started
+
+    return {
+        "documents": manifest["topics"],
+        "parent_documents": manifest["parent_documents"],
+        "child_vectors": vectorstore.index.ntotal,
+        "ingest_seconds": round(ingest_seconds, 2),
+        "startup_seconds": round(index_load_seconds + docstore_seconds + doc_embeddings_seconds, 3),
+        "index_load_seconds": round(index_load_seconds, 3),
+        "docstore_load_seconds": round(docstore_seconds, 3),
+        "doc_embeddings_load_seconds": round(doc_embeddings_seconds, 3),
+        "docstore_memory_mb": round(docstore_memory / 1e6, 2),
+        "index_size_mb": _size_mb(config.VECTORSTORE_PATH, config.DOCSTORE_PATH, config.DOC_EMBEDDINGS_PATH),
+        "search_latency_p50_ms": round(float(np.percentile(latencies_ms, 50)), 2),
+        "search_latency_p95_ms": round(float(np.percentile(latencies_ms, 95)), 2),
+        "retrieval_score": round(float(np.mean(retrieval_scores)), 4),
+        "recommendation_users": num_users,
+        "recommendation_ms_per_user": round(recommendation_seconds * 1000 / num_users, 3),
+    }
+
+def plot_results(results: List[Dict[str, Any]], path: str):
+    """Draws one log-log scaling curve per metric. Needs matplotlib, which is optional."""
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("⚠️  matplotlib is not installed; skipping the plot (pip install matplotlib).")
+        return
+
+    results = [result for result in results if "error" not in result]
+    if not results:
+        print("⚠️  No size finished; nothing to plot.")
+        return
+    sizes = [result["documents"] for result in results]
+    fig, axes = plt.subplots(2, 3, figsize=(15, 8))
+    for ax, (metric, label) in zip(axes.flat, PLOTTED_METRICS.items()):
+        ax.plot(sizes, [result[metric] for result in results], marker="o")
+        ax.set_xscale("log")
+        ax.set_yscale("log")
+        ax.set_xlabel("Documents")
+        ax.set_title(label)
+        ax.grid(True, which="both", alpha=0.3)
+    fig.tight_layout()
+    fig.savefig(path)
+    print(f"✅ Scaling curves saved to '{path}'.")
+
+# ==============================================================================
+# --- 3. COMMAND LINE ---
+# ==============================================================================
+def _add_corpus_args(parser):
+    parser.add_argument("--sections", type=int, default=4, help="Sections per document.")
+    parser.add_argument("--paragraphs", type=int, default=2, help="Paragraphs per section.")
+    parser.add_argument("--sentences", type=int, default=4, help="Sentences per paragraph.")
+    parser.add_argument("--queries", type=int, default=200, help="Generated evaluation queries.")
+    parser.add_argument("--seed", type=int, default=0)
+
+def _generate(args, num_docs: int, out_dir: str):
+    started = time.perf_counter()
+    summary = generate_corpus(out_dir, num_docs, args.sections, args.paragraphs, args.sentences, args.queries, args.seed)
+    print(f"✅ Generated {summary['documents']} documents and {summary['queries']} queries in '{out_dir}' "
+          f"({time.perf_counter() - started:.1f}s).")
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic knowledge bases and benchmark how the pipeline scales.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    generate_parser = subparsers.add_parser("generate", help="Write a synthetic markdown corpus.")
+    generate_parser.add_argument("--docs", type=int, required=True)
+    generate_parser.add_argument("--out", required=True)
+    _add_corpus_args(generate_parser)
+
+    run_parser = subparsers.add_parser("run", help="Benchmark the pipeline on corpora of increasing size.")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    run_parser.add_argument("--work-dir", default=BENCHMARK_DIR, help="Where corpora and indexes are kept (corpora are reused).")
+    run_parser.add_argument("--users", type=int, default=100, help="Profiles scored in the recommendation benchmark.")
+    run_parser.add_argument("--output", default=BENCHMARK_RESULTS_PATH)
+    run_parser.add_argument("--plot", help="Save scaling curves to this image (needs matplotlib).")
+    _add_corpus_args(run_parser)
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        _generate(args, args.docs, args.out)
+        return
+
+    results = []
+    # One size at a time, each in a fresh interpreter, so runs don't share caches or compete for the CPU.
+    context = multiprocessing.get_context("spawn")
+    for size in sorted(args.sizes):
+        corpus_dir = os.path.join(args.work_dir, f"corpus-{size}")
+        if not os.path.exists(os.path.join(corpus_dir, QUERIES_FILENAME)):
+            _generate(args, size, corpus_dir)
+        print(f"--- Benchmarking {size} documents ---")
+        try:
+            # A pool per size, so a worker killed by one size (e.g. out of memory) doesn't break the next.
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                result = executor.submit(benchmark_corpus, corpus_dir, os.path.join(args.work_dir, f"index-{size}"), args.users).result()
+        except Exception as e:
+            # Keep going: the sizes that did finish still make a scaling curve.
+            print(f"❌ {size} documents failed: {type(e).__name__}: {e}")
+            results.append({"documents": size, "error": f"{type(e).__name__}: {e}"})
+            continue
+        results.append(result)
+        print(f"✅ {size} documents: ingestion {result['ingest_seconds']}s, startup {result['startup_seconds']}s, "
+              f"search p50 {result['search_latency_p50_ms']} ms")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=4)
+    print("\n" + "="*50 + "\n--- SCALING BENCHMARK RESULTS ---\n" + "="*50)
+    print(pd.DataFrame(results).set_index("documents").T.to_string())
+    failed = [result["documents"] for result in results if "error" in result]
+    if failed:
+        print(f"\n⚠️  Failed sizes: {failed} (see the 'error' entries in the results).")
+    print(f"\nResults saved to '{args.output}'.")
+    if args.plot:
+        plot_results(results, args.plot)
+
+if __name__ == "__main__":
+    main()
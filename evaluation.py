@@ -2,53 +2,98 @@
 
 import os
 import json
+import time
+import asyncio
+import argparse
 import requests
+import numpy as np
 import pandas as pd
+from datetime import datetime, timezone
 from typing import List, Dict, Any
 from app import utils
+from app.client import BackendClient, AsyncBackendClient
 
 # --- CONFIGURATION ---
-BASE_URL = "http://127.0.0.1:5000"
 QA_DATASET_PATH = os.path.join("app", "data", "evaluation", "qa_dataset.json")
 USER_PROFILES_PATH = os.path.join("app", "data", "evaluation", "evaluation_user_profiles.json")
 BACKEND_USER_PROFILES_PATH = os.path.join("app", "data", "user_profiles.json")
 EVALUATION_RESULTS_PATH = "evaluation_results.json"
+EVALUATION_HISTORY_DIR = "evaluation_history"
+EVALUATION_BASELINE_PATH = "evaluation_baseline.json"
+# Exit code used when the run regresses against the baseline (1 is reserved for setup failures).
+REGRESSION_EXIT_CODE = 2
+# History questions sent per batch request when their retrieved sources aren't known yet.
+RECOMMENDATION_BATCH_SIZE = 100
 
-def check_server_status():
-    """Checks if the backend server is running before starting the evaluation."""
-    try:
-        response = requests.post(BASE_URL + "/api/query", json={}, timeout=3)
-        if response.status_code == 400:
-             print("OK: Backend server is running.")
-             return True
-        return False
-    except requests.exceptions.RequestException:
-        print("\n CRITICAL: Backend server is not running!")
-        print("Please run `python app/main.py` in a separate terminal before starting the evaluation.")
-        return False
-
-def evaluate_rag_system(dataset: List[Dict[str, Any]]) -> pd.DataFrame:
+def check_server_status(client: BackendClient, max_wait_seconds: int = 300) -> bool:
+    """Waits for the backend to report ready, distinguishing "booting" from "broken"."""
+    deadline = time.time() + max_wait_seconds
+    last_stage_report = None
+    while True:
+        try:
+            report = client.health(timeout=3)
+        except (requests.exceptions.RequestException, ValueError):
+            print("\n CRITICAL: Backend server is not running!")
+            print("Please run `python -m flask --app app/main run` in a separate terminal before starting the evaluation.")
+            return False
+
+        if report.get("status") == "ready":
+            print(f"OK: Backend server is ready (startup took {report.get('elapsed_ms')} ms).")
+            return True
+        if report.get("status") == "failed":
+            failed = {name: info.get("error") for name, info in report.get("stages", {}).items() if info.get("state") == "failed"}
+            print(f"\n CRITICAL: Backend pipeline initialization failed: {failed}")
+            return False
+
+        stage_report = ", ".join(f"{name}={info.get('state')}" for name, info in report.get("stages", {}).items())
+        if stage_report != last_stage_report:
+            print(f"  Backend is initializing... ({stage_report})")
+            last_stage_report = stage_report
+        if time.time() > deadline:
+            print(f"\n CRITICAL: Backend did not become ready within {max_wait_seconds} seconds.")
+            return False
+        time.sleep(2)
+
+async def _fetch_rag_answers(client: BackendClient, dataset: List[Dict[str, Any]], concurrency: int) -> List[Any]:
+    """Sends every evaluation question to the backend, at most `concurrency` at a time."""
+    async_client = AsyncBackendClient(client, max_concurrency=concurrency)
+    # Queue here rather than inside the client, so latency only covers the request itself.
+    slots = asyncio.Semaphore(concurrency)
+
+    async def ask(i, item):
+        async with slots:
+            started = time.perf_counter()
+            try:
+                # Cached answers would hide the latency, tokens and cost being tracked.
+                data = await async_client.query(item['question'], "evaluation_service", no_cache=True, timeout=(3, 30))
+            except requests.exceptions.RequestException as e:
+                data = e
+            latency_ms = (time.perf_counter() - started) * 1000
+        print(f"  Tested Q{i+1}/{len(dataset)}: \"{item['question'][:50]}...\" ({latency_ms:.0f} ms)")
+        return data, latency_ms
+
+    return await asyncio.gather(*(ask(i, item) for i, item in enumerate(dataset)))
+
+def evaluate_rag_system(client: BackendClient, dataset: List[Dict[str, Any]], concurrency: int = 1) -> pd.DataFrame:
     """Evaluates the RAG system's question-answering capabilities."""
     results = []
     print("\n--- Starting RAG System Evaluation ---")
+    responses = asyncio.run(_fetch_rag_answers(client, dataset, concurrency))
 
-    for i, item in enumerate(dataset):
+    for item, (data, latency_ms) in zip(dataset, responses):
         question = item['question']
         ideal_keywords = set(kw.lower() for kw in item['ideal_answer_keywords'])
         # +++ THE FIX: Call the function from the utils module +++
         expected_sources = {utils.normalize_topic(s) for s in item['expected_sources']}
-        
-        print(f"  Testing Q{i+1}/{len(dataset)}: \"{question[:50]}...\"")
-        
-        try:
-            response = requests.post(
-                f"{BASE_URL}/api/query",
-                json={"query": question, "user_id": "evaluation_service", "chat_history": []},
-                timeout=30
-            )
-            response.raise_for_status()
-            data = response.json()
-            
+
+        usage = {}
+        if isinstance(data, Exception):
+            print(f"    ERROR calling API for question \"{question[:50]}...\": {data}")
+            generated_answer, retrieved_sources = "[API Error]", set()
+            answer_score, retrieval_score = 0, 0
+            latency_ms = None
+        else:
+            usage = data.get("usage", {})
             generated_answer = data.get("answer", "").lower()
             retrieved_sources_raw = data.get("sources", [])
             # +++ THE FIX: Call the function from the utils module +++
@@ -58,28 +103,55 @@ def evaluate_rag_system(dataset: List[Dict[str, Any]]) -> pd.DataFrame:
             answer_score = len(matched_keywords) / len(ideal_keywords) if ideal_keywords else 0
 
             retrieval_score = len(retrieved_sources.intersection(expected_sources)) / len(expected_sources) if expected_sources else 0
-            
-        except requests.exceptions.RequestException as e:
-            print(f"    ERROR calling API for question: {e}")
-            generated_answer, retrieved_sources = "[API Error]", set()
-            answer_score, retrieval_score = 0, 0
 
         results.append({
             "Question": question, "Answer Score": answer_score, "Retrieval Score": retrieval_score,
-            "Retrieved Sources": ", ".join(sorted(list(retrieved_sources))) or "None"
+            "Retrieved Sources": ", ".join(sorted(list(retrieved_sources))) or "None",
+            "Latency (ms)": latency_ms, "Server Latency (ms)": usage.get("latency_ms"),
+            "Input Tokens": usage.get("input_tokens"), "Output Tokens": usage.get("output_tokens"),
+            "Total Tokens": usage.get("total_tokens"), "Cost": usage.get("cost")
         })
     
     print("--- RAG System Evaluation Complete ---")
     return pd.DataFrame(results)
 
-def evaluate_recommendation_system(user_profiles: List[Dict], qa_dataset: List[Dict]) -> Dict[str, Any]:
-    """Evaluates the recommendation system using hold-one-out cross-validation."""
+def _fetch_retrieved_sources(client: BackendClient, questions: List[str]) -> Dict[str, List[str]]:
+    """Sources the backend returns for history-free questions, fetched through the batch endpoint."""
+    retrieved = {}
+    for start in range(0, len(questions), RECOMMENDATION_BATCH_SIZE):
+        chunk = questions[start:start + RECOMMENDATION_BATCH_SIZE]
+        try:
+            results = client.query_batch(chunk, user_id="evaluation_recommendations", timeout=(3, 300))["results"]
+        except requests.exceptions.RequestException as e:
+            print(f"    ERROR fetching sources for {len(chunk)} history questions: {e}")
+            continue
+        for result in results:
+            if "error" not in result:
+                retrieved[result["question"]] = result["sources"]
+    return retrieved
+
+def evaluate_recommendation_system(client: BackendClient, user_profiles: List[Dict], qa_dataset: List[Dict],
+                                   retrieved_sources: Dict[str, List[str]] = None) -> Dict[str, Any]:
+    """
+    Evaluates the recommendation system using hold-one-out cross-validation.
+    Each user's history is replayed through the profile-only endpoint with the
+    topics the backend retrieved for each question, as /api/query would have
+    folded them in, so hit rates stay comparable with earlier runs.
+    `retrieved_sources` (question -> sources, e.g. from the RAG run) avoids
+    asking again; other history questions go through the batch endpoint.
+    Unanswered questions (no sources) leave the profile untouched.
+    """
     print("\n--- Starting Recommendation System Evaluation ---")
 
     query_to_topic_map = {
-        item['question']: utils.normalize_topic(item['expected_sources'][0]) 
+        item['question']: utils.normalize_topic(item['expected_sources'][0])
         for item in qa_dataset if item.get('expected_sources')
     }
+    retrieved_sources = dict(retrieved_sources or {})
+    history_questions = {query for user in user_profiles for query in user['query_history'][:-1]}
+    missing = sorted(history_questions - set(retrieved_sources))
+    if missing:
+        retrieved_sources.update(_fetch_retrieved_sources(client, missing))
     total_prediction_steps, successful_hits = 0, 0
 
     for user in user_profiles:
@@ -89,40 +161,102 @@ def evaluate_recommendation_system(user_profiles: List[Dict], qa_dataset: List[D
 
         if len(query_history) < 2: continue
 
-        for i in range(len(query_history) - 1):
-            current_query = query_history[i]
-            next_query = query_history[i+1]
-            ground_truth_topic = query_to_topic_map.get(next_query)
-            if not ground_truth_topic: continue
+        replay, replay_step = [], []
+        for query in query_history[:-1]:
+            topics = [topic for topic in retrieved_sources.get(query, []) if topic and topic != "None"]
+            if topics:
+                replay.append({"query": query, "topics": topics})
+            # The replay step whose recommendations follow this query, if any query was folded in yet.
+            replay_step.append(len(replay) - 1 if replay else None)
 
-            total_prediction_steps += 1
+        steps = []
+        if replay:
             try:
-                requests.post(
-                    f"{BASE_URL}/api/query",
-                    json={"query": current_query, "user_id": user_id, "chat_history": []},
-                    timeout=30
-                )
-                
-                rec_response = requests.post(f"{BASE_URL}/api/recommendations", json={"user_id": user_id}, timeout=10)
-                rec_response.raise_for_status()
-                recommendations = rec_response.json().get("recommendations", [])
-                
-              
-                recommended_topics = {utils.normalize_topic(rec['topic_id']) for rec in recommendations}
-
-                if ground_truth_topic in recommended_topics:
-                    successful_hits += 1
-
+                # `reset` replays from an empty profile, so results don't depend on earlier runs.
+                steps = client.replay_profile(user_id, replay, reset=True, include_recommendations=True, timeout=(3, 60))["steps"]
             except requests.exceptions.RequestException as e:
-                print(f"    ERROR during recommendation step for user {user_id}: {e}")
+                print(f"    ERROR during recommendation replay for user {user_id}: {e}")
+                steps = [{"recommendations": []} for _ in replay]
+
+        for i, step_index in enumerate(replay_step):
+            ground_truth_topic = query_to_topic_map.get(query_history[i+1])
+            if not ground_truth_topic: continue
+
+            total_prediction_steps += 1
+            recommendations = steps[step_index]["recommendations"] if step_index is not None else []
+            recommended_topics = {utils.normalize_topic(rec['topic_id']) for rec in recommendations}
+            if ground_truth_topic in recommended_topics:
+                successful_hits += 1
 
     hit_rate = (successful_hits / total_prediction_steps) if total_prediction_steps > 0 else 0
     print("--- Recommendation System Evaluation Complete ---")
     return {"hit_rate": hit_rate, "users_tested": len(user_profiles), "prediction_steps": total_prediction_steps}
 
 
+def _percentiles(values: pd.Series) -> Dict[str, Any]:
+    values = pd.to_numeric(values, errors='coerce').dropna()
+    if values.empty:
+        return {"p50": None, "p90": None, "p95": None, "p99": None, "mean": None}
+    p50, p90, p95, p99 = np.percentile(values, [50, 90, 95, 99])
+    return {"p50": float(p50), "p90": float(p90), "p95": float(p95), "p99": float(p99), "mean": float(values.mean())}
+
+def summarize_performance(rag_results_df: pd.DataFrame) -> Dict[str, Any]:
+    """Summarizes per-question latency, token usage and cost of a run."""
+    total_tokens = pd.to_numeric(rag_results_df['Total Tokens'], errors='coerce')
+    costs = pd.to_numeric(rag_results_df['Cost'], errors='coerce')
+    return {
+        "latency_ms": _percentiles(rag_results_df['Latency (ms)']),
+        "server_latency_ms": _percentiles(rag_results_df['Server Latency (ms)']),
+        "avg_total_tokens": float(total_tokens.mean()) if total_tokens.notna().any() else None,
+        "total_tokens": int(total_tokens.sum()),
+        "avg_cost": float(costs.mean()) if costs.notna().any() else None,
+        "total_cost": float(costs.sum()),
+        "errors": int(rag_results_df['Latency (ms)'].isna().sum()),
+    }
+
+def compare_to_baseline(report: Dict[str, Any], baseline: Dict[str, Any], args) -> List[str]:
+    """Returns a description of every metric that regressed beyond its tolerance."""
+    regressions = []
+
+    quality_metrics = [
+        ("RAG answer score", report['rag_summary']['avg_answer_score'], baseline['rag_summary']['avg_answer_score']),
+        ("RAG retrieval score", report['rag_summary']['avg_retrieval_score'], baseline['rag_summary']['avg_retrieval_score']),
+        ("Recommendation hit rate", report['rec_summary']['hit_rate'], baseline['rec_summary']['hit_rate']),
+    ]
+    for name, current, reference in quality_metrics:
+        if current is not None and reference is not None and current < reference - args.max_quality_drop:
+            regressions.append(f"{name} dropped from {reference:.1%} to {current:.1%} (tolerance {args.max_quality_drop:.1%}).")
+
+    current_perf, baseline_perf = report['performance_summary'], baseline.get('performance_summary')
+    if not baseline_perf:
+        return regressions
+    if report['run']['concurrency'] != baseline.get('run', {}).get('concurrency'):
+        print("WARNING: Baseline was recorded with a different --concurrency; latency comparisons may be skewed.")
+    performance_metrics = [
+        ("p50 latency (ms)", current_perf['latency_ms']['p50'], baseline_perf['latency_ms']['p50'], args.max_latency_increase),
+        ("p95 latency (ms)", current_perf['latency_ms']['p95'], baseline_perf['latency_ms']['p95'], args.max_latency_increase),
+        ("Avg. tokens per question", current_perf['avg_total_tokens'], baseline_perf['avg_total_tokens'], args.max_token_increase),
+        ("Total cost (USD)", current_perf['total_cost'], baseline_perf['total_cost'], args.max_cost_increase),
+    ]
+    for name, current, reference, tolerance in performance_metrics:
+        if current is not None and reference and current > reference * (1 + tolerance):
+            regressions.append(f"{name} rose from {reference:.4g} to {current:.4g} (+{current / reference - 1:.0%}, tolerance +{tolerance:.0%}).")
+    return regressions
+
+
 if __name__ == "__main__":
-    if not check_server_status():
+    parser = argparse.ArgumentParser(description="Evaluate the RAG and recommendation systems against the running backend.")
+    parser.add_argument("--concurrency", type=int, default=1, help="Number of RAG evaluation questions sent concurrently.")
+    parser.add_argument("--baseline", default=EVALUATION_BASELINE_PATH, help="Baseline run to compare against.")
+    parser.add_argument("--update-baseline", action="store_true", help="Store this run as the new baseline instead of comparing against it.")
+    parser.add_argument("--max-quality-drop", type=float, default=0.05, help="Allowed absolute drop in answer/retrieval scores and hit rate.")
+    parser.add_argument("--max-latency-increase", type=float, default=0.25, help="Allowed relative increase in p50/p95 latency.")
+    parser.add_argument("--max-token-increase", type=float, default=0.10, help="Allowed relative increase in average tokens per question.")
+    parser.add_argument("--max-cost-increase", type=float, default=0.10, help="Allowed relative increase in total cost.")
+    args = parser.parse_args()
+
+    client = BackendClient()
+    if not check_server_status(client):
         exit(1)
 
     if os.path.exists(BACKEND_USER_PROFILES_PATH):
@@ -136,13 +270,18 @@ if __name__ == "__main__":
         print(f"\n CRITICAL: Could not find a required data file: {e.filename}")
         exit(1)
 
-    rag_results_df = evaluate_rag_system(qa_dataset)
-    rec_results = evaluate_recommendation_system(user_profiles_data, qa_dataset)
+    rag_results_df = evaluate_rag_system(client, qa_dataset, concurrency=args.concurrency)
+    # Questions the RAG run answered already have their retrieved sources ("None" when unanswered).
+    answered = rag_results_df[rag_results_df['Latency (ms)'].notna()]
+    rag_sources = {row['Question']: row['Retrieved Sources'].split(", ") for _, row in answered.iterrows()}
+    rec_results = evaluate_recommendation_system(client, user_profiles_data, qa_dataset, retrieved_sources=rag_sources)
     
     avg_answer_score = rag_results_df['Answer Score'].mean()
     avg_retrieval_score = rag_results_df['Retrieval Score'].mean()
 
+    run_timestamp = datetime.now(timezone.utc)
     final_report = {
+        "run": {"timestamp": run_timestamp.isoformat(), "concurrency": args.concurrency},
         "rag_summary": {
             "total_questions": len(rag_results_df),
             "avg_answer_score": avg_answer_score,
@@ -153,12 +292,31 @@ if __name__ == "__main__":
             "prediction_steps": rec_results['prediction_steps'],
             "hit_rate": rec_results['hit_rate']
         },
-        "rag_details": rag_results_df.to_dict(orient='records')
+        "performance_summary": summarize_performance(rag_results_df),
+        "rag_details": rag_results_df.replace({np.nan: None}).to_dict(orient='records')
     }
-    
-    with open(EVALUATION_RESULTS_PATH, 'w') as f:
-        json.dump(final_report, f, indent=4)
-    print(f"\nOK: Evaluation results saved to '{EVALUATION_RESULTS_PATH}'")
+
+    # Compare against the stored baseline before saving, so the verdict is part of the record.
+    regressions = []
+    if args.update_baseline:
+        final_report["baseline_comparison"] = {"baseline": None, "regressions": []}
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f: baseline_report = json.load(f)
+        regressions = compare_to_baseline(final_report, baseline_report, args)
+        final_report["baseline_comparison"] = {"baseline": baseline_report.get("run", {}).get("timestamp"), "regressions": regressions}
+    else:
+        print(f"\nNOTE: No baseline found at '{args.baseline}'. Run with --update-baseline to create one.")
+
+    os.makedirs(EVALUATION_HISTORY_DIR, exist_ok=True)
+    history_path = os.path.join(EVALUATION_HISTORY_DIR, f"{run_timestamp.strftime('%Y%m%dT%H%M%SZ')}.json")
+    for path in (EVALUATION_RESULTS_PATH, history_path):
+        with open(path, 'w') as f:
+            json.dump(final_report, f, indent=4)
+    print(f"\nOK: Evaluation results saved to '{EVALUATION_RESULTS_PATH}' and '{history_path}'")
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(final_report, f, indent=4)
+        print(f"OK: Baseline updated at '{args.baseline}'")
 
     print("\n\n" + "="*38)
     print("=== AI SYSTEM EVALUATION REPORT ===")
@@ -171,8 +329,22 @@ if __name__ == "__main__":
     print(f"User Profiles Tested: {final_report['rec_summary']['users_tested']}")
     print(f"Total Prediction Steps: {final_report['rec_summary']['prediction_steps']}")
     print(f"Recommendation Hit Rate: {final_report['rec_summary']['hit_rate']:.1%}")
+    perf = final_report['performance_summary']
+    print("\n--- Latency, Tokens & Cost ---")
+    if perf['latency_ms']['p50'] is not None:
+        print(f"Latency p50 / p95 / p99 (ms): {perf['latency_ms']['p50']:.0f} / {perf['latency_ms']['p95']:.0f} / {perf['latency_ms']['p99']:.0f}")
+    if perf['avg_total_tokens'] is not None:
+        print(f"Average Tokens per Question: {perf['avg_total_tokens']:.0f}")
+    print(f"Total Cost (USD): ${perf['total_cost']:.4f}")
     print("\n--- Detailed RAG Results ---")
     pd.set_option('display.max_colwidth', 50)
     pd.set_option('display.width', 120)
-    print(rag_results_df.to_string(index=False, float_format="%.2f"))
+    detail_columns = ["Question", "Answer Score", "Retrieval Score", "Latency (ms)", "Total Tokens", "Retrieved Sources"]
+    print(rag_results_df[detail_columns].to_string(index=False, float_format="%.2f"))
     print("\n" + "="*38 + "\n         END OF REPORT\n" + "="*38)
+
+    if regressions:
+        print("\n REGRESSION: this run is worse than the baseline:")
+        for regression in regressions:
+            print(f"  - {regression}")
+        exit(REGRESSION_EXIT_CODE)
@@ -0,0 +1,27 @@
+# gunicorn.conf.py
+# Multi-worker deployment of the Flask backend:
+#   gunicorn -c gunicorn.conf.py "app.main:app"
+#
+# The serving artifacts are built once in a separate process before any worker
+# starts. Workers then run in shared-artifact mode: they memory-map the index
+# and embedding matrix read-only instead of building or re-embedding anything,
+# and profile/log writes are serialized across processes by `utils.file_lock`.
+# With RAG_ARTIFACT_BUNDLE set, that step installs the prebuilt bundle instead.
+
+import os
+import subprocess
+import sys
+
+os.environ.setdefault("RAG_SHARED_ARTIFACTS", "1")
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 2))
+# Workers refuse sharded search (RAG_SEARCH_SHARDS) when there is more than one of them.
+os.environ["RAG_SERVER_WORKERS"] = str(workers)
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+timeout = 120
+# Each worker loads the app itself; the Google SDK must not be initialized before fork().
+preload_app = False
+
+def on_starting(server):
+    subprocess.run([sys.executable, "-m", "app.build_artifacts"], check=True)
@@ -0,0 +1,255 @@
+# replay_logs.py
+# Re-issues the traffic recorded in query_logs.jsonl against a running backend,
+# for capacity tests with the real traffic shape instead of synthetic load:
+# - requests start at their original inter-arrival times, optionally sped up
+#   (`--speed 10` replays an hour of traffic in 6 minutes; `--speed 0` as fast
+#   as the backend allows);
+# - each user's requests are sent one after another in their original order,
+#   so user profiles evolve as they did;
+# - /api/query, /api/get_document and /api/query/batch entries are each
+#   replayed against their own endpoint;
+# - replayed latency and token usage are compared with the logged values.
+#
+# The log doesn't store chat histories. A follow-up (an entry with a `rewrite`
+# decision) is replayed with the user's previous logged turns as its history.
+#
+# Usage:
+#   python replay_logs.py --speed 10
+#   python replay_logs.py --log old_logs.jsonl --base-url http://staging:5000 --speed 0 --max-concurrency 32
+
+import re
+import json
+import time
+import asyncio
+import argparse
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional
+
+import requests
+import pandas as pd
+
+from app import config
+from app.client import BackendClient
+
+# --- CONFIGURATION ---
+REPLAY_RESULTS_PATH = "replay_results.json"
+# /api/get_document logs its request as this profile query, with the topic as the only source.
+GET_DOCUMENT_QUERY_PATTERN = re.compile(r"^Please explain more about '.+'$")
+
+def _read_log(log_path: str) -> List[Dict[str, Any]]:
+    entries, skipped = [], 0
+    with open(log_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                entry["_arrival"] = datetime.fromisoformat(entry["timestamp"]) - timedelta(milliseconds=entry.get("latency_ms") or 0)
+                entries.append(entry)
+            except (ValueError, KeyError, TypeError):
+                skipped += line.strip() != ""
+    if skipped:
+        print(f"⚠️  Skipped {skipped} malformed log lines.")
+    return entries
+
+def load_events(log_path: str, history_messages: int, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Turns log entries into requests to replay, ordered by arrival time (the log
+    timestamp minus the logged latency). Batch entries are regrouped into their
+    original batch request.
+    """
+    events, batches = [], defaultdict(list)
+    for entry in _read_log(log_path):
+        if "batch_index" in entry:
+            batches[entry["request_id"]].append(entry)
+            continue
+        sources = entry.get("sources") or []
+        logged = {key: entry.get(key) for key in ("latency_ms", "input_tokens", "output_tokens", "total_tokens")}
+        if GET_DOCUMENT_QUERY_PATTERN.match(entry.get("query", "")) and len(sources) == 1 and "rewrite" not in entry:
+            events.append({"kind": "get_document", "user_id": entry["user_id"], "arrival": entry["_arrival"],
+                           "topic": sources[0], "entry": entry, "logged": logged})
+        else:
+            events.append({"kind": "query", "user_id": entry["user_id"], "arrival": entry["_arrival"],
+                           "query": entry["query"], "entry": entry, "logged": logged})
+    for items in batches.values():
+        items.sort(key=lambda item: item["batch_index"])
+        events.append({
+            "kind": "batch", "user_id": items[0]["user_id"], "arrival": min(item["_arrival"] for item in items),
+            "questions": [item["query"] for item in items], "entry": items[0],
+            "logged": {"latency_ms": max(item.get("latency_ms") or 0 for item in items),
+                       **{key: sum(item.get(key) or 0 for item in items) for key in ("input_tokens", "output_tokens", "total_tokens")}},
+        })
+    events.sort(key=lambda event: event["arrival"])
+    events = events[:limit] if limit else events
+
+    # Rebuild the histories of follow-ups from each user's earlier logged turns.
+    turns = defaultdict(list)
+    for event in events:
+        if event["kind"] == "query" and event["entry"].get("rewrite") and history_messages:
+            event["chat_history"] = turns[event["user_id"]][-history_messages:]
+        if event["kind"] in ("query", "get_document"):
+            turns[event["user_id"]].extend([{"role": "user", "content": event["entry"]["query"]},
+                                            {"role": "assistant", "content": event["entry"].get("answer", "")}])
+    start = events[0]["arrival"] if events else None
+    for event in events:
+        event["offset_seconds"] = (event["arrival"] - start).total_seconds()
+    return events
+
+def _send(client: BackendClient, event: Dict[str, Any], user_id: str, timeout, no_cache: bool) -> Dict[str, Any]:
+    """Sends one event and returns the replayed token usage and server-side latency."""
+    if event["kind"] == "query":
+        data = client.query(event["query"], user_id, chat_history=event.get("chat_history"), no_cache=no_cache, timeout=timeout)
+        usage = data.get("usage", {})
+    elif event["kind"] == "get_document":
+        data = client.get_document(event["topic"], user_id, no_cache=no_cache, timeout=timeout)
+        usage = data.get("usage", {})
+    else:
+        data = client.query_batch(event["questions"], user_id, timeout=timeout)
+        usages = [result.get("usage", {}) for result in data.get("results", [])]
+        usage = {key: sum(u.get(key) or 0 for u in usages) for key in ("input_tokens", "output_tokens", "total_tokens")}
+        usage["latency_ms"] = max((u.get("latency_ms") or 0 for u in usages), default=None)
+    return {"server_latency_ms": usage.get("latency_ms"), "input_tokens": usage.get("input_tokens"),
+            "output_tokens": usage.get("output_tokens"), "total_tokens": usage.get("total_tokens"),
+            "degraded": data.get("degraded", [])}
+
+async def replay(client: BackendClient, events: List[Dict[str, Any]], speed: float, max_concurrency: int,
+                 user_prefix: str, timeout, no_cache: bool = True) -> List[Dict[str, Any]]:
+    """
+    Replays the events on schedule. Each user's events run in order, so a user
+    whose previous request is still running starts late; `lag_ms` records how
+    far behind schedule each request started.
+    """
+    slots = asyncio.Semaphore(max_concurrency)
+    by_user = defaultdict(list)
+    for event in events:
+        by_user[event["user_id"]].append(event)
+    results, started_at = [], time.perf_counter()
+
+    async def run_user(user_events):
+        for event in user_events:
+            scheduled = event["offset_seconds"] / speed if speed > 0 else 0.0
+            delay = scheduled - (time.perf_counter() - started_at)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            # Queue here rather than inside the client, so latency only covers the request itself.
+            async with slots:
+                sent = time.perf_counter()
+                record = {"kind": event["kind"], "user_id": event["user_id"], "logged_timestamp": event["entry"]["timestamp"],
+                          "lag_ms": round((sent - started_at - scheduled) * 1000) if speed > 0 else None,
+                          "logged_latency_ms": event["logged"]["latency_ms"], "logged_tokens": event["logged"]["total_tokens"],
+                          "error": None}
+                try:
+                    replayed = await asyncio.to_thread(_send, client, event, user_prefix + event["user_id"], timeout, no_cache)
+                except requests.exceptions.RequestException as e:
+                    status = getattr(getattr(e, "response", None), "status_code", None)
+                    replayed = {"error": f"HTTP {status}" if status else type(e).__name__}
+                record["latency_ms"] = round((time.perf_counter() - sent) * 1000)
+            record.update(replayed)
+            record["tokens"] = record.pop("total_tokens", None)
+            results.append(record)
+            done = len(results)
+            if done % 50 == 0 or done == len(events):
+                print(f"  Replayed {done}/{len(events)} requests ({time.perf_counter() - started_at:.1f} s).")
+
+    await asyncio.gather(*(run_user(user_events) for user_events in by_user.values()))
+    return results
+
+def summarize(results: List[Dict[str, Any]], events: List[Dict[str, Any]], wall_seconds: float) -> Dict[str, Any]:
+    """Per-endpoint comparison of replayed against logged latency and tokens."""
+    df = pd.DataFrame(results)
+    ok = df[df["error"].isna()]
+
+    def percentile(series, pct):
+        series = series.dropna()
+        return round(float(series.quantile(pct / 100)), 1) if len(series) else None
+
+    by_kind = {}
+    for kind, group in df.groupby("kind"):
+        ok_group = ok[ok["kind"] == kind]
+        paired = ok_group.dropna(subset=["logged_tokens", "tokens"])
+        by_kind[kind] = {
+            "requests": len(group), "errors": int(group["error"].notna().sum()),
+            "logged_latency_p50_ms": percentile(group["logged_latency_ms"], 50),
+            "replay_latency_p50_ms": percentile(ok_group["latency_ms"], 50),
+            "logged_latency_p95_ms": percentile(group["logged_latency_ms"], 95),
+            "replay_latency_p95_ms": percentile(ok_group["latency_ms"], 95),
+            "logged_tokens_avg": round(float(paired["logged_tokens"].mean()), 1) if len(paired) else None,
+            "replay_tokens_avg": round(float(paired["tokens"].mean()), 1) if len(paired) else None,
+            "token_change": round(float(paired["tokens"].sum() / paired["logged_tokens"].sum() - 1), 4)
+                            if len(paired) and paired["logged_tokens"].sum() else None,
+        }
+    logged_seconds = events[-1]["offset_seconds"] if events else 0
+    return {
+        "requests": len(df), "errors": int(df["error"].notna().sum()), "users": int(df["user_id"].nunique()),
+        "logged_span_seconds": round(logged_seconds, 1), "replay_wall_seconds": round(wall_seconds, 1),
+        "replay_requests_per_second": round(len(df) / wall_seconds, 2) if wall_seconds else None,
+        "lag_p95_ms": percentile(df["lag_ms"], 95) if "lag_ms" in df else None,
+        "by_endpoint": by_kind,
+    }
+
+def wait_for_backend(client: BackendClient, max_wait_seconds: int = 300) -> bool:
+    deadline = time.time() + max_wait_seconds
+    while time.time() < deadline:
+        try:
+            report = client.health(timeout=3)
+        except (requests.exceptions.RequestException, ValueError):
+            print(f"❌ Backend at {client.base_url} is not reachable.")
+            return False
+        if report.get("status") == "ready":
+            return True
+        if report.get("status") == "failed":
+            print(f"❌ Backend initialization failed: {report.get('stages')}")
+            return False
+        time.sleep(2)
+    print(f"❌ Backend did not become ready within {max_wait_seconds} seconds.")
+    return False
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay logged traffic against a backend and compare latency and token usage.")
+    parser.add_argument("--log", default=config.QUERY_LOGS_PATH, help="Query log to replay.")
+    parser.add_argument("--base-url", default=config.API_BASE_URL)
+    parser.add_argument("--speed", type=float, default=1.0, help="Timing multiplier: 10 replays 10x faster; 0 ignores the original timing.")
+    parser.add_argument("--max-concurrency", type=int, default=64, help="Requests in flight at once, across users.")
+    parser.add_argument("--limit", type=int, help="Replay only the first N requests.")
+    parser.add_argument("--user-prefix", default="replay-",
+                        help="Prefix for replayed user IDs, so real profiles aren't modified ('' replays as the original users).")
+    parser.add_argument("--history-messages", type=int, default=config.REWRITE_HISTORY_MESSAGES,
+                        help="Earlier logged messages sent as the chat history of follow-ups.")
+    parser.add_argument("--timeout", type=float, default=config.API_READ_TIMEOUT_SECONDS, help="Read timeout per request, in seconds.")
+    parser.add_argument("--use-cache", action="store_true",
+                        help="Let the backend serve cached answers and summaries (by default every request runs the full pipeline).")
+    parser.add_argument("--output", default=REPLAY_RESULTS_PATH)
+    args = parser.parse_args()
+
+    events = load_events(args.log, args.history_messages, args.limit)
+    if not events:
+        print(f"❌ No requests to replay in '{args.log}'.")
+        return
+    counts = pd.Series([event["kind"] for event in events]).value_counts().to_dict()
+    span = events[-1]["offset_seconds"]
+    print(f"--- Replaying {len(events)} requests from {len(set(e['user_id'] for e in events))} users {counts} ---")
+    print(f"Logged traffic spans {span:.0f} s; expected replay time "
+          f"{'as fast as possible' if args.speed <= 0 else f'~{span / args.speed:.0f} s'}.")
+
+    # No retries: a 503 or 429 under load is a result, not something to hide.
+    client = BackendClient(args.base_url, max_retries=0, pool_size=args.max_concurrency)
+    if not wait_for_backend(client):
+        return
+    started = time.perf_counter()
+    results = asyncio.run(replay(client, events, args.speed, args.max_concurrency, args.user_prefix,
+                                 (config.API_CONNECT_TIMEOUT_SECONDS, args.timeout), no_cache=not args.use_cache))
+    summary = summarize(results, events, time.perf_counter() - started)
+    client.close()
+
+    with open(args.output, 'w') as f:
+        json.dump({"settings": vars(args), "summary": summary, "requests": results}, f, indent=4)
+
+    print("\n" + "="*50 + "\n--- REPLAY RESULTS ---\n" + "="*50)
+    print(pd.DataFrame.from_dict(summary["by_endpoint"], orient="index").to_string())
+    print(f"\n{summary['requests']} requests ({summary['errors']} errors) in {summary['replay_wall_seconds']} s "
+          f"({summary['replay_requests_per_second']} req/s); logged span {summary['logged_span_seconds']} s.")
+    if summary["lag_p95_ms"] is not None:
+        print(f"p95 start lag behind schedule: {summary['lag_p95_ms']} ms.")
+    print(f"\nResults saved to '{args.output}'.")
+
+if __name__ == "__main__":
+    main()
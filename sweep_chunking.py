@@ -0,0 +1,167 @@
+# sweep_chunking.py
+# Builds an isolated index for every combination of chunking settings and runs
+# the qa_dataset.json retrieval evaluation against each one, so the chunk sizes
+# in app/config.py can be chosen on measured trade-offs.
+#
+# Every setting gets its own cache directory (reused on the next run if the
+# knowledge base hasn't changed) and is built in its own process. All of them
+# share the normal embedding cache, so texts that several settings have in
+# common (and every evaluation question) are embedded only once.
+#
+# Usage:
+#   python sweep_chunking.py --parent-sizes 1000 2000 3000 --child-sizes 200 400 --workers 3
+#   RAG_MODEL_BACKEND=stand-in python sweep_chunking.py   # offline dry run
+
+import os
+import json
+import time
+import argparse
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Any, List
+
+import numpy as np
+import pandas as pd
+
+from app import config
+
+# --- CONFIGURATION ---
+QA_DATASET_PATH = os.path.join("app", "data", "evaluation", "qa_dataset.json")
+SWEEP_DIR = os.path.join(config.CACHE_DIR, "chunking_sweep")
+SWEEP_RESULTS_PATH = "chunking_sweep_results.json"
+# Rough token estimate for the retrieved context, matching the ~4 characters per
+# token that Gemini averages on English text.
+CHARS_PER_TOKEN = 4
+
+def _setting_name(setting: Dict[str, int]) -> str:
+    return (f"p{setting['parent_chunk_size']}-{setting['parent_chunk_overlap']}"
+            f"_c{setting['child_chunk_size']}-{setting['child_chunk_overlap']}")
+
+def _index_size_bytes() -> int:
+    paths = [config.DOCSTORE_PATH] + [os.path.join(config.VECTORSTORE_PATH, name) for name in os.listdir(config.VECTORSTORE_PATH)]
+    return sum(os.path.getsize(path) for path in paths)
+
+def evaluate_setting(setting: Dict[str, int], sweep_dir: str, qa_dataset: List[Dict[str, Any]], force: bool = False) -> Dict[str, Any]:
+    """
+    Builds (or reuses) the index for one chunking setting and scores retrieval on
+    the QA dataset. Runs in a fresh process, since it rewrites the config module.
+    """
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    cache_dir = os.path.join(sweep_dir, _setting_name(setting))
+    config.use_cache_dir(cache_dir)
+    config.PARENT_CHUNK_SIZE = setting["parent_chunk_size"]
+    config.PARENT_CHUNK_OVERLAP = setting["parent_chunk_overlap"]
+    config.CHILD_CHUNK_SIZE = setting["child_chunk_size"]
+    config.CHILD_CHUNK_OVERLAP = setting["child_chunk_overlap"]
+    # Imported only now: the pipeline creates its build lock from the config on import.
+    from app import rag_pipeline, utils
+
+    embeddings, _ = rag_pipeline._create_models()
+    build_started = time.perf_counter()
+    manifest = rag_pipeline.build_artifacts(embeddings, force=force)
+    build_seconds = time.perf_counter() - build_started
+    build_model_calls = embeddings.stats()["model_calls"]
+
+    vectorstore = rag_pipeline._load_vectorstore(embeddings)
+    store = rag_pipeline._load_docstore()
+    retriever = rag_pipeline._make_retriever(vectorstore, store)
+
+    # Embed the questions up front, so the latencies below measure the search itself.
+    questions = [item["question"] for item in qa_dataset]
+    embeddings.embed_queries(questions)
+
+    retrieval_scores, latencies_ms, context_tokens = [], [], []
+    for item in qa_dataset:
+        started = time.perf_counter()
+        docs = retriever.invoke(item["question"])
+        latencies_ms.append((time.perf_counter() - started) * 1000)
+
+        # Scored exactly like evaluation.py scores the sources of an answer.
+        retrieved_sources = {utils.normalize_topic(doc.metadata.get('topic', '')) for doc in docs}
+        expected_sources = {utils.normalize_topic(s) for s in item.get("expected_sources", [])}
+        retrieval_scores.append(len(retrieved_sources & expected_sources) / len(expected_sources) if expected_sources else 0)
+        context_tokens.append(sum(len(doc.page_content) for doc in docs) / CHARS_PER_TOKEN)
+
+    return {
+        "setting": _setting_name(setting),
+        **setting,
+        "avg_retrieval_score": round(float(np.mean(retrieval_scores)), 4),
+        "parent_documents": manifest["parent_documents"],
+        "child_vectors": vectorstore.index.ntotal,
+        "index_size_mb": round(_index_size_bytes() / 1e6, 2),
+        "build_seconds": round(build_seconds, 2),
+        "build_embedding_calls": build_model_calls,
+        "search_latency_p50_ms": round(float(np.percentile(latencies_ms, 50)), 2),
+        "search_latency_p95_ms": round(float(np.percentile(latencies_ms, 95)), 2),
+        "avg_context_tokens": round(float(np.mean(context_tokens))),
+        "index_version": manifest["index_version"],
+    }
+
+def build_grid(args) -> List[Dict[str, int]]:
+    """Every combination of the given values, skipping ones the splitters would reject."""
+    grid = []
+    for parent_size, parent_overlap, child_size, child_overlap in itertools.product(
+            args.parent_sizes, args.parent_overlaps, args.child_sizes, args.child_overlaps):
+        if parent_overlap >= parent_size or child_overlap >= child_size or child_size > parent_size:
+            print(f"⚠️  Skipping parent {parent_size}/{parent_overlap}, child {child_size}/{child_overlap}: "
+                  "overlaps must be smaller than their chunks, and children no larger than parents.")
+            continue
+        grid.append({"parent_chunk_size": parent_size, "parent_chunk_overlap": parent_overlap,
+                     "child_chunk_size": child_size, "child_chunk_overlap": child_overlap})
+    return grid
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep chunking settings and compare retrieval quality against cost.")
+    parser.add_argument("--parent-sizes", type=int, nargs="+", default=[1000, 2000, 3000])
+    parser.add_argument("--parent-overlaps", type=int, nargs="+", default=[config.PARENT_CHUNK_OVERLAP])
+    parser.add_argument("--child-sizes", type=int, nargs="+", default=[200, 400, 800])
+    parser.add_argument("--child-overlaps", type=int, nargs="+", default=[config.CHILD_CHUNK_OVERLAP])
+    parser.add_argument("--workers", type=int, default=2, help="Indexes built at once (each build calls the embedding API).")
+    parser.add_argument("--sweep-dir", default=SWEEP_DIR, help="Parent directory of the per-setting caches.")
+    parser.add_argument("--output", default=SWEEP_RESULTS_PATH)
+    parser.add_argument("--force", action="store_true", help="Rebuild indexes even if they are up to date.")
+    args = parser.parse_args()
+
+    with open(QA_DATASET_PATH, 'r') as f:
+        qa_dataset = json.load(f)
+    grid = build_grid(args)
+    if not grid:
+        print("❌ No valid chunking settings to evaluate.")
+        return
+
+    print(f"--- Sweeping {len(grid)} chunking settings ({args.workers} at a time) ---")
+    results, failures = [], {}
+    # A fresh interpreter per setting: each one rewrites the config module.
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=context, max_tasks_per_child=1) as executor:
+        futures = {executor.submit(evaluate_setting, setting, args.sweep_dir, qa_dataset, args.force): setting for setting in grid}
+        for future in as_completed(futures):
+            name = _setting_name(futures[future])
+            try:
+                results.append(future.result())
+                print(f"✅ {name}: retrieval score {results[-1]['avg_retrieval_score']:.1%}")
+            except Exception as e:
+                failures[name] = str(e)
+                print(f"❌ {name}: {e}")
+
+    current = _setting_name({"parent_chunk_size": config.PARENT_CHUNK_SIZE, "parent_chunk_overlap": config.PARENT_CHUNK_OVERLAP,
+                             "child_chunk_size": config.CHILD_CHUNK_SIZE, "child_chunk_overlap": config.CHILD_CHUNK_OVERLAP})
+    results.sort(key=lambda r: (-r["avg_retrieval_score"], r["avg_context_tokens"]))
+    with open(args.output, 'w') as f:
+        json.dump({"current_setting": current, "results": results, "failures": failures}, f, indent=4)
+
+    if results:
+        table = pd.DataFrame(results).set_index("setting")[[
+            "avg_retrieval_score", "avg_context_tokens", "index_size_mb", "child_vectors",
+            "build_seconds", "search_latency_p50_ms", "search_latency_p95_ms",
+        ]]
+        print("\n" + "="*50 + "\n--- CHUNKING SWEEP RESULTS ---\n" + "="*50)
+        print(table.to_string())
+        print(f"\nCurrent setting in app/config.py: {current}")
+    print(f"\nResults saved to '{args.output}'.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# tests/test_bundles.py
+# Installs hand-made artifact bundles into temporary cache directories and
+# checks that a tampered file, an unsafe member name or other index settings
+# are refused before anything in the cache is replaced.
+
+import io
+import json
+import os
+import tarfile
+
+import pytest
+
+from app import bundles, config, rag_pipeline, utils
+
+CACHE_PATH_SETTINGS = ["CACHE_DIR", "VECTORSTORE_PATH", "DOCSTORE_PATH", "DOC_EMBEDDINGS_PATH", "DOC_EMBEDDINGS_INDEX_PATH",
+                       "ARTIFACT_MANIFEST_PATH", "BUILD_LOCK_PATH", "EMBEDDING_CACHE_PATH", "SHARDS_PATH", "SUMMARIES_PATH"]
+
+@pytest.fixture
+def use_cache_dir(monkeypatch):
+    """Points the artifact paths and the build lock at a directory; restored after the test."""
+    for name in CACHE_PATH_SETTINGS:
+        monkeypatch.setattr(config, name, getattr(config, name))
+
+    def point_at(cache_dir):
+        config.use_cache_dir(str(cache_dir))
+        monkeypatch.setattr(rag_pipeline, "build_lock", utils.InterProcessLock(config.BUILD_LOCK_PATH))
+    return point_at
+
+@pytest.fixture
+def bundle(tmp_path, monkeypatch, use_cache_dir):
+    """Writes fake artifacts to a source cache and bundles them. Returns the bundle path."""
+    source = tmp_path / "source"
+    use_cache_dir(source)
+    os.makedirs(config.VECTORSTORE_PATH)
+    for path, content in [(os.path.join(config.VECTORSTORE_PATH, "index.faiss"), b"faiss" * 100),
+                          (os.path.join(config.VECTORSTORE_PATH, "index.pkl"), b"pickle"),
+                          (config.DOCSTORE_PATH, b"docstore"), (config.DOC_EMBEDDINGS_PATH, b"matrix"),
+                          (config.DOC_EMBEDDINGS_INDEX_PATH, b"[]")]:
+        with open(path, "wb") as f:
+            f.write(content)
+    manifest = {"index_version": "v1", "built_at": "2026-01-01T00:00:00", "topics": 0, **bundles._current_settings()}
+    with open(config.ARTIFACT_MANIFEST_PATH, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    monkeypatch.setattr(rag_pipeline, "build_artifacts", lambda force=False: manifest)
+    # Serve whatever version the bundle has, rather than the local knowledge base's.
+    monkeypatch.setattr(config, "ARTIFACT_BUNDLE_VERSION", "v1")
+
+    path = str(tmp_path / "artifacts.tar.gz")
+    bundles.create_bundle(path)
+    use_cache_dir(tmp_path / "target")
+    return path
+
+def rewrite_bundle(path: str, edit_index=None, edit_files=None) -> str:
+    """Copies a bundle, letting `edit_index` change bundle.json and `edit_files` the other members."""
+    with tarfile.open(path, "r:gz") as tar:
+        members = {member.name: tar.extractfile(member).read() for member in tar.getmembers()}
+    bundle_index = json.loads(members.pop(bundles.BUNDLE_INDEX_NAME))
+    if edit_index:
+        edit_index(bundle_index)
+    if edit_files:
+        edit_files(members)
+    members = {bundles.BUNDLE_INDEX_NAME: json.dumps(bundle_index).encode("utf-8"), **members}
+
+    new_path = path.replace(".tar.gz", "-edited.tar.gz")
+    with tarfile.open(new_path, "w:gz") as tar:
+        for name, content in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return new_path
+
+def test_install_copies_every_artifact(bundle):
+    manifest = bundles.install_bundle(bundle)
+    assert manifest["index_version"] == "v1"
+    assert rag_pipeline._load_manifest()["index_version"] == "v1"
+    with open(config.DOCSTORE_PATH, "rb") as f:
+        assert f.read() == b"docstore"
+
+def test_tampered_file_is_refused(bundle):
+    def tamper(members):
+        members["pdr_docstore.pkl"] = b"DOCSTORE"  # Same size, other content.
+    with pytest.raises(bundles.BundleError, match="integrity"):
+        bundles.install_bundle(rewrite_bundle(bundle, edit_files=tamper))
+    assert not os.path.exists(config.ARTIFACT_MANIFEST_PATH)
+    assert not os.path.exists(config.DOCSTORE_PATH)
+
+def test_parent_directory_member_is_refused(bundle, tmp_path):
+    def add_escape(bundle_index):
+        files = bundle_index["files"]
+        manifest = files.pop("manifest.json")
+        files["../escaped.txt"] = {"sha256": "0" * 64, "bytes": 4}
+        files["manifest.json"] = manifest
+    def add_member(members):
+        members["../escaped.txt"] = b"evil"
+    with pytest.raises(bundles.BundleError, match="unexpected files"):
+        bundles.install_bundle(rewrite_bundle(bundle, edit_index=add_escape, edit_files=add_member))
+    assert not os.path.exists(tmp_path / "escaped.txt")
+    assert not os.path.exists(config.ARTIFACT_MANIFEST_PATH)
+
+def test_settings_hash_mismatch_is_refused(bundle):
+    def change_hash(bundle_index):
+        bundle_index["settings_hash"] = "0" * 16
+    with pytest.raises(bundles.BundleError, match="settings hash"):
+        bundles.install_bundle(rewrite_bundle(bundle, edit_index=change_hash))
+    assert not os.path.exists(config.ARTIFACT_MANIFEST_PATH)
+
+def test_other_index_settings_are_refused(bundle, monkeypatch):
+    monkeypatch.setattr(config, "CHILD_CHUNK_SIZE", config.CHILD_CHUNK_SIZE + 1)
+    with pytest.raises(bundles.BundleError, match="other index settings"):
+        bundles.install_bundle(bundle)
+    assert not os.path.exists(config.ARTIFACT_MANIFEST_PATH)
+
+def test_ensure_installed_skips_hashing_once_installed(bundle, monkeypatch):
+    bundles.install_bundle(bundle)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("the installed bundle was verified again")
+    monkeypatch.setattr(bundles, "_sha256", fail)
+    monkeypatch.setattr(bundles, "install_bundle", fail)
+    assert bundles.ensure_installed(bundle)["index_version"] == "v1"
+
+def test_ensure_installed_installs_another_build(bundle, monkeypatch):
+    bundles.install_bundle(bundle)
+    with open(config.ARTIFACT_MANIFEST_PATH, "w", encoding="utf-8") as f:
+        json.dump({"index_version": "v1", "built_at": "2025-12-31T00:00:00"}, f)
+
+    installs = []
+    install_bundle = bundles.install_bundle
+    monkeypatch.setattr(bundles, "install_bundle", lambda path: installs.append(path) or install_bundle(path))
+    assert bundles.ensure_installed(bundle)["built_at"] == "2026-01-01T00:00:00"
+    assert installs == [bundle]
+    assert rag_pipeline._load_manifest()["built_at"] == "2026-01-01T00:00:00"
@@ -0,0 +1,110 @@
+# tests/test_recommender.py
+# Checks the vectorized recommender against the original per-user loop, which
+# scored one profile at a time with scipy's cosine distance and two passes.
+
+import random
+
+import numpy as np
+import pytest
+from scipy.spatial.distance import cosine
+
+from app import recommender
+
+LIMIT = 4
+
+def reference_recommendations(profile: dict, doc_matrix, topic_ids: list, limit: int = LIMIT) -> list:
+    """The per-user algorithm the recommender replaced."""
+    if not profile or not profile.get("profile_vector"):
+        return []
+    profile_vector = np.array(profile["profile_vector"])
+    consulted_topics = set(profile.get("inferred_interests", []))
+    all_doc_scores = [(1 - cosine(profile_vector, np.array(doc_matrix[i])), topic_id) for i, topic_id in enumerate(topic_ids)]
+    all_doc_scores.sort(key=lambda x: x[0], reverse=True)
+
+    recommendations, seen_topic_ids, seen_parent_topics = [], set(), set()
+    for score, topic_id in all_doc_scores:
+        if len(recommendations) >= limit: break
+        if topic_id in consulted_topics or topic_id in seen_topic_ids: continue
+        parent_topic = recommender.get_parent_topic(topic_id)
+        if parent_topic not in seen_parent_topics:
+            recommendations.append((topic_id, recommender.FIRST_PASS_EXPLANATION))
+            seen_topic_ids.add(topic_id)
+            seen_parent_topics.add(parent_topic)
+    for score, topic_id in all_doc_scores:
+        if len(recommendations) >= limit: break
+        if topic_id not in consulted_topics and topic_id not in seen_topic_ids:
+            recommendations.append((topic_id, recommender.SECOND_PASS_EXPLANATION))
+            seen_topic_ids.add(topic_id)
+    return recommendations
+
+def _topics(num_groups: int, per_group: int) -> list:
+    # `NN_Group-...` IDs share their parent topic ("NN_Group-") within a group;
+    # `NN_NN-...` IDs, like the bundled knowledge base's, are each their own parent.
+    topic_ids = [f"{g:02d}_Group-{i:02d}-Topic" for g in range(num_groups) for i in range(per_group)]
+    return topic_ids + [f"{g:02d}_{g:02d}-Standalone" for g in range(num_groups, num_groups + 3)]
+
+def _as_pairs(recommendations: list) -> list:
+    return [(rec["topic_id"], rec["explanation"]) for rec in recommendations]
+
+@pytest.mark.parametrize("seed", range(20))
+def test_matches_reference_on_random_profiles(seed):
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    topic_ids = _topics(num_groups=rng.randint(1, 4), per_group=rng.randint(1, 4))
+    doc_matrix = np_rng.normal(size=(len(topic_ids), 8))
+    profiles = []
+    for _ in range(10):
+        interests = rng.sample(topic_ids, rng.randint(0, len(topic_ids)))
+        profiles.append({"profile_vector": np_rng.normal(size=8).tolist(), "inferred_interests": interests})
+
+    results = recommender.recommend_for_profiles(profiles, doc_matrix, topic_ids, LIMIT)
+    for profile, result in zip(profiles, results):
+        assert _as_pairs(result) == reference_recommendations(profile, doc_matrix, topic_ids)
+
+def test_ties_keep_topic_order():
+    topic_ids = _topics(num_groups=2, per_group=3)
+    # Every document shares one of two directions, so most scores tie exactly.
+    directions = np.array([[1.0, 0.0, 0.0], [0.5, 0.5, 0.0]])
+    doc_matrix = directions[[i % 2 for i in range(len(topic_ids))]]
+    profiles = [{"profile_vector": [1.0, 0.2, 0.0], "inferred_interests": []},
+                {"profile_vector": [0.5, 0.5, 0.0], "inferred_interests": [topic_ids[1]]}]
+
+    results = recommender.recommend_for_profiles(profiles, doc_matrix, topic_ids, LIMIT)
+    for profile, result in zip(profiles, results):
+        assert _as_pairs(result) == reference_recommendations(profile, doc_matrix, topic_ids)
+
+def test_shared_parent_is_recommended_once_in_first_pass():
+    topic_ids = ["01_Group-01-A", "01_Group-02-B", "01_Group-03-C", "02_02-Other"]
+    doc_matrix = np.array([[1.0, 0.0], [0.99, 0.1], [0.98, 0.2], [0.0, 1.0]])
+    profile = {"profile_vector": [1.0, 0.0], "inferred_interests": []}
+
+    result = _as_pairs(recommender.recommend_for_profiles([profile], doc_matrix, topic_ids, 3)[0])
+    assert result == reference_recommendations(profile, doc_matrix, topic_ids, 3)
+    assert result == [("01_Group-01-A", recommender.FIRST_PASS_EXPLANATION),
+                      ("02_02-Other", recommender.FIRST_PASS_EXPLANATION),
+                      ("01_Group-02-B", recommender.SECOND_PASS_EXPLANATION)]
+
+def test_excluded_interests_are_never_recommended():
+    topic_ids = _topics(num_groups=2, per_group=2)
+    doc_matrix = np.random.default_rng(0).normal(size=(len(topic_ids), 4))
+    # The best match of a group is excluded, so the group's next topic leads the first pass.
+    profile = {"profile_vector": doc_matrix[0].tolist(), "inferred_interests": [topic_ids[0]]}
+    everything = {"profile_vector": doc_matrix[0].tolist(), "inferred_interests": list(topic_ids)}
+
+    results = recommender.recommend_for_profiles([profile, everything], doc_matrix, topic_ids, LIMIT)
+    assert _as_pairs(results[0]) == reference_recommendations(profile, doc_matrix, topic_ids)
+    assert topic_ids[0] not in {rec["topic_id"] for rec in results[0]}
+    assert results[1] == []
+
+def test_mismatched_dimensions_get_no_recommendations():
+    topic_ids = _topics(num_groups=2, per_group=2)
+    doc_matrix = np.random.default_rng(1).normal(size=(len(topic_ids), 4))
+    profiles = [{"profile_vector": [0.1] * 6, "inferred_interests": []},
+                {"profile_vector": doc_matrix[2].tolist(), "inferred_interests": []},
+                {"profile_vector": None}, None]
+
+    results = recommender.recommend_for_profiles(profiles, doc_matrix, topic_ids, LIMIT)
+    assert results[0] == [] and results[2] == [] and results[3] == []
+    assert _as_pairs(results[1]) == reference_recommendations(profiles[1], doc_matrix, topic_ids)
+    assert recommender.dimension_mismatch(profiles[0], doc_matrix)
+    assert not recommender.dimension_mismatch(profiles[1], doc_matrix)